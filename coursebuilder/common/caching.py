@@ -20,9 +20,12 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import collections
 import datetime
 import logging
+import random
 import sys
 import threading
+import time
 import unittest
+import weakref
 
 import appengine_config
 from models.counters import PerfCounter
@@ -125,12 +128,84 @@ class RequestScopedSingleton(AbstractScopedSingleton):
     CONTAINER = _request_scoped_singleton.__dict__
 
 
+class LRUCacheCounters(object):
+    """Performance counters shared by all LRUCache instances of one name."""
+
+    _COUNTERS = {}
+
+    @classmethod
+    def get(cls, name):
+        if name not in cls._COUNTERS:
+            cls._COUNTERS[name] = cls(name)
+        return cls._COUNTERS[name]
+
+    def __init__(self, name):
+        self.hit = PerfCounter(
+            'gcb-caching-%s-lru-hit' % name,
+            'A number of times an object was found in the cache.')
+        self.miss = PerfCounter(
+            'gcb-caching-%s-lru-miss' % name,
+            'A number of times an object was not found in the cache.')
+        self.evict = PerfCounter(
+            'gcb-caching-%s-lru-evict' % name,
+            'A number of times an object was evicted from the cache to make '
+            'room for another one.')
+        self.expire = PerfCounter(
+            'gcb-caching-%s-lru-expire' % name,
+            'A number of times an object has expired from the cache because '
+            'it was too old.')
+        self.hit_ratio = PerfCounter(
+            'gcb-caching-%s-lru-hit-ratio' % name,
+            'A percentage of lookups that found an object in the cache.')
+        self.size_bytes = PerfCounter(
+            'gcb-caching-%s-lru-bytes' % name,
+            'A total size of items in the most recently created cache in '
+            'bytes.')
+        self.hit_ratio.poll_value = self._get_hit_ratio
+        self._cache_ref = None
+        self.size_bytes.poll_value = self._get_size_bytes
+
+    def _get_hit_ratio(self):
+        lookups = self.hit.value + self.miss.value
+        if not lookups:
+            return None
+        return 100 * self.hit.value // lookups
+
+    def _get_size_bytes(self):
+        cache = self._cache_ref() if self._cache_ref else None
+        return cache.total_size if cache else None
+
+    def attach(self, cache):
+        """Makes byte usage report on this cache; older ones are dropped."""
+        self._cache_ref = weakref.ref(cache)
+
+
 class LRUCache(object):
-    """A dict that supports capped size and LRU eviction of items."""
+    """A dict that supports capped size and LRU eviction of items.
+
+    All operations are O(1): items are kept in an OrderedDict in order of
+    access, and the size of each entry is computed once, when it is put, and
+    remembered until the entry leaves the cache.
+    """
 
     def __init__(
         self, max_item_count=None,
-        max_size_bytes=None, max_item_size_bytes=None):
+        max_size_bytes=None, max_item_size_bytes=None, ttl_sec=None,
+        name=None):
+        """Creates a new cache.
+
+        Args:
+          max_item_count: int or None. Maximum number of items to keep.
+          max_size_bytes: int or None. Maximum total size of items to keep.
+          max_item_size_bytes: int or None. Items larger than this are
+              not cached at all.
+          ttl_sec: int or None. Default time to live of items; items older
+              than this are treated as absent. May be overridden for each
+              item in put().
+          name: str or None. If set, hits, misses, evictions, expirations
+              and byte usage of the cache are reported via PerfCounters of
+              this name.
+        """
         assert max_item_count or max_size_bytes
         if max_item_count:
             assert max_item_count > 0
@@ -140,43 +215,59 @@ class LRUCache(object):
         self.max_item_count = max_item_count
         self.max_size_bytes = max_size_bytes
         self.max_item_size_bytes = max_item_size_bytes
+        self.ttl_sec = ttl_sec
         self.items = collections.OrderedDict([])
+        self._sizes = {}
+        self._expires_on = {}
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.expiration_count = 0
+        self._counters = None
+        if name:
+            self._counters = LRUCacheCounters.get(name)
+            self._counters.attach(self)
 
     def get_entry_size(self, key, value):
         """Computes item size. Override and compute properly for your items."""
         return sys.getsizeof(key) + sys.getsizeof(value)
 
     def _compute_current_size(self):
-        total = 0
-        for key, item in self.items.iteritems():
-            total += sys.getsizeof(key) + self.get_item_size(item)
-        return total
+        """Recomputes total size from scratch; for debugging and tests."""
+        return sum([
+            self.get_entry_size(key, value)
+            for key, value in self.items.iteritems()])
+
+    def _remove(self, key):
+        del self.items[key]
+        self.total_size -= self._sizes.pop(key)
+        self._expires_on.pop(key, None)
+        assert self.total_size >= 0
+
+    def _is_full(self, entry_size):
+        if self.max_item_count and len(self.items) >= self.max_item_count:
+            return True
+        if (self.max_size_bytes and
+            self.total_size + entry_size >= self.max_size_bytes):
+            return True
+        return False
 
-    def _allocate_space(self, key, value):
-        """Remove items in FIFO order until size constraints are met."""
-        entry_size = self.get_entry_size(key, value)
+    def _allocate_space(self, entry_size):
+        """Remove items in LRU order until size constraints are met."""
         if self.max_item_size_bytes and entry_size > self.max_item_size_bytes:
             return False
-        while True:
-            over_count = False
-            over_size = False
-            if self.max_item_count:
-                over_count = len(self.items) >= self.max_item_count
-            if self.max_size_bytes:
-                over_size = self.total_size + entry_size >= self.max_size_bytes
-            if not (over_count or over_size):
-                if self.max_size_bytes:
-                    self.total_size += entry_size
-                    assert self.total_size < self.max_size_bytes
-                return True
-            if self.items:
-                _key, _value = self.items.popitem(last=False)
-                if self.max_size_bytes:
-                    self.total_size -= self.get_entry_size(_key, _value)
-                    assert self.total_size >= 0
-            else:
-                break
-        return False
+        while self.items and self._is_full(entry_size):
+            key = next(iter(self.items))
+            self._remove(key)
+            self.eviction_count += 1
+            if self._counters:
+                self._counters.evict.inc()
+        return not self._is_full(entry_size)
+
+    def _has_expired(self, key):
+        expires_on = self._expires_on.get(key)
+        return expires_on is not None and expires_on < time.time()
 
     def _record_access(self, key):
         """Pop and re-add the item."""
@@ -186,30 +277,61 @@ class LRUCache(object):
     def contains(self, key):
         """Checks if item is contained without accessing it."""
         assert key
-        return key in self.items
+        return key in self.items and not self._has_expired(key)
 
-    def put(self, key, value):
+    def put(self, key, value, ttl_sec=None):
+        """Puts item; returns False if it can't fit even in an empty cache."""
         assert key
-        if self._allocate_space(key, value):
-            self.items[key] = value
-            return True
-        return False
+        if key in self.items:
+            self._remove(key)
+        entry_size = self.get_entry_size(key, value)
+        if not self._allocate_space(entry_size):
+            return False
+        self.items[key] = value
+        self._sizes[key] = entry_size
+        self.total_size += entry_size
+        ttl_sec = ttl_sec or self.ttl_sec
+        if ttl_sec:
+            self._expires_on[key] = time.time() + ttl_sec
+        return True
 
     def get(self, key):
         """Accessing item makes it less likely to be evicted."""
         assert key
         if key in self.items:
-            self._record_access(key)
-            return True, self.items[key]
+            if not self._has_expired(key):
+                self._record_access(key)
+                self.hit_count += 1
+                if self._counters:
+                    self._counters.hit.inc()
+                return True, self.items[key]
+            self._remove(key)
+            self.expiration_count += 1
+            if self._counters:
+                self._counters.expire.inc()
+        self.miss_count += 1
+        if self._counters:
+            self._counters.miss.inc()
         return False, None
 
     def delete(self, key):
         assert key
         if key in self.items:
-            del self.items[key]
+            self._remove(key)
             return True
         return False
 
+    def clear(self):
+        self.items.clear()
+        self._sizes.clear()
+        self._expires_on.clear()
+        self.total_size = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hit_count + self.miss_count
+        return float(self.hit_count) / lookups if lookups else 0.0
+
 
 class NoopCacheConnection(object):
     """Connection to no-op cache that provides no caching."""
@@ -227,7 +349,8 @@ class NoopCacheConnection(object):
 class AbstractCacheEntry(object):
     """Object representation while in cache."""
 
-    # we don't track deletions; deleted item will hang around this long
+    # unless the connection has a TOMBSTONE_ENTITY, we don't track deletions;
+    # deleted item will hang around this long
     CACHE_ENTRY_TTL_SEC = 5 * 60
 
     @classmethod
@@ -253,10 +376,41 @@ class AbstractCacheEntry(object):
         raise NotImplementedError()
 
 
+class CacheNamespaceIndex(object):
+    """Tracks which entries of one namespace are in a cache, and how recent.
+
+    Maintained on put() and delete() of the connection, so that finding the
+    most recently updated entry does not require scanning the whole cache.
+    Entries evicted by the cache itself are dropped lazily from the key set.
+    Deleted objects leave the cache, so the most recent deletion seen is
+    tracked separately.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.max_updated_on = datetime.datetime.fromtimestamp(0)
+        self.max_deleted_on = datetime.datetime.fromtimestamp(0)
+        self.synced_on = None
+
+
 class AbstractCacheConnection(object):
 
     PERSISTENT_ENTITY = None
     CACHE_ENTRY = None
+    NAMESPACE_INDEX = CacheNamespaceIndex
+
+    # An entity kind with an indexed 'updated_on' property, whose entities are
+    # keyed as PERSISTENT_ENTITY and mark the deletion of one of those.
+    TOMBSTONE_ENTITY = None
+
+    # Minimum number of seconds between two queries for updates to the
+    # persistent entities of one namespace; 0 to query on every connection.
+    # Only set this if all changes made in this process are applied to the
+    # cache directly, as otherwise they will not be seen for this long.
+    RESYNC_INTERVAL_SEC = 0
+
+    # Maps each cache to {namespace: NAMESPACE_INDEX}.
+    _NAMESPACE_INDEXES = weakref.WeakKeyDictionary()
 
     @classmethod
     def init_counters(cls):
@@ -326,6 +480,33 @@ class AbstractCacheConnection(object):
         appengine_config.log_appstats_event(
             '%s.connect' % self.__class__.__name__, {'namespace': namespace})
 
+    def _get_namespace_index(self):
+        indexes = self._NAMESPACE_INDEXES.get(self.cache)
+        if indexes is None:
+            indexes = {}
+            self._NAMESPACE_INDEXES[self.cache] = indexes
+        index = indexes.get(self.namespace)
+        if index is None:
+            index = self.NAMESPACE_INDEX()
+            indexes[self.namespace] = index
+        return index
+
+    def _index_put(self, _key, entry):
+        index = self._get_namespace_index()
+        index.keys.add(_key)
+        if not entry:
+            return
+        updated_on = entry.updated_on()
+        if updated_on and updated_on > index.max_updated_on:
+            index.max_updated_on = updated_on
+
+    def _index_delete(self, _key):
+        self._get_namespace_index().keys.discard(_key)
+
+    def _cache_delete(self, _key):
+        self.cache.delete(_key)
+        self._index_delete(_key)
+
     def apply_updates(self, updates):
         """Applies a list of global changes to the local cache."""
         self.CACHE_RESYNC.inc()
@@ -333,37 +514,36 @@ class AbstractCacheConnection(object):
             _key = self.make_key(self.namespace, key)
             found, entry = self.cache.get(_key)
             if not found:
+                self._index_delete(_key)
                 continue
             if entry is None:
                 self.CACHE_EVICT.inc()
-                self.cache.delete(_key)
+                self._cache_delete(_key)
                 continue
             if not entry.is_up_to_date(key, update):
                 self.CACHE_EVICT.inc()
-                self.cache.delete(_key)
+                self._cache_delete(_key)
                 continue
             if entry.has_expired():
                 self.CACHE_EXPIRE.inc()
-                self.cache.delete(_key)
+                self._cache_delete(_key)
                 continue
 
     def _get_most_recent_updated_on(self):
         """Get the most recent item cached. Datastore deletions are missed..."""
-        has_items = False
-        max_updated_on = datetime.datetime.fromtimestamp(0)
-        prefix = self.make_key_prefix(self.namespace)
-        for key, entry in self.cache.items.iteritems():
-            if not key.startswith(prefix):
-                continue
-            has_items = True
-            if not entry:
-                continue
-            updated_on = entry.updated_on()
-            if not updated_on:  # old entities may be missing this field
-                updated_on = datetime.datetime.fromtimestamp(0)
-            if updated_on > max_updated_on:
-                max_updated_on = updated_on
-        return has_items, max_updated_on
+        index = self._get_namespace_index()
+
+        # Drop keys of items the cache has evicted on its own; each such key
+        # is looked at only once, so this is cheap over time.
+        while index.keys:
+            _key = next(iter(index.keys))
+            if self.cache.contains(_key):
+                return True, index.max_updated_on
+            index.keys.discard(_key)
+
+        index.max_updated_on = datetime.datetime.fromtimestamp(0)
+        index.max_deleted_on = index.max_updated_on
+        return False, index.max_updated_on
 
     def get_updates_when_empty(self):
         """Override this method to pre-load cache when it's completely empty."""
@@ -376,28 +556,51 @@ class AbstractCacheConnection(object):
         we have cached so far. This will bring all objects that have changed or
         were created since that time.
 
-        This will NOT bring the notifications about object deletions. Thus cache
-        will continue to serve deleted objects until they expire.
+        This will NOT bring the notifications about object deletions, unless
+        TOMBSTONE_ENTITY is set. Otherwise cache will continue to serve deleted
+        objects until they expire.
 
         Returns:
-          a dict of {key: update} objects that represent recent updates
+          a dict of {key: update} objects that represent recent updates; the
+          update is None for objects that were deleted
         """
         has_items, updated_on = self._get_most_recent_updated_on()
         if not has_items:
             return self.get_updates_when_empty()
+
+        index = self._get_namespace_index()
+        now = time.time()
+        if (self.RESYNC_INTERVAL_SEC and index.synced_on and
+            now - index.synced_on < self.RESYNC_INTERVAL_SEC):
+            return {}
+        index.synced_on = now
+
         q = self.PERSISTENT_ENTITY.all()
         if updated_on:
             q.filter('updated_on > ', updated_on)
         result = {
             entity.key().name(): entity for entity in iter_all(q)}
+        if self.TOMBSTONE_ENTITY:
+            # Tombstones already seen are not fetched again, even if they are
+            # newer than all of the objects cached.
+            q = self.TOMBSTONE_ENTITY.all()
+            q.filter('updated_on > ', max(updated_on, index.max_deleted_on))
+            for tombstone in iter_all(q):
+                key = tombstone.key().name()
+                entity = result.get(key)
+                if not entity or entity.updated_on < tombstone.updated_on:
+                    result[key] = None
+                index.max_deleted_on = max(
+                    index.max_deleted_on, tombstone.updated_on)
         self.CACHE_UPDATE_COUNT.inc(len(result.keys()))
         return result
 
     def put(self, key, *args):
         self.CACHE_PUT.inc()
-        self.cache.put(
-            self.make_key(self.namespace, key),
-            self.CACHE_ENTRY.internalize(key, *args))
+        _key = self.make_key(self.namespace, key)
+        entry = self.CACHE_ENTRY.internalize(key, *args)
+        if self.cache.put(_key, entry):
+            self._index_put(_key, entry)
 
     def get(self, key):
         self.CACHE_GET.inc()
@@ -411,14 +614,14 @@ class AbstractCacheConnection(object):
             return True, None
         if entry.has_expired():
             self.CACHE_EXPIRE.inc()
-            self.cache.delete(_key)
+            self._cache_delete(_key)
             return False, None
         self.CACHE_HIT.inc()
         return True, self.CACHE_ENTRY.externalize(key, entry)
 
     def delete(self, key):
         self.CACHE_DELETE.inc()
-        self.cache.delete(self.make_key(self.namespace, key))
+        self._cache_delete(self.make_key(self.namespace, key))
 
 
 class LRUCacheTests(unittest.TestCase):
@@ -489,6 +692,73 @@ class LRUCacheTests(unittest.TestCase):
         self.assertTrue(found)
 
 
+    def test_delete_releases_space(self):
+        cache = LRUCache(max_size_bytes=5000)
+        self.assertTrue(cache.put('a', bytearray(1000)))
+        self.assertTrue(cache.put('b', bytearray(1000)))
+        self.assertTrue(cache.delete('a'))
+        self.assertFalse(cache.delete('a'))
+        self.assertEquals(cache._compute_current_size(), cache.total_size)
+        for unused in xrange(100):
+            self.assertTrue(cache.put('a', bytearray(1000)))
+            self.assertTrue(cache.delete('a'))
+        self.assertTrue(cache.contains('b'))
+        cache.delete('b')
+        self.assertEquals(0, cache.total_size)
+
+    def test_put_replaces_existing_item(self):
+        cache = LRUCache(max_size_bytes=5000)
+        self.assertTrue(cache.put('a', bytearray(1000)))
+        self.assertTrue(cache.put('b', '2'))
+        for unused in xrange(100):
+            self.assertTrue(cache.put('a', bytearray(1000)))
+        self.assertTrue(cache.contains('b'))
+        self.assertEquals(cache._compute_current_size(), cache.total_size)
+
+    def test_eviction_keeps_size(self):
+        cache = LRUCache(max_size_bytes=5000)
+        for index in xrange(100):
+            self.assertTrue(cache.put(str(index), bytearray(index * 10)))
+            self.assertLess(cache.total_size, cache.max_size_bytes)
+            self.assertEquals(
+                cache._compute_current_size(), cache.total_size)
+        self.assertTrue(cache.contains('99'))
+        self.assertFalse(cache.contains('0'))
+        self.assertGreater(cache.eviction_count, 0)
+
+    def test_ttl(self):
+        now = [1000.0]
+        cache = LRUCache(max_item_count=10, ttl_sec=10)
+        original_time = time.time
+        time.time = lambda: now[0]
+        try:
+            cache.put('a', '1')
+            cache.put('b', '2', ttl_sec=100)
+            now[0] += 11
+            self.assertFalse(cache.contains('a'))
+            self.assertEquals((False, None), cache.get('a'))
+            self.assertEquals((True, '2'), cache.get('b'))
+            self.assertEquals(1, cache.expiration_count)
+            self.assertEquals(cache._compute_current_size(), cache.total_size)
+        finally:
+            time.time = original_time
+
+    def test_hit_ratio(self):
+        cache = LRUCache(max_item_count=10)
+        self.assertEquals(0.0, cache.hit_ratio)
+        cache.put('a', '1')
+        cache.get('a')
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEquals(0.75, cache.hit_ratio)
+
+    def test_benchmark(self):
+        stats = benchmark_lru_cache(num_ops=2000, max_size_bytes=64 * 1024)
+        self.assertGreater(stats['hit_ratio'], 0)
+        self.assertGreater(stats['evictions'], 0)
+
+
 class SingletonTests(unittest.TestCase):
 
     def test_singleton(self):
@@ -543,6 +813,61 @@ class SingletonTests(unittest.TestCase):
         assert b is not d
 
 
+def benchmark_lru_cache(
+    num_ops=200 * 1000, num_files=5000, max_size_bytes=16 * 1024 * 1024,
+    max_item_size_bytes=256 * 1024, seed=0):
+    """Stresses LRUCache the way the VFS cache uses it; returns stats.
+
+    Files are fetched with a skewed distribution: most requests hit a few
+    popular small files (templates, course.yaml), and some hit large files
+    that push others out. About one operation in ten updates a file, and
+    one in a hundred deletes one, as happens when content is edited.
+
+    Run as: python -m common.caching --benchmark
+    """
+    rnd = random.Random(seed)
+    cache = LRUCache(
+        max_size_bytes=max_size_bytes, max_item_size_bytes=max_item_size_bytes)
+
+    def file_size(index):
+        if index % 50 == 0:
+            return max_item_size_bytes // 2
+        return 256 + (index * 7919) % 16384
+
+    def pick_file():
+        return int(num_files * rnd.random() ** 3)
+
+    bodies = dict(
+        (size, bytearray(size))
+        for size in set(file_size(index) for index in xrange(num_files)))
+    keys = [
+        'VfsCacheConnection:ns_%d:/data/file_%d' % (index % 7, index)
+        for index in xrange(num_files)]
+
+    start = time.time()
+    for unused in xrange(num_ops):
+        index = pick_file()
+        key = keys[index]
+        dice = rnd.random()
+        if dice < 0.01:
+            cache.delete(key)
+        elif dice < 0.1:
+            cache.put(key, bodies[file_size(index)])
+        else:
+            found, _ = cache.get(key)
+            if not found:
+                cache.put(key, bodies[file_size(index)])
+    elapsed = time.time() - start
+
+    assert cache.total_size == cache._compute_current_size()
+    return {
+        'ops_per_sec': num_ops / elapsed if elapsed else None,
+        'hit_ratio': cache.hit_ratio,
+        'evictions': cache.eviction_count,
+        'items': len(cache.items),
+        'total_size': cache.total_size}
+
+
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
     suites_list = []
@@ -553,4 +878,8 @@ def run_all_unit_tests():
 
 
 if __name__ == '__main__':
-    run_all_unit_tests()
+    if '--benchmark' in sys.argv:
+        for stat_name, stat_value in sorted(benchmark_lru_cache().items()):
+            print '%s: %s' % (stat_name, stat_value)
+    else:
+        run_all_unit_tests()
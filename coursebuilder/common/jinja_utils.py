@@ -116,7 +116,7 @@ class ProcessScopedJinjaCache(caching.ProcessScopedSingleton):
 
     def __init__(self):
         self.cache = caching.LRUCache(
-            max_size_bytes=MAX_GLOBAL_CACHE_SIZE_BYTES)
+            max_size_bytes=MAX_GLOBAL_CACHE_SIZE_BYTES, name='jinja')
         self.cache.get_entry_size = self._get_entry_size
 
     def _get_entry_size(self, key, value):
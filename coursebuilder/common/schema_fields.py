@@ -453,7 +453,7 @@ class FieldRegistry(Registry):
     @classmethod
     def _get_field_value(cls, key_part_list, entity, default):
         if len(key_part_list) == 1:
-            if type(entity) == dict and entity.has_key(key_part_list[0]):
+            if isinstance(entity, dict) and entity.has_key(key_part_list[0]):
                 return entity[key_part_list[0]]
             return default
         key = key_part_list.pop()
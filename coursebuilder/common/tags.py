@@ -17,10 +17,13 @@
 __author__ = 'John Orr (jorr@google.com)'
 
 
+import copy
+import hashlib
 import logging
 import mimetypes
 import os
 import re
+import sys
 from xml.etree import cElementTree
 
 import html5lib
@@ -29,6 +32,7 @@ import webapp2
 
 import appengine_config
 
+from common import caching
 from common import messages
 from common import schema_fields
 from models import config
@@ -47,6 +51,10 @@ CAN_USE_DYNAMIC_TAGS = config.ConfigProperty(
     default_value=True, label='Dynamic Tags')
 
 
+# Rendered content shared by all the students is cached in process up to this
+# size; see html_to_safe_dom().
+MAX_RENDER_CACHE_SIZE_BYTES = 8 * 1024 * 1024
+
 DUPLICATE_INSTANCE_ID_MESSAGE = (
     'Error processing custom HTML tag: duplicate tag id')
 INVALID_HTML_TAG_MESSAGE = 'Invalid HTML tag'
@@ -73,6 +81,18 @@ class BaseTag(object):
         """Returns a list of JS files to be loaded in the editor lightbox."""
         return []
 
+    @classmethod
+    def is_student_dependent(cls):
+        """Tells whether render() output may differ between page views.
+
+        The rendered output of tags that return False here is computed once
+        per content, locale and course and shared by all students; only tags
+        that return True are rendered on every page view.  The default is
+        True, so a tag must opt in to sharing by overriding this to return
+        False when its output depends on nothing but the tag node itself.
+        """
+        return True
+
     @classmethod
     def extra_css_files(cls):
         """Returns a list of CSS files to be loaded in the editor lightbox."""
@@ -332,16 +352,26 @@ class Registry(object):
 
     _bindings = {}
 
+    # Incremented on every change of the bindings; content rendered under one
+    # version is not reused under another.
+    _version = 0
+
     @classmethod
     def add_tag_binding(cls, tag_name, clazz):
         """Registers a tag name to class binding."""
         cls._bindings[tag_name] = clazz
+        cls._version += 1
 
     @classmethod
     def remove_tag_binding(cls, tag_name):
         """Unregisters a tag binding."""
         if tag_name in cls._bindings:
             del cls._bindings[tag_name]
+            cls._version += 1
+
+    @classmethod
+    def get_version(cls):
+        return cls._version
 
     @classmethod
     def get_all_tags(cls):
@@ -364,33 +394,103 @@ def html_string_to_element_tree(html_string, is_fragment=True):
         return parser.parse(html_string)
 
 
-def html_to_safe_dom(html_string, handler, render_custom_tags=True,
-                     tags_filter=None):
-    """Render HTML text as a tree of safe_dom elements."""
+class ProcessScopedRenderCache(caching.ProcessScopedSingleton):
+    """Holds content rendered by html_to_safe_dom() for reuse across requests.
+    """
 
-    tag_bindings = get_tag_bindings()
-    if tags_filter:
+    def __init__(self):
+        self.cache = caching.LRUCache(
+            max_size_bytes=MAX_RENDER_CACHE_SIZE_BYTES, name='tags-render')
+        self.cache.get_entry_size = self._get_entry_size
 
-        class SuppressedTag(BaseTag):
+    def _get_entry_size(self, key, value):
+        return sys.getsizeof(key) + value.size
 
-            def render(self, node, context):
-                return cElementTree.XML('<div style="display:none;"></div>')
 
-        for name, cls in tag_bindings.iteritems():
-            if not tags_filter(name, cls):
-                tag_bindings[name] = SuppressedTag
+class _SanitizedHtml(safe_dom.Node):
+    """Holds markup which has already been sanitized by safe_dom."""
 
-    node_list = safe_dom.NodeList()
-    if not html_string:
+    def __init__(self, sanitized_html):
+        super(_SanitizedHtml, self).__init__()
+        self._sanitized_html = sanitized_html
+
+    @property
+    def sanitized(self):
+        return self._sanitized_html
+
+
+class _TagPlaceholder(safe_dom.Node):
+    """Marks the position of a tag whose rendering has been deferred.
+
+    The marker is delimited by NUL characters, which html5lib never lets
+    through from parsed content, so it can't collide with page text.
+    """
+
+    MARKER_PATTERN = re.compile(u'\x00([0-9]+)\x00')
+
+    def __init__(self, index):
+        super(_TagPlaceholder, self).__init__()
+        self._index = index
+
+    @property
+    def sanitized(self):
+        return u'\x00%s\x00' % self._index
+
+
+class _RenderedContent(object):
+    """Sanitized markup of content, with holes for student-dependent tags."""
+
+    def __init__(self, node_list, deferred_elts):
+        parts = _TagPlaceholder.MARKER_PATTERN.split(node_list.sanitized)
+        self.static_parts = parts[0::2]
+        self.deferred_elts = [deferred_elts[int(index)]
+                              for index in parts[1::2]]
+        self.size = sum([sys.getsizeof(part) for part in self.static_parts])
+        self.size += sum([
+            len(cElementTree.tostring(elt)) for elt in self.deferred_elts])
+
+    def expand(self, handler, tag_bindings):
+        """Renders deferred tags for this handler between the static parts."""
+        renderer = _HtmlTreeRenderer(handler, tag_bindings)
+        node_list = safe_dom.NodeList()
+        node_list.append(_SanitizedHtml(self.static_parts[0]))
+        for elt, static_part in zip(
+            self.deferred_elts, self.static_parts[1:]):
+            # Tags may modify the node they render; keep ours pristine.
+            node_list.append(renderer.process_html_tree(copy.deepcopy(elt)))
+            node_list.append(_SanitizedHtml(static_part))
+        renderer.rollup_header_footer(node_list)
         return node_list
 
-    # Set of all instance id's used in this dom tree, used to detect duplication
-    used_instance_ids = set([])
-    # A dictionary of environments, one for each tag type which appears in the
-    # page
-    tag_contexts = {}
 
-    def _generate_error_message_node_list(elt, error_message):
+class _HtmlTreeRenderer(object):
+    """Converts an html5lib element tree into safe_dom, rendering custom tags.
+    """
+
+    def __init__(self, handler, tag_bindings, render_custom_tags=True,
+                 deferred_elts=None):
+        """Initializes the renderer.
+
+        Args:
+            handler: controllers.utils.BaseHandler. The server runtime.
+            tag_bindings: dict. Maps tag names to BaseTag subclasses.
+            render_custom_tags: bool. Whether to render custom tags at all.
+            deferred_elts: list or None. If a list, student-dependent tags are
+                not rendered; each is appended to this list instead, and a
+                _TagPlaceholder holding its index is put in its place.
+        """
+        self._handler = handler
+        self._tag_bindings = tag_bindings
+        self._render_custom_tags = render_custom_tags
+        self._deferred_elts = deferred_elts
+        # Set of all instance id's used in this dom tree, used to detect
+        # duplication
+        self._used_instance_ids = set([])
+        # A dictionary of environments, one for each tag type which appears in
+        # the page
+        self._tag_contexts = {}
+
+    def _generate_error_message_node_list(self, elt, error_message):
         """Generates a node_list representing an error message."""
         logging.error(
             '[%s, %s]: %s.', elt.tag, dict(**elt.attrib), error_message)
@@ -404,55 +504,75 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True,
             node_list.append(safe_dom.Text(elt.tail))
         return node_list
 
+    @staticmethod
     def _remove_namespace(tag_name):
         # Remove any namespacing which html5lib may have introduced. Html5lib
         # namespacing is of the form, e.g.,
         #     {http://www.w3.org/2000/svg}svg
         return re.sub(r'^\{[^\}]+\}', '', tag_name, count=1)
 
-    def _process_html_tree(elt):
+    def _is_deferred(self, elt):
+        return (
+            self._deferred_elts is not None and self._render_custom_tags and
+            elt.tag in self._tag_bindings and
+            self._tag_bindings[elt.tag].is_student_dependent())
+
+    def _defer(self, elt):
+        """Replaces the tag with a placeholder; its tail text stays static."""
+        node_list = safe_dom.NodeList()
+        node_list.append(_TagPlaceholder(len(self._deferred_elts)))
+        if elt.tail:
+            node_list.append(safe_dom.Text(elt.tail))
+        elt.tail = None
+        self._deferred_elts.append(elt)
+        return node_list
+
+    def process_html_tree(self, elt):
         """Recursively parses an HTML tree into a safe_dom.NodeList()."""
         # Return immediately with an error message if a duplicate instanceid is
         # detected.
         if 'instanceid' in elt.attrib:
-            if elt.attrib['instanceid'] in used_instance_ids:
-                return _generate_error_message_node_list(
+            if elt.attrib['instanceid'] in self._used_instance_ids:
+                return self._generate_error_message_node_list(
                     elt, DUPLICATE_INSTANCE_ID_MESSAGE)
 
-            used_instance_ids.add(elt.attrib['instanceid'])
+            self._used_instance_ids.add(elt.attrib['instanceid'])
+
+        if self._is_deferred(elt):
+            return self._defer(elt)
 
         # Otherwise, attempt to parse this tag and all its child tags.
         original_elt = elt
         try:
-            if render_custom_tags and elt.tag in tag_bindings:
-                tag = tag_bindings[elt.tag]()
+            if self._render_custom_tags and elt.tag in self._tag_bindings:
+                tag = self._tag_bindings[elt.tag]()
                 if isinstance(tag, ContextAwareTag):
                     # Get or initialize a environment dict for this type of tag.
                     # Each tag type gets a separate environment shared by all
                     # instances of that tag.
-                    context = tag_contexts.get(elt.tag)
+                    context = self._tag_contexts.get(elt.tag)
                     if context is None:
-                        context = ContextAwareTag.Context(handler, {})
-                        tag_contexts[elt.tag] = context
+                        context = ContextAwareTag.Context(self._handler, {})
+                        self._tag_contexts[elt.tag] = context
                     # Render the tag
                     elt = tag.render(elt, context)
                 else:
                     # Render the tag
-                    elt = tag.render(elt, handler)
+                    elt = tag.render(elt, self._handler)
 
             if elt.tag == cElementTree.Comment:
                 out_elt = safe_dom.Comment()
             elif elt.tag.lower() == 'script':
                 out_elt = safe_dom.ScriptElement()
             else:
-                out_elt = safe_dom.Element(_remove_namespace(elt.tag))
+                out_elt = safe_dom.Element(self._remove_namespace(elt.tag))
             out_elt.add_attribute(**elt.attrib)
 
             if elt.text:
                 out_elt.add_text(elt.text)
             for child in elt:
                 out_elt.add_children(
-                    _process_html_tree(child))
+                    self.process_html_tree(child))
 
             node_list = safe_dom.NodeList()
             node_list.append(out_elt)
@@ -462,24 +582,89 @@ def html_to_safe_dom(html_string, handler, render_custom_tags=True,
 
         except Exception as e:  # pylint: disable=broad-except
             logging.exception('Error handling tag: %s', elt.tag)
-            return _generate_error_message_node_list(
+            return self._generate_error_message_node_list(
                 original_elt, '%s: %s' % (INVALID_HTML_TAG_MESSAGE, e))
 
-    root = html_string_to_element_tree(html_string)
-    if root.text:
-        node_list.append(safe_dom.Text(root.text))
+    def process_root(self, root, node_list):
+        if root.text:
+            node_list.append(safe_dom.Text(root.text))
+
+        for child_elt in root:
+            node_list.append(self.process_html_tree(child_elt))
+
+    def rollup_header_footer(self, node_list):
+        # After the page is processed, rollup any global header/footer data
+        # which the environment-aware tags have accumulated in their env's
+        for tag_name, context in self._tag_contexts.items():
+            header, footer = self._tag_bindings[tag_name](
+                ).rollup_header_footer(context)
+            node_list.insert(0, self.process_html_tree(header))
+            node_list.append(self.process_html_tree(footer))
+
+
+def _make_render_cache_key(html_string, handler):
+    """Returns the key of rendered content in the cache, or None if uncached.
+    """
+    app_context = getattr(handler, 'app_context', None)
+    if not app_context:
+        return None
+    content_hash = hashlib.sha1(
+        html_string.encode('utf-8') if isinstance(html_string, unicode)
+        else html_string).hexdigest()
+    return '%s:%s:%s:%s' % (
+        app_context.get_namespace_name(), app_context.get_current_locale(),
+        Registry.get_version(), content_hash)
+
+
+def html_to_safe_dom(html_string, handler, render_custom_tags=True,
+                     tags_filter=None):
+    """Render HTML text as a tree of safe_dom elements.
+
+    When rendering for a course, everything but the student-dependent tags is
+    rendered once and cached in process, keyed by the hash of the content,
+    the course, the locale and the version of the tag registry; later calls
+    only render the student-dependent tags.
+    """
+
+    tag_bindings = get_tag_bindings()
+    if tags_filter:
+
+        class SuppressedTag(BaseTag):
+
+            def render(self, node, context):
+                return cElementTree.XML('<div style="display:none;"></div>')
+
+        for name, cls in tag_bindings.iteritems():
+            if not tags_filter(name, cls):
+                tag_bindings[name] = SuppressedTag
 
-    for child_elt in root:
-        node_list.append(_process_html_tree(child_elt))
+    node_list = safe_dom.NodeList()
+    if not html_string:
+        return node_list
 
-    # After the page is processed, rollup any global header/footer data which
-    # the environment-aware tags have accumulated in their env's
-    for tag_name, context in tag_contexts.items():
-        header, footer = tag_bindings[tag_name]().rollup_header_footer(context)
-        node_list.insert(0, _process_html_tree(header))
-        node_list.append(_process_html_tree(footer))
+    cache_key = None
+    if render_custom_tags and not tags_filter:
+        cache_key = _make_render_cache_key(html_string, handler)
+    if not cache_key:
+        renderer = _HtmlTreeRenderer(
+            handler, tag_bindings, render_custom_tags=render_custom_tags)
+        renderer.process_root(
+            html_string_to_element_tree(html_string), node_list)
+        renderer.rollup_header_footer(node_list)
+        return node_list
 
-    return node_list
+    cache = ProcessScopedRenderCache.instance().cache
+    found, rendered = cache.get(cache_key)
+    if not found:
+        deferred_elts = []
+        renderer = _HtmlTreeRenderer(
+            handler, tag_bindings, deferred_elts=deferred_elts)
+        renderer.process_root(
+            html_string_to_element_tree(html_string), node_list)
+        renderer.rollup_header_footer(node_list)
+        rendered = _RenderedContent(node_list, deferred_elts)
+        cache.put(cache_key, rendered)
+    return rendered.expand(handler, tag_bindings)
 
 
 def get_components_from_html(html, use_lxml=_LXML_AVAILABLE):
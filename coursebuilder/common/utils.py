@@ -16,6 +16,7 @@
 
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
+import copy
 import cStringIO
 import datetime
 import logging
@@ -84,6 +85,121 @@ def run_hooks(hooks, *args, **kwargs):
         hook(*args, **kwargs)
 
 
+class CopyOnWriteDict(dict):
+    """A dict sharing the values of another dict until they may be modified.
+
+    Creating one copies only the top level of the original dict. Values that
+    are not of an immutable type stay shared with the original until they are
+    first read, at which point they are replaced by a deep copy; changes made
+    through this dict, or through the values it hands out, never reach the
+    original. Bulk reads such as items() copy all shared values. Note that
+    readers using the dict C API directly, such as dict(), see the shared
+    values; these must not be modified.
+    """
+
+    __slots__ = ('_shared_keys',)
+
+    _IMMUTABLE_TYPES = (
+        type(None), basestring, int, long, float, datetime.date,
+        datetime.time, datetime.timedelta)
+
+    def __init__(self, original):
+        super(CopyOnWriteDict, self).__init__(original)
+        self._shared_keys = set([
+            key for key, value in dict.iteritems(self)
+            if not isinstance(value, self._IMMUTABLE_TYPES)])
+
+    def _own(self, key):
+        if key in self._shared_keys:
+            self._shared_keys.discard(key)
+            dict.__setitem__(
+                self, key, copy.deepcopy(dict.__getitem__(self, key)))
+
+    def _own_all(self):
+        for key in list(self._shared_keys):
+            self._own(key)
+
+    def __getitem__(self, key):
+        self._own(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._shared_keys.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._shared_keys.discard(key)
+        dict.__delitem__(self, key)
+
+    def __copy__(self):
+        return CopyOnWriteDict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(dict.iteritems(self)), memo)
+
+    def __reduce_ex__(self, unused_protocol):
+        return (dict, (dict(dict.iteritems(self)),))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        self._own(key)
+        self._shared_keys.discard(key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if key in self._shared_keys:
+            self._shared_keys.discard(key)
+            value = copy.deepcopy(value)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        if args and isinstance(args[0], CopyOnWriteDict):
+            args = (args[0].items(),) + args[1:]
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        self._shared_keys.clear()
+        dict.clear(self)
+
+    def copy(self):
+        return CopyOnWriteDict(self)
+
+    def items(self):
+        self._own_all()
+        return dict.items(self)
+
+    def iteritems(self):
+        self._own_all()
+        return dict.iteritems(self)
+
+    def values(self):
+        self._own_all()
+        return dict.values(self)
+
+    def itervalues(self):
+        self._own_all()
+        return dict.itervalues(self)
+
+    def viewitems(self):
+        self._own_all()
+        return dict.viewitems(self)
+
+    def viewvalues(self):
+        self._own_all()
+        return dict.viewvalues(self)
+
+
 class Namespace(object):
     """Save current namespace and reset it.
 
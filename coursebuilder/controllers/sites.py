@@ -104,6 +104,7 @@ not hosting multiple courses, your course will run in a default namespace
 Good luck!
 """
 
+import calendar
 import logging
 import mimetypes
 import os
@@ -129,6 +130,7 @@ from common import safe_dom
 from common import users
 from common import user_routes
 from common import utils as common_utils
+from models import counters
 from models import courses
 from models import messages
 from models import models
@@ -613,6 +615,9 @@ def make_css_combo_zip_handler(zipfilename, static_file_handler):
 class AssetHandler(utils.BaseHandler):
     """Handles serving of static resources located on the file system."""
 
+    # Large files are read and written one VFS data shard at a time.
+    CHUNK_SIZE_BYTES = 1000 * 1000
+
     def __init__(self, app_context, filename):
         super(AssetHandler, self).__init__()
         self.app_context = app_context
@@ -624,26 +629,135 @@ class AssetHandler(utils.BaseHandler):
             return default
         return guess
 
-    def _can_view(self, fs, stream):
-        """Checks if current user can view stream."""
-        public = not fs.is_draft(stream)
+    def _can_view(self, metadata):
+        """Checks if current user can view a file with this metadata."""
+        public = not metadata.is_draft
         return public or Roles.is_course_admin(self.app_context)
 
+    @classmethod
+    def _get_etag(cls, metadata):
+        """Makes a strong ETag; every put stamps the file with a new time.
+
+        Returns None for files saved before they were stamped; those are
+        served without validators.
+        """
+        updated_on = metadata.updated_on
+        if not updated_on:
+            return None
+        timestamp_usec = (
+            calendar.timegm(updated_on.timetuple()) * 1000000 +
+            updated_on.microsecond)
+        return '"%x-%x"' % (timestamp_usec, metadata.size or 0)
+
+    @classmethod
+    def _etag_in(cls, etag, header):
+        """Checks if an ETag is in the list of an If-* header."""
+        if header.strip() == '*':
+            return True
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    @classmethod
+    def _is_modified_since(cls, metadata, since):
+        """Compares at the one second resolution of HTTP dates."""
+        return (calendar.timegm(metadata.updated_on.timetuple()) >
+                calendar.timegm(since.utctimetuple()))
+
+    def _is_not_modified(self, metadata, etag):
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match:
+            return self._etag_in(etag, if_none_match)
+        if_modified_since = self.request.if_modified_since
+        if if_modified_since:
+            return not self._is_modified_since(metadata, if_modified_since)
+        return False
+
+    def _get_byte_range(self, etag, length):
+        """Returns (start, end) of the requested bytes; empty if unsatisfiable.
+
+        Returns None when the whole file is to be sent: no Range header, a
+        stale If-Range validator, a range we don't support (e.g. several
+        ranges at once), which HTTP lets a server ignore, or an invalid one
+        (e.g. ending before it starts), which it must ignore.
+        """
+        range_header = self.request.headers.get('Range')
+        if not range_header:
+            return None
+        if_range = self.request.headers.get('If-Range')
+        if if_range and if_range.strip() != etag:
+            return None
+        match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first and last and int(last) < int(first):
+            return None
+        if not first:
+            start, end = max(length - int(last), 0), length
+        else:
+            start = int(first)
+            end = min(int(last) + 1, length) if last else length
+        return start, end
+
+    def _write_stream(self, stream, start, end):
+        """Writes the bytes from start to end of a stream chunk by chunk."""
+        stream.seek(start)
+        while start < end:
+            chunk = stream.read(min(self.CHUNK_SIZE_BYTES, end - start))
+            if not chunk:
+                break
+            self.response.write(chunk)
+            start += len(chunk)
+
     def get(self):
         """Handles GET requests."""
         models.MemcacheManager.begin_readonly()
         try:
-            stream = self.app_context.fs.open(self.filename)
-            if not stream:
+            fs = self.app_context.fs
+            metadata = fs.get_metadata(self.filename)
+            if not metadata:
                 self.error(404)
                 return
-            if not self._can_view(self.app_context.fs, stream):
+            if not self._can_view(metadata):
                 self.error(403)
                 return
             set_static_resource_cache_control(self)
+            etag = self._get_etag(metadata)
+            self.response.headers['Accept-Ranges'] = 'bytes'
+            if etag:
+                self.response.headers['ETag'] = etag
+                self.response.last_modified = metadata.updated_on
+                if self._is_not_modified(metadata, etag):
+                    self.response.status = 304
+                    self.response.headers.pop('Content-Type', None)
+                    return
+
+            stream = fs.open(self.filename)
+            if not stream:
+                self.error(404)
+                return
             self.response.headers['Content-Type'] = self.get_mime_type(
                self.filename)
-            self.response.write(stream.read())
+            stream.seek(0, os.SEEK_END)
+            length = stream.tell()
+            byte_range = self._get_byte_range(etag, length)
+            if byte_range is None:
+                self._write_stream(stream, 0, length)
+                return
+            start, end = byte_range
+            if start >= end:
+                self.response.status = 416
+                self.response.headers['Content-Range'] = 'bytes */%d' % length
+                return
+            self.response.status = 206
+            self.response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, end - 1, length)
+            self._write_stream(stream, start, end)
         finally:
             models.MemcacheManager.end_readonly()
 
@@ -1781,15 +1895,18 @@ class WSGIRouter(webapp2.Router):
         super(WSGIRouter, self).__init__(routes)
 
     def dispatch(self, request, response):
-        result = super(WSGIRouter, self).dispatch(request, response)
-        if result:
-            response = result
+        try:
+            result = super(WSGIRouter, self).dispatch(request, response)
+            if result:
+                response = result
 
-        # pylint: disable=protected-access
-        ApplicationRequestHandler.finalize_response(
-            request, response, response.status_code)
+            # pylint: disable=protected-access
+            ApplicationRequestHandler.finalize_response(
+                request, response, response.status_code)
 
-        return response
+            return response
+        finally:
+            counters.flush_counter_global_values()
 
 
 class ClearCookiesHandler(webapp2.RequestHandler):
@@ -27,6 +27,11 @@ def get_counter_global_value(unused_name):
     return None
 
 
+def flush_counter_global_values():
+    """Hook method for global aggregation; sends buffered deltas."""
+    pass
+
+
 class PerfCounter(object):
     """A generic, in-process integer counter."""
 
@@ -76,9 +81,28 @@ class PerfCounter(object):
 class Registry(object):
     """Holds all registered counters."""
     registered = {}
+    last_flushed_on = {}
 
     @classmethod
     def _clear_all(cls):
         """Clears all counters for tests."""
         for counter in cls.registered.values():
             counter._clear()  # pylint: disable=protected-access
+        cls.last_flushed_on = {}
+
+    @classmethod
+    def set_last_flushed_on(cls, names, timestamp):
+        """Records when global values of these counters were last flushed."""
+        for name in names:
+            cls.last_flushed_on[name] = timestamp
+
+    @classmethod
+    def get_last_flushed_on(cls, name):
+        """Returns time (seconds since epoch) of last flush of counter or None.
+
+        Global values are buffered per request and sent to the aggregation
+        backend in a single batch when the request ends. This method lets
+        callers find out how stale the global value of a counter may be as
+        seen from this process.
+        """
+        return cls.last_flushed_on.get(name)
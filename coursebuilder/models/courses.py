@@ -25,6 +25,8 @@ import pickle
 import re
 import sys
 import threading
+import uuid
+import zlib
 import custom_units
 
 import messages
@@ -37,6 +39,7 @@ import vfs
 import yaml
 
 import appengine_config
+from common import caching
 from common import locales
 from common import safe_dom
 from common import schema_fields
@@ -46,6 +49,7 @@ import models
 from models import MemcacheManager
 from models import QuestionImporter
 from models import services
+from models.counters import PerfCounter
 from tools import verify
 
 from google.appengine.ext import db
@@ -55,6 +59,10 @@ COURSE_MODEL_VERSION_1_3 = '1.3'
 
 DEFAULT_FETCH_LIMIT = 100
 
+# all caches must have limits; the size of a cached course is estimated as
+# the size of its serialized memento
+MAX_COURSE_CACHE_SIZE_BYTES = 16 * 1024 * 1024
+
 # all entities of these types are copies from source to target during course
 # import
 COURSE_CONTENT_ENTITIES = frozenset([
@@ -387,6 +395,38 @@ def index_units_and_lessons(course):
                     lesson_index += 1
 
 
+def get_components_from_manifest(unit_or_lesson, html):
+    """Returns the components in the HTML of a unit or lesson.
+
+    The components found are kept on the unit or lesson as a manifest,
+    together with the HTML they were found in. The manifest is not persisted,
+    but is pickled along with the course into the course cache, so the HTML
+    is only parsed again when it changes or when a course without manifests
+    is loaded.
+
+    Args:
+        unit_or_lesson: the unit holding html_content or lesson holding
+            objectives.
+        html: the value of html_content or objectives.
+
+    Returns:
+        A list of dicts as returned by tags.get_components_from_html().
+    """
+    if not html:
+        return []
+    if not hasattr(unit_or_lesson, '_components'):
+        # Only Unit13 and Lesson13 keep manifests; older objects, including
+        # any unpickled from caches filled before they did, are parsed.
+        return common.tags.get_components_from_html(html)
+
+    # pylint: disable=protected-access
+    manifest = unit_or_lesson._components
+    if manifest is None or manifest[0] != html:
+        manifest = (html, common.tags.get_components_from_html(html))
+        unit_or_lesson._components = manifest
+    return [dict(component) for component in manifest[1]]
+
+
 def has_at_least_one_old_style_assessment(course):
     assessments = course.get_assessment_list()
     return any(a.is_old_style_assessment(course) for a in assessments)
@@ -413,8 +453,119 @@ def has_only_new_style_activities(course):
     return not has_at_least_one_old_style_activity(course)
 
 
+class ProcessScopedCourseCache(caching.ProcessScopedSingleton):
+    """This class holds in-process cache of deserialized course mementos.
+
+    Each entry is a tuple of (generation, memento, size). The generation
+    identifies the version of the memento saved to memcache; an entry is only
+    used while the manifest stored in memcache still names the same one.
+    """
+
+    @classmethod
+    def get_cache_len(cls):
+        # pylint: disable=protected-access
+        return len(ProcessScopedCourseCache.instance()._cache.items.keys())
+
+    @classmethod
+    def get_cache_size(cls):
+        # pylint: disable=protected-access
+        return ProcessScopedCourseCache.instance()._cache.total_size
+
+    def __init__(self):
+        self._cache = caching.LRUCache(
+            max_size_bytes=MAX_COURSE_CACHE_SIZE_BYTES,
+            max_item_size_bytes=MAX_COURSE_CACHE_SIZE_BYTES // 4,
+            name='courses')
+        self._cache.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, key, value):
+        return sys.getsizeof(key) + value[2] if value else 0
+
+    @property
+    def cache(self):
+        return self._cache
+
+
+COURSE_CACHE_HIT_LOCAL = PerfCounter(
+    'gcb-models-courses-cache-hit-local',
+    'A number of times a course was found in the in-process course cache.')
+COURSE_CACHE_MISS_LOCAL = PerfCounter(
+    'gcb-models-courses-cache-miss-local',
+    'A number of times a course was not found in the in-process course cache.')
+COURSE_CACHE_LEN = PerfCounter(
+    'gcb-models-courses-cache-len',
+    'A total number of items in the in-process course cache.')
+COURSE_CACHE_SIZE_BYTES = PerfCounter(
+    'gcb-models-courses-cache-bytes',
+    'A total size of items in the in-process course cache in bytes.')
+
+COURSE_CACHE_LEN.poll_value = ProcessScopedCourseCache.get_cache_len
+COURSE_CACHE_SIZE_BYTES.poll_value = ProcessScopedCourseCache.get_cache_size
+
+COURSE_CACHE_SHARDS = PerfCounter(
+    'gcb-models-courses-cache-shards',
+    'A total number of memcache shards written for courses.')
+COURSE_CACHE_BYTES_UNCOMPRESSED = PerfCounter(
+    'gcb-models-courses-cache-bytes-uncompressed',
+    'A total size of courses written to memcache before compression.')
+COURSE_CACHE_BYTES_COMPRESSED = PerfCounter(
+    'gcb-models-courses-cache-bytes-compressed',
+    'A total size of courses written to memcache after compression.')
+COURSE_CACHE_COMPRESSION_RATIO = PerfCounter(
+    'gcb-models-courses-cache-compression-ratio',
+    'Uncompressed size of courses written to memcache, as a percentage of '
+    'their compressed size.')
+
+
+def _get_course_cache_compression_ratio():
+    if not COURSE_CACHE_BYTES_COMPRESSED.value:
+        return None
+    return (100 * COURSE_CACHE_BYTES_UNCOMPRESSED.value //
+            COURSE_CACHE_BYTES_COMPRESSED.value)
+
+COURSE_CACHE_COMPRESSION_RATIO.poll_value = _get_course_cache_compression_ratio
+
+COURSE_ENVIRON_VIEWS = PerfCounter(
+    'gcb-models-courses-environ-views',
+    'A number of copy-on-write views of course settings handed out. Sections '
+    'of a view are still deep copied when they are first read.')
+
+# Course settings are handed out as copy-on-write views; let them be saved.
+for _dumper in [yaml.Dumper, yaml.SafeDumper]:
+    yaml.add_representer(
+        common_utils.CopyOnWriteDict,
+        yaml.representer.SafeRepresenter.represent_dict, Dumper=_dumper)
+
+
+class RequestScopedEnvironCache(caching.RequestScopedSingleton):
+    """Holds course settings with post-copy hooks applied, for one request.
+
+    Entries are keyed by namespace, the hooks and the values returned by the
+    key providers for the current user; each entry is a tuple of the settings
+    the hooks were applied to and the resulting settings.
+    """
+
+    def __init__(self):
+        self.views = {}
+
+
 class AbstractCachedObject(object):
-    """Abstract serializable versioned object that can stored in memcache."""
+    """Abstract serializable versioned object that can stored in memcache.
+
+    The pickled object is compressed and split into as many memcache shards
+    as needed. A small manifest records the generation of the saved object,
+    the number of shards and a checksum of their content; shard keys include
+    the generation, so shards of different saves are never mixed, and a
+    corrupt or incomplete set of shards is detected by the checksum.
+
+    Deserialized objects are also kept in a bounded in-process cache. Since
+    every save() writes a new generation and every delete() removes the
+    manifest, a process can cheaply tell whether its copy is current by
+    fetching the manifest alone. The object held in the in-process cache is
+    shared by all requests and must never be modified; instance_from_memento()
+    wraps its parts in copy-on-write views, such as CourseElementView, rather
+    than copying all of it.
+    """
 
     @classmethod
     def _max_size(cls):
@@ -422,24 +573,57 @@ class AbstractCachedObject(object):
         return models.MEMCACHE_MAX
 
     @classmethod
-    def _make_keys(cls):
+    def _make_key_prefix(cls):
         # The course content files may change between deployment. To avoid
         # reading old cached values by the new version of the application we
         # add deployment version to the key. Now each version of the
         # application can put/get its own version of the course and the
         # deployment.
+        return 'course:model:pickle:%s:%s' % (
+            cls.VERSION, os.environ.get('CURRENT_VERSION_ID'))
 
-        # Generate the maximum number of cache shard keys indicated by the max
-        # allowed size of the derived type.  Not all of these will necessarily
-        # be used, but the number of shards is typically very small (max of 4)
-        # so pre-generating these is not a big burden.
-        num_shards = (
-            (cls._max_size() + models.MEMCACHE_MAX - 1) // models.MEMCACHE_MAX)
+    @classmethod
+    def _make_manifest_key(cls):
+        return '%s:manifest' % cls._make_key_prefix()
+
+    @classmethod
+    def _make_shard_keys(cls, generation, num_shards):
         return [
-            'course:model:pickle:%s:%s:%d' % (
-                cls.VERSION, os.environ.get('CURRENT_VERSION_ID'), shard)
+            '%s:%s:%d' % (cls._make_key_prefix(), generation, shard)
             for shard in xrange(num_shards)]
 
+    @classmethod
+    def _checksum(cls, data):
+        return zlib.crc32(data) & 0xffffffff
+
+    @classmethod
+    def _make_local_key(cls, app_context):
+        return '%s:%s' % (
+            app_context.get_namespace_name(), cls._make_key_prefix())
+
+    @classmethod
+    def _get_local(cls, app_context, generation):
+        """Returns the shared in-process memento, if current."""
+        if generation:
+            found, entry = ProcessScopedCourseCache.instance().cache.get(
+                cls._make_local_key(app_context))
+            if found and entry[0] == generation:
+                COURSE_CACHE_HIT_LOCAL.inc()
+                return entry[1]
+        COURSE_CACHE_MISS_LOCAL.inc()
+        return None
+
+    @classmethod
+    def _put_local(cls, app_context, generation, memento, size):
+        """Puts a memento no one else refers to into the in-process cache."""
+        ProcessScopedCourseCache.instance().cache.put(
+            cls._make_local_key(app_context), (generation, memento, size))
+
+    @classmethod
+    def _delete_local(cls, app_context):
+        ProcessScopedCourseCache.instance().cache.delete(
+            cls._make_local_key(app_context))
+
     @classmethod
     def new_memento(cls):
         """Creates new empty memento instance; must be pickle serializable."""
@@ -447,7 +631,7 @@ class AbstractCachedObject(object):
 
     @classmethod
     def instance_from_memento(cls, unused_app_context, unused_memento):
-        """Creates instance from serializable memento."""
+        """Creates instance from serializable memento; must not modify it."""
         raise Exception('Not implemented')
 
     @classmethod
@@ -458,67 +642,98 @@ class AbstractCachedObject(object):
     @classmethod
     def load(cls, app_context):
         """Loads instance from memcache; does not fail on errors."""
-        shard_keys = cls._make_keys()
-        shard_contents = {}
+        namespace = app_context.get_namespace_name()
+        manifest_key = cls._make_manifest_key()
         try:
-            shard_0 = MemcacheManager.get(
-                shard_keys[0], namespace=app_context.get_namespace_name())
-            if not shard_0:
+            manifest = MemcacheManager.get(
+                manifest_key, namespace=namespace) or {}
+            generation = manifest.get('generation')
+            memento = cls._get_local(app_context, generation)
+            if memento:
+                return cls.instance_from_memento(app_context, memento)
+            if not generation:
                 return None
 
-            num_shards = ord(shard_0[0])
-            shard_contents[shard_keys[0]] = shard_0[1:]
-            if num_shards > 1:
-                shard_contents.update(MemcacheManager.get_multi(
-                    shard_keys[1:], namespace=app_context.get_namespace_name()))
-            if len(shard_contents) != num_shards:
+            shard_keys = cls._make_shard_keys(
+                generation, manifest['num_shards'])
+            shard_contents = MemcacheManager.get_multi(
+                shard_keys, namespace=namespace)
+            if len(shard_contents) != len(shard_keys):
                 return None
 
-            data = []
-            for shard_key in sorted(shard_contents.keys()):
-                data.append(shard_contents[shard_key])
+            data = ''.join([
+                shard_contents[shard_key] for shard_key in shard_keys])
+            if cls._checksum(data) != manifest['checksum']:
+                logging.error(
+                    'Checksum mismatch for object \'%s\' of generation %s '
+                    'in memcache.', manifest_key, generation)
+                return None
+            data = zlib.decompress(data)
             memento = cls.new_memento()
-            memento.deserialize(''.join(data))
+            memento.deserialize(data)
+            cls._put_local(app_context, generation, memento, len(data))
             return cls.instance_from_memento(app_context, memento)
 
         except Exception as e:  # pylint: disable=broad-except
             logging.error(
-                'Failed to load object \'%s\' from memcache. %s', shard_keys, e)
+                'Failed to load object \'%s\' from memcache. %s',
+                manifest_key, e)
         return None
 
     @classmethod
     def save(cls, app_context, instance):
         """Saves instance to memcache."""
+        memento = cls.memento_from_instance(instance)
+        data_bytes = memento.serialize()
+        compressed_bytes = zlib.compress(data_bytes)
 
         # If item to cache is too large, clear the old cached value for this
         # item, and don't send the new, too-large item to cache.
-        data_bytes = cls.memento_from_instance(instance).serialize()
-        num_shards_required = (len(data_bytes) // models.MEMCACHE_MAX) + 1
-        data_bytes = chr(num_shards_required) + data_bytes
-        if len(data_bytes) > cls._max_size():
+        if len(compressed_bytes) > cls._max_size():
             logging.warning(
                 'Not sending %d bytes for %s to Memcache; this is more '
                 'than the maximum limit of %d bytes.',
-                len(data_bytes), cls.__name__, cls._max_size())
+                len(compressed_bytes), cls.__name__, cls._max_size())
             cls.delete(app_context)
             return
 
+        generation = uuid.uuid4().hex
+        num_shards = (
+            (len(compressed_bytes) + models.MEMCACHE_MAX - 1) //
+            models.MEMCACHE_MAX)
         mapping = {}
-        shard_keys = cls._make_keys()
-        i = 0
-        while i < num_shards_required:
-            mapping[shard_keys[i]] = data_bytes[i * models.MEMCACHE_MAX:
-                                                (i + 1) * models.MEMCACHE_MAX]
-            i += 1
+        for index, shard_key in enumerate(
+                cls._make_shard_keys(generation, num_shards)):
+            mapping[shard_key] = compressed_bytes[
+                index * models.MEMCACHE_MAX:(index + 1) * models.MEMCACHE_MAX]
+        mapping[cls._make_manifest_key()] = {
+            'generation': generation,
+            'num_shards': num_shards,
+            'checksum': cls._checksum(compressed_bytes)}
         MemcacheManager.set_multi(
             mapping, namespace=app_context.get_namespace_name())
 
+        COURSE_CACHE_SHARDS.inc(increment=num_shards)
+        COURSE_CACHE_BYTES_UNCOMPRESSED.inc(increment=len(data_bytes))
+        COURSE_CACHE_BYTES_COMPRESSED.inc(increment=len(compressed_bytes))
+
+        # The memento refers to the parts of the instance, which the caller
+        # keeps using; the in-process cache gets its own copy.
+        memento = cls.new_memento()
+        memento.deserialize(data_bytes)
+        cls._put_local(app_context, generation, memento, len(data_bytes))
+
     @classmethod
     def delete(cls, app_context):
-        """Deletes instance from memcache."""
-        MemcacheManager.delete_multi(
-            cls._make_keys(),
-            namespace=app_context.get_namespace_name())
+        """Deletes instance from memcache and from the in-process cache."""
+        cls._delete_local(app_context)
+        namespace = app_context.get_namespace_name()
+        keys = [cls._make_manifest_key()]
+        manifest = MemcacheManager.get(keys[0], namespace=namespace)
+        if manifest:
+            keys += cls._make_shard_keys(
+                manifest['generation'], manifest['num_shards'])
+        MemcacheManager.delete_multi(keys, namespace=namespace)
 
     def serialize(self):
         """Saves instance to a pickle representation."""
@@ -703,9 +918,12 @@ class CachedCourse12(AbstractCachedObject):
 
     @classmethod
     def instance_from_memento(cls, app_context, memento):
+        # The lookup dict refers to the lessons, so it is rebuilt for the
+        # views.
         return CourseModel12(
-            app_context, units=memento.units, lessons=memento.lessons,
-            unit_id_to_lessons=memento.unit_id_to_lessons)
+            app_context,
+            units=[CourseElementView(unit) for unit in memento.units],
+            lessons=[CourseElementView(lesson) for lesson in memento.lessons])
 
     @classmethod
     def memento_from_instance(cls, course):
@@ -781,6 +999,11 @@ class CourseModel12(object):
     def get_units(self):
         return self._units[:]
 
+    def get_outline_index(self):
+        if getattr(self, '_outline_index', None) is None:
+            self._outline_index = progress.CourseOutlineIndex.build(self)
+        return self._outline_index
+
     def get_assessments(self):
         return [x for x in self.get_units() if x.is_assessment()]
 
@@ -894,6 +1117,9 @@ class Unit13(object):
         # computed.
         self._index = None
 
+        # Components in html_content; see get_components_from_manifest().
+        self._components = None
+
         # Only valid for the unit.type == verify.UNIT_TYPE_LINK.
         self.href = None
 
@@ -908,6 +1134,9 @@ class Unit13(object):
         # Only valid for the unit.type == verify.UNIT_TYPE_ASSESSMENT.
         self.workflow_yaml = DEFAULT_AUTO_GRADER_WORKFLOW
 
+        # Workflow parsed from workflow_yaml; see workflow property.
+        self._workflow = None
+
         # Valid for all values of unit.type
         self.labels = None
 
@@ -954,9 +1183,17 @@ class Unit13(object):
 
     @property
     def workflow(self):
-        """Returns the workflow as an object."""
+        """Returns the workflow as an object.
+
+        The workflow is kept on the unit, and is pickled along with the course
+        into the course cache, so workflow_yaml is only parsed again when it
+        changes.
+        """
         assert self.is_assessment() or self.is_custom_unit()
-        workflow = Workflow(self.workflow_yaml)
+        workflow = getattr(self, '_workflow', None)
+        if workflow is None or workflow.to_yaml() != self.workflow_yaml:
+            workflow = Workflow(self.workflow_yaml)
+            self._workflow = workflow
         return workflow
 
     @property
@@ -1060,6 +1297,9 @@ class Lesson13(object):
         self.auto_index = True
         self._index = None
 
+        # Components in objectives; see get_components_from_manifest().
+        self._components = None
+
         # When manual_progress is set, the user must take an affirmative UI
         # action to mark the lesson as completed.  If not set, a lesson is
         # considered completed the first time it is shown to the student.
@@ -1197,7 +1437,7 @@ class CachedCourse13(AbstractCachedObject):
 
     def __init__(
         self, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None):
+        unit_id_to_lesson_ids=None, outline_index=None):
 
         self.version = self.VERSION
         self.next_id = next_id
@@ -1209,12 +1449,13 @@ class CachedCourse13(AbstractCachedObject):
         # is no need to persist these indexes in durable storage, but it is
         # nice to have them in memcache.
         self.unit_id_to_lesson_ids = unit_id_to_lesson_ids
+        self.outline_index = outline_index
 
     @classmethod
     def _max_size(cls):
-        # Cap at approximately 4M to avoid 1M single-cache-element limit,
-        # which is too small for larger courses.
-        return models.MEMCACHE_MAX * 4
+        # Courses are split into as many shards as needed; the only limit
+        # is what MemcacheManager.set_multi() will send in one call.
+        return models.MEMCACHE_MULTI_MAX - models.MEMCACHE_MAX
 
     @classmethod
     def new_memento(cls):
@@ -1222,17 +1463,24 @@ class CachedCourse13(AbstractCachedObject):
 
     @classmethod
     def instance_from_memento(cls, app_context, memento):
+        # The indexes are only ever replaced by the course, never modified,
+        # so they are shared along with the outline index.
         return CourseModel13(
             app_context, next_id=memento.next_id,
-            units=memento.units, lessons=memento.lessons,
-            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids)
+            units=[CourseElementView(unit) for unit in memento.units],
+            lessons=[CourseElementView(lesson) for lesson in memento.lessons],
+            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids,
+            outline_index=memento.outline_index)
 
     @classmethod
     def memento_from_instance(cls, course):
+        course.update_component_manifests()
+        course.update_workflows()
         return CachedCourse13(
             next_id=course.next_id,
             units=course.units, lessons=course.lessons,
-            unit_id_to_lesson_ids=course.unit_id_to_lesson_ids)
+            unit_id_to_lesson_ids=course.unit_id_to_lesson_ids,
+            outline_index=course.get_outline_index())
 
 
 class CourseModel13(object):
@@ -1263,14 +1511,17 @@ class CourseModel13(object):
 
     def __init__(
         self, app_context, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None):
+        unit_id_to_lesson_ids=None, outline_index=None):
 
         # Init default values.
         self._app_context = app_context
         self._next_id = 1  # a counter for creating sequential entity ids
         self._units = []
         self._lessons = []
+        self._units_by_id = {}
+        self._lessons_by_id = {}
         self._unit_id_to_lesson_ids = {}
+        self._outline_index = None
 
         # These array keep dirty object in current transaction.
         self._dirty_units = []
@@ -1285,8 +1536,10 @@ class CourseModel13(object):
             self._units = units
         if lessons:
             self._lessons = lessons
+        self._index_ids()
         if unit_id_to_lesson_ids:
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
+            self._outline_index = outline_index
         else:
             self._index()
 
@@ -1316,11 +1569,45 @@ class CourseModel13(object):
         self._next_id += 1
         return next_id
 
+    def _index_ids(self):
+        """Indexes units and lessons by their ids, always as strings.
+
+        Unlike the other indexes, these are kept up to date by the methods
+        adding and removing units and lessons.
+        """
+        self._units_by_id = {str(unit.unit_id): unit for unit in self._units}
+        self._lessons_by_id = {
+            str(lesson.lesson_id): lesson for lesson in self._lessons}
+
     def _index(self):
         """Indexes units and lessons."""
         self._unit_id_to_lesson_ids = self._make_unit_id_to_lessons_lookup_dict(
             self._lessons)
         index_units_and_lessons(self)
+        self._outline_index = None
+
+    def update_component_manifests(self):
+        """Finds the components of units and lessons changed since last time."""
+        for unit in self._units:
+            get_components_from_manifest(unit, unit.html_content)
+        for lesson in self._lessons:
+            get_components_from_manifest(lesson, lesson.objectives)
+
+    def update_workflows(self):
+        """Parses the workflows of assessments changed since last time."""
+        for unit in self._units:
+            if unit.is_assessment() or unit.is_custom_unit():
+                try:
+                    unit.workflow.get_grader()
+                except Exception:  # pylint: disable=broad-except
+                    # Invalid workflows fail when used, as they always did.
+                    pass
+
+    def get_outline_index(self):
+        """Returns progress.CourseOutlineIndex; built lazily after changes."""
+        if self._outline_index is None:
+            self._outline_index = progress.CourseOutlineIndex.build(self)
+        return self._outline_index
 
     def get_file_content(self, filename):
         fs = self.app_context.fs
@@ -1382,10 +1669,13 @@ class CourseModel13(object):
 
         units = self._units
         lessons = self._lessons
+        units_by_id = self._units_by_id
+        lessons_by_id = self._lessons_by_id
         unit_id_to_lesson_ids = self._unit_id_to_lesson_ids
         try:
             self._units = self._deleted_units
             self._lessons = self._deleted_lessons
+            self._index_ids()
             self._unit_id_to_lesson_ids = None
 
             # Delete owned assessments.
@@ -1405,6 +1695,8 @@ class CourseModel13(object):
         finally:
             self._units = units
             self._lessons = lessons
+            self._units_by_id = units_by_id
+            self._lessons_by_id = lessons_by_id
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
 
     def _validate_settings_content(self, content):
@@ -1475,6 +1767,8 @@ class CourseModel13(object):
         self._deleted_lessons = []
 
         self._index()
+        self.update_component_manifests()
+        self.update_workflows()
         PersistentCourse13.save(self._app_context, self)
         CachedCourse13.delete(self._app_context)
 
@@ -1514,17 +1808,11 @@ class CourseModel13(object):
 
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
-        for unit in self._units:
-            if str(unit.unit_id) == str(unit_id):
-                return unit
-        return None
+        return self._units_by_id.get(str(unit_id))
 
     def find_lesson_by_id(self, unused_unit, lesson_id):
         """Finds a lesson given its id."""
-        for lesson in self._lessons:
-            if str(lesson.lesson_id) == str(lesson_id):
-                return lesson
-        return None
+        return self._lessons_by_id.get(str(lesson_id))
 
     def get_parent_unit(self, unit_id):
         # See if the unit is an assessment being used as a pre/post
@@ -1555,6 +1843,7 @@ class CourseModel13(object):
             unit.custom_unit_type = custom_unit_type
 
         self._units.append(unit)
+        self._units_by_id[str(unit.unit_id)] = unit
         self._index()
 
         self._dirty_units.append(unit)
@@ -1573,6 +1862,7 @@ class CourseModel13(object):
         lesson.shown_when_unavailable = False
 
         self._lessons.append(lesson)
+        self._lessons_by_id[str(lesson.lesson_id)] = lesson
         self._index()
 
         self._dirty_lessons.append(lesson)
@@ -1632,6 +1922,7 @@ class CourseModel13(object):
         if not lesson:
             return False
         self._lessons.remove(lesson)
+        del self._lessons_by_id[str(lesson.lesson_id)]
         self._index()
         self._deleted_lessons.append(lesson)
         self._dirty_lessons.append(lesson)
@@ -1652,6 +1943,7 @@ class CourseModel13(object):
                 parent.post_assessment = None
             self._dirty_units.append(parent)
         self._units.remove(unit)
+        del self._units_by_id[str(unit.unit_id)]
         self._index()
         self._deleted_units.append(unit)
         self._dirty_units.append(unit)
@@ -1687,6 +1979,8 @@ class CourseModel13(object):
             existing_unit.html_review_form = unit.html_review_form
             existing_unit.workflow_yaml = unit.workflow_yaml
 
+        # Pre/post assessments may have changed.
+        self._outline_index = None
         self._dirty_units.append(existing_unit)
         return existing_unit
 
@@ -2192,21 +2486,50 @@ class CourseModel13(object):
 
 
 class Workflow(object):
-    """Stores workflow specifications for assessments."""
+    """Stores workflow specifications for assessments.
+
+    The specification is parsed when it is first used, and its due dates are
+    converted to datetimes at the same time. A Workflow is not modified after
+    that, so it can be shared and cached along with the unit it belongs to.
+    """
+
+    DUE_DATE_KEYS = [SUBMISSION_DUE_DATE_KEY, REVIEW_DUE_DATE_KEY]
 
     def __init__(self, yaml_str):
         """Sets yaml_str (the workflow spec), without doing any validation."""
         self._yaml_str = yaml_str
+        self._dict = None
+        self._due_dates = None
 
     def to_yaml(self):
         return self._yaml_str
 
+    def _get_dict(self):
+        if self._dict is None:
+            workflow_dict = {}
+            if self._yaml_str:
+                workflow_dict = yaml.safe_load(self._yaml_str)
+                assert isinstance(workflow_dict, dict)
+            due_dates = {}
+            for key in self.DUE_DATE_KEYS:
+                try:
+                    due_dates[key] = self._convert_date_string_to_datetime(
+                        workflow_dict.get(key))
+                except (TypeError, ValueError):
+                    # Left for _get_due_date() to report when asked for.
+                    pass
+            self._due_dates = due_dates
+            self._dict = workflow_dict
+        return self._dict
+
+    def _get_due_date(self, key):
+        workflow_dict = self._get_dict()
+        if key in self._due_dates:
+            return self._due_dates[key]
+        return self._convert_date_string_to_datetime(workflow_dict.get(key))
+
     def to_dict(self):
-        if not self._yaml_str:
-            return {}
-        obj = yaml.safe_load(self._yaml_str)
-        assert isinstance(obj, dict)
-        return obj
+        return dict(self._get_dict())
 
     def _convert_date_string_to_datetime(self, date_str):
         """Returns a datetime object."""
@@ -2216,34 +2539,28 @@ class Workflow(object):
 
     def get_grader(self):
         """Returns the associated grader."""
-        return self.to_dict().get(GRADER_KEY)
+        return self._get_dict().get(GRADER_KEY)
 
     def get_matcher(self):
-        return self.to_dict().get(MATCHER_KEY)
+        return self._get_dict().get(MATCHER_KEY)
 
     def is_single_submission(self):
-        return self.to_dict().get(SINGLE_SUBMISSION_KEY, False)
+        return self._get_dict().get(SINGLE_SUBMISSION_KEY, False)
 
     def get_submission_due_date(self):
-        date_str = self.to_dict().get(SUBMISSION_DUE_DATE_KEY)
-        if date_str is None:
-            return None
-        return self._convert_date_string_to_datetime(date_str)
+        return self._get_due_date(SUBMISSION_DUE_DATE_KEY)
 
     def show_feedback(self):
-        return self.to_dict().get(SHOW_FEEDBACK_KEY, False)
+        return self._get_dict().get(SHOW_FEEDBACK_KEY, False)
 
     def get_review_due_date(self):
-        date_str = self.to_dict().get(REVIEW_DUE_DATE_KEY)
-        if date_str is None:
-            return None
-        return self._convert_date_string_to_datetime(date_str)
+        return self._get_due_date(REVIEW_DUE_DATE_KEY)
 
     def get_review_min_count(self):
-        return self.to_dict().get(REVIEW_MIN_COUNT_KEY)
+        return self._get_dict().get(REVIEW_MIN_COUNT_KEY)
 
     def get_review_window_mins(self):
-        return self.to_dict().get(REVIEW_WINDOW_MINS_KEY)
+        return self._get_dict().get(REVIEW_WINDOW_MINS_KEY)
 
     def _ensure_value_is_nonnegative_int(self, workflow_dict, key, errors):
         """Checks that workflow_dict[key] is a non-negative integer."""
@@ -2334,6 +2651,125 @@ class Workflow(object):
             return False
 
 
+class CourseElementView(object):
+    """A copy-on-write view of a unit or lesson.
+
+    Reads are delegated to the wrapped element, which is shared with other
+    views and must not be modified; attributes assigned on the view are
+    recorded on the view only. Attribute values that are not of an immutable
+    type are copied into the view the first time they are read, so that
+    modifying them in place does not reach the element either. Methods and
+    properties of the element run against the view. A view of a view starts
+    with the overrides of the latter. A copy of a view, and a view restored
+    from a pickle, is a plain copy of the element with the overrides applied.
+    """
+
+    __slots__ = ('_element', '_overrides')
+
+    # Values of these types are shared with the element when read.
+    _IMMUTABLE_TYPES = (type(None), basestring, int, long, float)
+
+    # Attributes derived from others, which are only ever replaced and never
+    # modified in place; see get_components_from_manifest() and
+    # Unit13.workflow.
+    _SHARED_ATTRIBUTES = frozenset(['_components', '_workflow'])
+
+    def __init__(self, element):
+        overrides = {}
+        if isinstance(element, CourseElementView):
+            overrides.update(element._overrides)
+            element = element._element
+        object.__setattr__(self, '_element', element)
+        object.__setattr__(self, '_overrides', overrides)
+
+    @property
+    def __class__(self):
+        # Lets isinstance() checks see the class of the wrapped element.
+        return type(self._element)
+
+    @classmethod
+    def _find_class_attribute(cls, element, name):
+        for klass in type(element).__mro__:
+            if name in klass.__dict__:
+                return klass.__dict__[name]
+        return None
+
+    @classmethod
+    def _copy_value(cls, name, value):
+        if (isinstance(value, cls._IMMUTABLE_TYPES) or
+            name in cls._SHARED_ATTRIBUTES):
+            return value
+        return copy.deepcopy(value)
+
+    def __getattr__(self, name):
+        if name in CourseElementView.__slots__:
+            raise AttributeError(name)
+        overrides = self._overrides
+        if name in overrides:
+            return overrides[name]
+        element = self._element
+        if name == '__dict__':
+            adict = dict(element.__dict__)
+            adict.update(overrides)
+            return adict
+        if name.startswith('__'):
+            return getattr(element, name)
+        if name in element.__dict__:
+            value = self._copy_value(name, element.__dict__[name])
+            if value is not element.__dict__[name]:
+                overrides[name] = value
+            return value
+        attr = self._find_class_attribute(element, name)
+        if hasattr(attr, '__get__'):
+            return attr.__get__(self, type(element))
+        return getattr(element, name)
+
+    def __setattr__(self, name, value):
+        if name in CourseElementView.__slots__:
+            object.__setattr__(self, name, value)
+            return
+        attr = self._find_class_attribute(self._element, name)
+        if hasattr(attr, '__set__'):
+            attr.__set__(self, value)
+        else:
+            self._overrides[name] = value
+
+    def __copy__(self):
+        element = copy.copy(self._element)
+        for name, value in element.__dict__.items():
+            if name not in self._overrides:
+                element.__dict__[name] = self._copy_value(name, value)
+        for name, value in self._overrides.iteritems():
+            setattr(element, name, value)
+        return element
+
+    def __deepcopy__(self, memo):
+        element = copy.deepcopy(self._element, memo)
+        for name, value in self._overrides.iteritems():
+            setattr(element, name, copy.deepcopy(value, memo))
+        return element
+
+    def __reduce_ex__(self, protocol):
+        return copy.copy(self).__reduce_ex__(protocol)
+
+    def get_overrides(self):
+        return dict(self._overrides)
+
+    def get_element(self):
+        return self._element
+
+
+class CourseElementStudentView(CourseElementView):
+    """A copy-on-write view of a unit or lesson as seen by some students.
+
+    Assigning attributes on the view lets hooks customize e.g. availability
+    for some students without affecting the course; see
+    Course.COURSE_ELEMENT_STUDENT_VIEW_HOOKS.
+    """
+
+    __slots__ = ()
+
+
 class Course(object):
     """Manages a course and all of its components."""
 
@@ -2400,8 +2836,19 @@ class Course(object):
     # - the current application context
     # - the environment dict, which should be modified in place.
     # Return values from callbacks are ignored.
+    #
+    # The environment dict is a copy-on-write view of the cached one; the
+    # result is shared by all get_environ() calls in a request for which the
+    # COURSE_ENV_POST_COPY_KEY_PROVIDERS return the same values.
     COURSE_ENV_POST_COPY_HOOKS = []
 
+    # Callback functions identifying which variant of the environment the
+    # hooks above produce for the current user.  Callbacks are passed the
+    # current application context and return a hashable value.  A module
+    # registering a hook whose effect varies between users within a request
+    # must also register a provider.
+    COURSE_ENV_POST_COPY_KEY_PROVIDERS = []
+
     # Holds callback functions which are passed the course env dict after it is
     # saved.
     COURSE_ENV_POST_SAVE_HOOKS = []
@@ -2410,17 +2857,27 @@ class Course(object):
     ENVIRON_TEST_OVERRIDES = {}
 
     # Callback functions for modifying course content elements (units and
-    # lessons) when these are cloned in 'get_track_matching_student()'.
+    # lessons) when these are wrapped in 'get_track_matching_student()'.
     # Parameters are:
     # - The current course
-    # - The Student object - may be a real Student, TransientStudent or None
     # - List of units (possibly empty, but non-None)
     # - List of lessons (possibly empty, but non-None)
-    # Hooks are expected to modify the units and lessons in place.  Any
-    # modifications are allowed, since these do not affect the official cached
-    # or stored copies.
+    # Units and lessons are CourseElementStudentView instances.  Hooks are
+    # expected to modify them in place by assigning attributes; these
+    # assignments are recorded on the views and do not affect the official
+    # cached or stored copies.  Do not mutate attribute values in place.
     COURSE_ELEMENT_STUDENT_VIEW_HOOKS = []
 
+    # Callback functions identifying which variant of the student view the
+    # hooks above produce for the current user.  Parameters are:
+    # - The current course
+    # - The Student object - may be a real Student, TransientStudent or None
+    # Each provider returns a hashable value; views are shared between all
+    # students for whom every provider returns the same values.  A module
+    # registering a hook whose effect varies between users must also
+    # register a provider.
+    COURSE_ELEMENT_STUDENT_VIEW_KEY_PROVIDERS = []
+
     SCHEMA_LOCALE_AVAILABILITY = 'availability'
     SCHEMA_LOCALE_AVAILABILITY_AVAILABLE = 'available'
     SCHEMA_LOCALE_AVAILABILITY_UNAVAILABLE = 'unvailable'
@@ -2429,6 +2886,9 @@ class Course(object):
     # here we keep current course available to thread
     INSTANCE = threading.local()
 
+    # here we keep the environment that hooks are being applied to
+    _ENVIRON_IN_HOOKS = threading.local()
+
     @classmethod
     def get_schema_sections(cls):
         ret = set([
@@ -2450,38 +2910,52 @@ class Course(object):
             os.environ.get('CURRENT_VERSION_ID'), locale)
 
     @classmethod
-    def _run_env_post_copy_hooks(cls, app_context, env):
-        env = copy.deepcopy(env)
-
-        # Monkey patch to defend against infinite recursion. Downstream
-        # calls do not reload the env but just return the copy we have here.
-        old_get_environ = cls.get_environ
+    def _run_env_hooks(cls, env, hooks, *args):
+        # Defend against infinite recursion. Downstream calls to get_environ()
+        # do not reload the env but just return the one we have here.
+        old_env = getattr(cls._ENVIRON_IN_HOOKS, 'env', None)
+        cls._ENVIRON_IN_HOOKS.env = env
         try:
-            cls.get_environ = classmethod(lambda cl, ac: env)
-            common_utils.run_hooks(
-                cls.COURSE_ENV_POST_COPY_HOOKS, app_context, env)
+            return [hook(*args) for hook in hooks]
         finally:
-            # Restore the original method from monkey-patch
-            cls.get_environ = old_get_environ
-        return env
+            cls._ENVIRON_IN_HOOKS.env = old_env
 
     @classmethod
-    def _run_env_post_load_hooks(cls, env):
-        old_get_environ = cls.get_environ
-        try:
-            cls.get_environ = classmethod(lambda cl, ac: env)
-            common_utils.run_hooks(
-                cls.COURSE_ENV_POST_LOAD_HOOKS, env)
-        finally:
-            # Restore the original method from monkey-patch
-            cls.get_environ = old_get_environ
+    def _run_env_post_copy_hooks(cls, app_context, env):
+        key = (
+            app_context.get_namespace_name(),
+            tuple(cls.COURSE_ENV_POST_COPY_HOOKS),
+            tuple(cls._run_env_hooks(
+                common_utils.CopyOnWriteDict(env),
+                cls.COURSE_ENV_POST_COPY_KEY_PROVIDERS, app_context)))
+        views = RequestScopedEnvironCache.instance().views
+        entry = views.get(key)
+        if not entry or entry[0] is not env:
+            view = common_utils.CopyOnWriteDict(env)
+            cls._run_env_hooks(
+                view, cls.COURSE_ENV_POST_COPY_HOOKS, app_context, view)
+            entry = (env, view)
+            views[key] = entry
+        COURSE_ENVIRON_VIEWS.inc()
+        return common_utils.CopyOnWriteDict(entry[1])
 
+    @classmethod
+    def _run_env_post_load_hooks(cls, env):
+        cls._run_env_hooks(env, cls.COURSE_ENV_POST_LOAD_HOOKS, env)
 
     @classmethod
     def get_environ(cls, app_context):
-        """Returns currently defined course settings as a dictionary."""
+        """Returns currently defined course settings as a dictionary.
+
+        The result is a copy-on-write view of the cached settings; callers
+        may modify it freely.
+        """
         # pylint: disable=protected-access
 
+        env = getattr(cls._ENVIRON_IN_HOOKS, 'env', None)
+        if env is not None:
+            return env
+
         # get from local cache
         env = app_context._cached_environ
         if env:
@@ -3013,6 +3487,7 @@ class Course(object):
         self._model = self._load(self._app_context)
         self._tracker = None
         self._reviews_processor = None
+        self._student_views = {}
 
         for hook in self.POST_LOAD_HOOKS:
             try:
@@ -3078,8 +3553,18 @@ class Course(object):
     def get_units_of_type(self, unit_type):
         return [unit for unit in self.get_units() if unit_type == unit.type]
 
+    def get_outline_index(self):
+        """Returns the precomputed progress.CourseOutlineIndex of the course."""
+        return self._model.get_outline_index()
+
+    def _get_student_view_key(self, student):
+        return (
+            models.LabelDAO.get_course_track_labels_view_key(self, student),
+            tuple([provider(self, student) for provider in
+                   self.COURSE_ELEMENT_STUDENT_VIEW_KEY_PROVIDERS]))
+
     def get_track_matching_student(self, student):
-        """Copy of units and lessons as modified for a particular student.
+        """Views of units and lessons as modified for a particular student.
 
         Be particularly careful to only use these items in read-only contexts
         (i.e., student-facing views, not admin dashboards).  This function
@@ -3088,6 +3573,11 @@ class Course(object):
         you run the risk of overwriting the base course view with the view
         appropriate to a specific student.
 
+        Units and lessons are returned as CourseElementStudentView instances
+        wrapping the elements of this course.  Views are shared by students
+        with the same track labels and view key providers' values, so the
+        returned lists must not be modified.
+
         Args:
           student: The current student.  May be a transient student or None.
         Returns:
@@ -3095,16 +3585,22 @@ class Course(object):
           respect the availability settings applied to these.
         """
 
-        units = [copy.deepcopy(unit) for unit in self.get_units()]
-        lessons = [copy.deepcopy(lesson)
-                   for lesson in self.get_lessons_for_all_units()]
-        models.LabelDAO.apply_course_track_labels_to_student_labels(
-            self, student, units)
-        models.LabelDAO.apply_course_track_labels_to_student_labels(
-            self, student, lessons)
-        common_utils.run_hooks(self.COURSE_ELEMENT_STUDENT_VIEW_HOOKS,
-                               self, units, lessons)
-        return units, lessons
+        key = self._get_student_view_key(student)
+        views = self._student_views.get(key)
+        if views is None:
+            units = [CourseElementStudentView(unit)
+                     for unit in self.get_units()]
+            lessons = [CourseElementStudentView(lesson)
+                       for lesson in self.get_lessons_for_all_units()]
+            models.LabelDAO.apply_course_track_labels_to_student_labels(
+                self, student, units)
+            models.LabelDAO.apply_course_track_labels_to_student_labels(
+                self, student, lessons)
+            common_utils.run_hooks(self.COURSE_ELEMENT_STUDENT_VIEW_HOOKS,
+                                   self, units, lessons)
+            views = (units, lessons)
+            self._student_views[key] = views
+        return views
 
     def get_unit_track_labels(self, unit):
         all_track_ids = models.LabelDAO.get_set_of_ids_of_type(
@@ -3131,6 +3627,7 @@ class Course(object):
         return None
 
     def save(self):
+        self._student_views = {}
         return self._model.save()
 
     def find_unit_by_id(self, unit_id):
@@ -3369,8 +3866,10 @@ class Course(object):
         if not lesson.objectives:
             return []
 
-        return common.tags.get_components_from_html(
-            lesson.objectives, use_lxml)
+        if not use_lxml:
+            return common.tags.get_components_from_html(
+                lesson.objectives, use_lxml)
+        return get_components_from_manifest(lesson, lesson.objectives)
 
     def get_content_as_dict_safe(self, unit, errors, kind='assessment'):
         """Validate the assessment or review script and return as a dict."""
@@ -3406,7 +3905,7 @@ class Course(object):
         if not getattr(unit, 'html_content', None):
             return []
 
-        return common.tags.get_components_from_html(unit.html_content)
+        return get_components_from_manifest(unit, unit.html_content)
 
     def get_components_with_name(self, unit_id, lesson_id, component_name):
         """Returns a list of dicts representing this component in a lesson."""
@@ -3905,14 +4404,16 @@ course:
         self.save_settings(env)
 
     def is_unit_available(self, unit):
-        unit = copy.deepcopy(unit)
+        unit = CourseElementStudentView(unit)
         common_utils.run_hooks(self.COURSE_ELEMENT_STUDENT_VIEW_HOOKS,
                                self, [unit], [])
         return self._model.is_unit_available(unit)
 
     def is_lesson_available(self, unit, lesson):
-        unit = copy.deepcopy(unit)
-        lesson = copy.deepcopy(lesson)
+        if unit is not None:
+            unit = CourseElementStudentView(unit)
+        if lesson is not None:
+            lesson = CourseElementStudentView(lesson)
         common_utils.run_hooks(self.COURSE_ELEMENT_STUDENT_VIEW_HOOKS,
                                self, [unit], [lesson])
         return self._model.is_lesson_available(unit, lesson)
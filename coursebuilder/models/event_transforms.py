@@ -20,7 +20,6 @@ import collections
 import logging
 
 import courses
-from common import tags
 import models
 from tools import verify
 
@@ -290,12 +289,13 @@ def unpack_check_answers(
     return answers
 
 
-def _add_questions_from_html(
-    questions_by_usage_id, unit_id, lesson_id, html, question_group_lengths):
-    """Parse rich-text HTML and add questions found to map by ID."""
+def _add_questions_from_components(
+    questions_by_usage_id, unit_id, lesson_id, components,
+    question_group_lengths):
+    """Add questions found among components of rich-text HTML to map by ID."""
 
     sequence_counter = 0
-    for component in tags.get_components_from_html(html):
+    for component in components:
         if component['cpt_name'] == 'question':
             weight = 1.0
             if 'weight' in component and component['weight'] != '':
@@ -356,12 +356,15 @@ def get_questions_by_usage_id(app_context):
     # count by the number of questions they contain.
     course = courses.Course(None, app_context)
     for unit in course.get_units():
-        _add_questions_from_html(questions_by_usage_id, unit.unit_id, None,
-                                 unit.html_content, question_group_lengths)
+        _add_questions_from_components(
+            questions_by_usage_id, unit.unit_id, None,
+            course.get_assessment_components(unit.unit_id),
+            question_group_lengths)
         for lesson in course.get_lessons(unit.unit_id):
-            _add_questions_from_html(questions_by_usage_id, unit.unit_id,
-                                     lesson.lesson_id, lesson.objectives,
-                                     question_group_lengths)
+            _add_questions_from_components(
+                questions_by_usage_id, unit.unit_id, lesson.lesson_id,
+                course.get_components(unit.unit_id, lesson.lesson_id),
+                question_group_lengths)
     return questions_by_usage_id
 
 
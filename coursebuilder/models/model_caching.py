@@ -91,7 +91,8 @@ class CacheFactory(object):
                 return cls.instance()._cache.total_size
 
             def __init__(self):
-                self._cache = caching.LRUCache(max_size_bytes=max_size_bytes)
+                self._cache = caching.LRUCache(
+                    max_size_bytes=max_size_bytes, name=name)
                 self._cache.get_entry_size = self._get_entry_size
 
             def _get_entry_size(self, key, value):
@@ -130,14 +131,23 @@ class CacheFactory(object):
                     return self.entity.updated_on
                 return None
 
+            @classmethod
+            def to_dto(cls, entity):
+                dto = dao_class.DTO(
+                    entity.key().id_or_name(),
+                    transforms.loads(entity.data))
+                # DTOs that declare updated_on get the time of the entity
+                # they were built from, to be used as a cheap version.
+                if hasattr(dto, 'updated_on'):
+                    dto.updated_on = entity.updated_on
+                return dto
+
             @classmethod
             def externalize(cls, key, entry):
                 entity = entry.entity
                 if not entity:
                     return None
-                return dao_class.DTO(
-                    entity.key().id_or_name(),
-                    transforms.loads(entity.data))
+                return cls.to_dto(entity)
 
             @classmethod
             def internalize(cls, key, entity):
@@ -211,9 +221,7 @@ class CacheFactory(object):
                         dao_class.ENTITY, str(key))
                 if entity:
                     self._conn(namespace).put(key, entity)
-                    return dao_class.DTO(
-                        entity.key().id_or_name(),
-                        transforms.loads(entity.data))
+                    return CacheEntry.to_dto(entity)
                 self._conn(namespace).CACHE_NOT_FOUND.inc()
                 self._conn(namespace).put(key, None)
                 return None
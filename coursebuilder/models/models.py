@@ -18,10 +18,12 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 import collections
 import copy
+import cPickle
 import datetime
 import logging
 import os
 import sys
+import threading
 import time
 import webapp2
 
@@ -98,19 +100,89 @@ CACHE_HIT_LOCAL = PerfCounter(
 CACHE_MISS_LOCAL = PerfCounter(
     'gcb-models-cache-miss-local',
     'A number of times an object was not found in local memcache.')
+CACHE_MUTATED_LOCAL = PerfCounter(
+    'gcb-models-cache-mutated-local',
+    'A number of times an object of immutable type was found modified in '
+    'local memcache.')
 
 # Intent for sending welcome notifications.
 WELCOME_NOTIFICATION_INTENT = 'welcome'
 
 
 class MemcacheManager(object):
-    """Class that consolidates all memcache operations."""
+    """Class that consolidates all memcache operations.
+
+    While in read-only mode, values are also kept in a request-local cache and
+    the same objects are served to all callers; to keep callers from seeing
+    each other's modifications, these values are deep-copied on the way in
+    and on the way out. Values of types registered as immutable with
+    register_immutable_type() are shared without copying. Set
+    CHECK_IMMUTABLE_VALUES to verify that shared values are in fact never
+    modified; this is expensive and meant for development and tests.
+    """
 
     _LOCAL_CACHE = None
+    _LOCAL_CACHE_FINGERPRINTS = None
     _IS_READONLY = False
     _READONLY_REENTRY_COUNT = 0
     _READONLY_APP_CONTEXT = None
 
+    # Types of values that are never modified after being put into or
+    # fetched from memcache, and so can be shared instead of being copied.
+    _IMMUTABLE_TYPES = set([
+        type(None), bool, int, long, float, str, unicode, datetime.datetime])
+
+    # Types registered by callers; unlike the built-in types above, their
+    # immutability is only a promise, which CHECK_IMMUTABLE_VALUES verifies.
+    _REGISTERED_IMMUTABLE_TYPES = set()
+
+    CHECK_IMMUTABLE_VALUES = not appengine_config.PRODUCTION_MODE
+
+    @classmethod
+    def register_immutable_type(cls, value_type):
+        """Declares that values of this exact type are never modified."""
+        cls._IMMUTABLE_TYPES.add(value_type)
+        cls._REGISTERED_IMMUTABLE_TYPES.add(value_type)
+
+    @classmethod
+    def unregister_immutable_type(cls, value_type):
+        cls._IMMUTABLE_TYPES.discard(value_type)
+        cls._REGISTERED_IMMUTABLE_TYPES.discard(value_type)
+
+    @classmethod
+    def _copy(cls, value):
+        if type(value) in cls._IMMUTABLE_TYPES:
+            return value
+        return copy.deepcopy(value)
+
+    @classmethod
+    def _fingerprint(cls, value):
+        return cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _is_checked(cls, value):
+        return (cls.CHECK_IMMUTABLE_VALUES and
+                type(value) in cls._REGISTERED_IMMUTABLE_TYPES)
+
+    @classmethod
+    def _check_unmodified(cls, key, namespace, value):
+        fingerprints = cls._LOCAL_CACHE_FINGERPRINTS
+        if fingerprints is None or (namespace, key) not in fingerprints:
+            return
+        if fingerprints[(namespace, key)] != cls._fingerprint(value):
+            CACHE_MUTATED_LOCAL.inc()
+            logging.error(
+                'Value of immutable type %s was modified after it was cached: '
+                '%s, %s', type(value).__name__, key, namespace)
+
+    @classmethod
+    def _check_all_unmodified(cls):
+        if not cls._LOCAL_CACHE_FINGERPRINTS:
+            return
+        for namespace, _dict in cls._LOCAL_CACHE.iteritems():
+            for key, value in _dict.iteritems():
+                cls._check_unmodified(key, namespace, value)
+
     @classmethod
     def _is_same_app_context_if_set(cls):
         if cls._READONLY_APP_CONTEXT is None:
@@ -149,6 +221,7 @@ class MemcacheManager(object):
                 'MemcacheManager.begin_readonly')
             cls._IS_READONLY = True
             cls._LOCAL_CACHE = {}
+            cls._LOCAL_CACHE_FINGERPRINTS = {}
             cls._fs_begin_readonly()
         cls._READONLY_REENTRY_COUNT += 1
 
@@ -160,15 +233,18 @@ class MemcacheManager(object):
             cls._is_same_app_context_if_set(), 'Unable to switch app_context.')
         cls._READONLY_REENTRY_COUNT -= 1
         if cls._READONLY_REENTRY_COUNT == 0:
+            cls._check_all_unmodified()
             cls._fs_end_readonly()
             cls._IS_READONLY = False
             cls._LOCAL_CACHE = None
+            cls._LOCAL_CACHE_FINGERPRINTS = None
             cls._READONLY_APP_CONTEXT = None
             appengine_config.log_appstats_event('MemcacheManager.end_readonly')
 
     @classmethod
     def clear_readonly_cache(cls):
         cls._LOCAL_CACHE = None
+        cls._LOCAL_CACHE_FINGERPRINTS = None
         cls._IS_READONLY = False
         cls._READONLY_REENTRY_COUNT = 0
         if cls._READONLY_APP_CONTEXT and (
@@ -188,6 +264,7 @@ class MemcacheManager(object):
             if key in _dict:
                 CACHE_HIT_LOCAL.inc()
                 value = _dict[key]
+                cls._check_unmodified(key, namespace, value)
                 return True, value
             else:
                 CACHE_MISS_LOCAL.inc()
@@ -203,6 +280,11 @@ class MemcacheManager(object):
                 _dict = {}
                 cls._LOCAL_CACHE[namespace] = _dict
             _dict[key] = value
+            if cls._is_checked(value):
+                cls._LOCAL_CACHE_FINGERPRINTS[(namespace, key)] = (
+                    cls._fingerprint(value))
+            else:
+                cls._LOCAL_CACHE_FINGERPRINTS.pop((namespace, key), None)
             CACHE_PUT_LOCAL.inc()
 
     @classmethod
@@ -249,7 +331,7 @@ class MemcacheManager(object):
 
         is_cached, value = cls._local_cache_get(key, _namespace)
         if is_cached:
-            return copy.deepcopy(value)
+            return cls._copy(value)
 
         value = memcache.get(key, namespace=_namespace)
 
@@ -261,8 +343,12 @@ class MemcacheManager(object):
         else:
             CACHE_MISS.inc(context=key)
 
-        cls._local_cache_put(key, _namespace, value)
-        return copy.deepcopy(value)
+        # The value was just unpickled from memcache; it only needs copying
+        # if it is also shared with other callers via the local cache.
+        if cls._IS_READONLY:
+            cls._local_cache_put(key, _namespace, value)
+            return cls._copy(value)
+        return value
 
     @classmethod
     def get_multi(cls, keys, namespace=None):
@@ -291,8 +377,10 @@ class MemcacheManager(object):
     def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None,
             propagate_exceptions=False):
         """Sets an item in memcache if memcache is enabled."""
-        # Ensure subsequent mods to value do not affect the cached copy.
-        value = copy.deepcopy(value)
+        # Ensure subsequent mods to value do not affect the locally cached
+        # copy; memcache itself keeps a pickled copy.
+        if cls._IS_READONLY:
+            value = cls._copy(value)
 
         try:
             if CAN_USE_MEMCACHE.value:
@@ -360,6 +448,14 @@ class MemcacheManager(object):
                 key, delta,
                 namespace=cls._get_namespace(namespace), initial_value=0)
 
+    @classmethod
+    def offset_multi(cls, mapping, namespace=None):
+        """Incr a dict of {key: delta} items in one call if memcache enabled."""
+        if CAN_USE_MEMCACHE.value and mapping:
+            memcache.offset_multi(
+                mapping, namespace=cls._get_namespace(namespace),
+                initial_value=0)
+
 
 CAN_AGGREGATE_COUNTERS = config.ConfigProperty(
     'gcb_can_aggregate_counters', bool,
@@ -367,23 +463,77 @@ CAN_AGGREGATE_COUNTERS = config.ConfigProperty(
     label='Aggregate Counters')
 
 
+class CounterDeltaBuffer(object):
+    """Collects global counter deltas for the duration of a request.
+
+    A single page view increments dozens of counters; sending each increment
+    to memcache as it happens costs one RPC per increment. Instead we sum the
+    deltas in a thread local buffer and send them all with one offset_multi()
+    call when the request ends.
+    """
+
+    KEY_PREFIX = 'counter:'
+    _THREAD_LOCAL = threading.local()
+
+    @classmethod
+    def _deltas(cls):
+        deltas = getattr(cls._THREAD_LOCAL, 'deltas', None)
+        if deltas is None:
+            deltas = collections.defaultdict(int)
+            cls._THREAD_LOCAL.deltas = deltas
+        return deltas
+
+    @classmethod
+    def make_key(cls, name):
+        return cls.KEY_PREFIX + name
+
+    @classmethod
+    def add(cls, name, delta):
+        cls._deltas()[name] += delta
+
+    @classmethod
+    def clear(cls):
+        cls._THREAD_LOCAL.deltas = None
+
+    @classmethod
+    def flush(cls):
+        """Sends all buffered deltas to memcache in one batch."""
+        deltas = cls._deltas()
+        cls.clear()
+        mapping = dict(
+            (cls.make_key(name), delta)
+            for name, delta in deltas.iteritems() if delta)
+        if not mapping:
+            return
+        try:
+            MemcacheManager.offset_multi(
+                mapping, namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        except:  # pylint: disable=bare-except
+            logging.exception('Failed to flush counters: %s', mapping)
+            return
+        counters.Registry.set_last_flushed_on(deltas.keys(), time.time())
+
+
 def incr_counter_global_value(name, delta):
     if CAN_AGGREGATE_COUNTERS.value:
-        MemcacheManager.incr(
-            'counter:' + name, delta,
-            namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        CounterDeltaBuffer.add(name, delta)
 
 
 def get_counter_global_value(name):
     if CAN_AGGREGATE_COUNTERS.value:
         return MemcacheManager.get(
-            'counter:' + name,
+            CounterDeltaBuffer.make_key(name),
             namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
     else:
         return None
 
+
+def flush_counter_global_values():
+    CounterDeltaBuffer.flush()
+
 counters.get_counter_global_value = get_counter_global_value
 counters.incr_counter_global_value = incr_counter_global_value
+counters.flush_counter_global_values = flush_counter_global_values
 
 DEPRECATED_CAN_SHARE_STUDENT_PROFILE = config.ConfigProperty(
     'gcb_can_share_student_profile', bool, '', default_value=False,
@@ -1701,17 +1851,24 @@ class EventEntity(BaseEntity):
                     source, user.user_id(), data_dict)
 
     @classmethod
-    def record(cls, source, user, data, user_id=None):
-        """Records new event into a datastore."""
-        data_dict = transforms.loads(data)
+    def create(cls, source, user, data_dict, user_id=None):
+        """Runs record hooks and returns a new, not yet saved, event.
+
+        Callers recording many events at once should create them all and
+        save them with a single db.put() or db.put_async().
+        """
         cls._run_record_hooks(source, user, data_dict)
-        data = transforms.dumps(data_dict)
 
         event = cls()
         event.source = source
         event.user_id = user_id if user_id else user.user_id()
-        event.data = data
-        event.put()
+        event.data = transforms.dumps(data_dict)
+        return event
+
+    @classmethod
+    def record(cls, source, user, data, user_id=None):
+        """Records new event into a datastore."""
+        cls.create(source, user, transforms.loads(data), user_id).put()
 
     def for_export(self, transform_fn):
         model = super(EventEntity, self).for_export(transform_fn)
@@ -1799,6 +1956,26 @@ class StudentPropertyEntity(BaseEntity):
                 MemcacheManager.set(cls._memcache_key(key), NO_OBJECT)
         return value
 
+    @classmethod
+    def get_multi(cls, students, property_name):
+        """Loads a student property for many students with one datastore RPC.
+
+        Args:
+          students: a list of Student objects.
+          property_name: the name of the property to load.
+
+        Returns:
+          A dict of {user_id: StudentPropertyEntity or None}; None is used for
+          students who do not have this property yet.
+        """
+        user_ids = [student.user_id for student in students]
+        keys = [
+            db.Key.from_path(cls.kind(), cls.create_key(user_id, property_name))
+            for user_id in user_ids]
+        if not keys:
+            return {}
+        return dict(zip(user_ids, get(keys)))
+
 
 class BaseJsonDao(object):
     """Base DAO class for entities storing their data in a single JSON blob."""
@@ -2581,6 +2758,29 @@ class LabelDAO(BaseJsonDao):
                     items.remove(item)
         return items
 
+    @classmethod
+    def get_course_track_labels_view_key(cls, course, student):
+        """Returns a hashable value identifying the outcome of track filtering.
+
+        Students with equal values keep the same items in
+        apply_course_track_labels_to_student_labels().
+        """
+        MemcacheManager.begin_readonly()
+        try:
+            track_labels = None
+            locale_labels = None
+            if student and not student.is_transient:
+                track_labels = frozenset(student.get_labels_of_type(
+                    LabelDTO.LABEL_TYPE_COURSE_TRACK))
+                locale_labels = frozenset(student.get_labels_of_type(
+                    LabelDTO.LABEL_TYPE_LOCALE))
+            if course.get_course_setting('can_student_change_locale'):
+                return (track_labels,
+                        course.app_context.get_current_locale())
+            return (track_labels, locale_labels)
+        finally:
+            MemcacheManager.end_readonly()
+
     @classmethod
     def apply_course_track_labels_to_student_labels(
         cls, course, student, items):
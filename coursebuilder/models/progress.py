@@ -16,6 +16,7 @@
 
 __author__ = 'Sean Lip (sll@google.com)'
 
+import collections
 import datetime
 import logging
 import os
@@ -41,6 +42,76 @@ TRACKABLE_COMPONENTS = [
 ]
 
 
+class DecodedProgress(object):
+    """Parsed, mutable form of the JSON value of a progress entity.
+
+    The tracker consults progress many times per request (twice per lesson
+    when rendering a unit, once per level of every cascaded update). Rather
+    than parse and re-serialize the whole JSON blob on every lookup, we parse
+    it once, attach the resulting object to the StudentPropertyEntity, mutate
+    it in place and only write it back to entity.value when it is dirty and
+    the entity is about to be saved.
+    """
+
+    ATTRIBUTE_NAME = '_decoded_progress'
+
+    def __init__(self, raw_value):
+        self._raw_value = raw_value
+        self._dirty = False
+        self._data = {}
+        if raw_value:
+            try:
+                self._data = transforms.loads(raw_value)
+            except (AttributeError, TypeError, ValueError):
+                logging.exception('Failed to parse progress: %s', raw_value)
+
+    def __reduce__(self):
+        # Never copy or pickle the decoded form along with the entity (e.g.
+        # when the entity is put into memcache); it is cheaply rebuilt from
+        # entity.value on first access.
+        return (DecodedProgress, (None,))
+
+    @classmethod
+    def of(cls, student_property):
+        """Returns the decoded form attached to the entity; decodes if needed."""
+        decoded = getattr(student_property, cls.ATTRIBUTE_NAME, None)
+        if decoded is None or (
+            not decoded.is_dirty and
+            decoded._raw_value is not student_property.value):
+            # Either never decoded or the value was replaced from outside.
+            decoded = cls(student_property.value)
+            setattr(student_property, cls.ATTRIBUTE_NAME, decoded)
+        return decoded
+
+    @classmethod
+    def flush(cls, student_property):
+        """Serializes pending changes into entity.value; call before put()."""
+        decoded = getattr(student_property, cls.ATTRIBUTE_NAME, None)
+        if decoded is not None and decoded.is_dirty:
+            student_property.value = transforms.dumps(decoded._data)
+            decoded._raw_value = student_property.value
+            decoded._dirty = False
+
+    @property
+    def is_dirty(self):
+        return self._dirty
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        if key not in self._data or self._data[key] != value:
+            self._data[key] = value
+            self._dirty = True
+
+    def inc(self, key, value=1):
+        self._data[key] = self._data.get(key, 0) + value
+        self._dirty = True
+
+    def items(self):
+        return self._data.items()
+
+
 class UnitLessonCompletionTracker(object):
     """Tracks student completion for a unit/lesson-based linear course."""
 
@@ -109,6 +180,8 @@ class UnitLessonCompletionTracker(object):
     def __init__(self, course):
         self._course = course
         self._progress_by_user_id = {}
+        self._batch_depth = 0
+        self._pending_user_ids = set()
 
     def _get_course(self):
         return self._course
@@ -126,65 +199,79 @@ class UnitLessonCompletionTracker(object):
             content, root_name, verify.Activity().scope, noverify_text)
         return activity
 
-    def _get_course_key(self):
+    @classmethod
+    def _get_course_key(cls):
         return '%s.0' % (
-            self.EVENT_CODE_MAPPING['course'],
+            cls.EVENT_CODE_MAPPING['course'],
         )
 
-    def _get_unit_key(self, unit_id):
-        return '%s.%s' % (self.EVENT_CODE_MAPPING['unit'], unit_id)
+    @classmethod
+    def _get_unit_key(cls, unit_id):
+        return '%s.%s' % (cls.EVENT_CODE_MAPPING['unit'], unit_id)
 
-    def _get_custom_unit_key(self, unit_id):
-        return '%s.%s' % (self.EVENT_CODE_MAPPING['custom_unit'], unit_id)
+    @classmethod
+    def _get_custom_unit_key(cls, unit_id):
+        return '%s.%s' % (cls.EVENT_CODE_MAPPING['custom_unit'], unit_id)
 
-    def _get_lesson_key(self, unit_id, lesson_id):
+    @classmethod
+    def _get_lesson_key(cls, unit_id, lesson_id):
         return '%s.%s.%s.%s' % (
-            self.EVENT_CODE_MAPPING['unit'], unit_id,
-            self.EVENT_CODE_MAPPING['lesson'], lesson_id
+            cls.EVENT_CODE_MAPPING['unit'], unit_id,
+            cls.EVENT_CODE_MAPPING['lesson'], lesson_id
         )
 
-    def _get_activity_key(self, unit_id, lesson_id):
+    @classmethod
+    def _get_activity_key(cls, unit_id, lesson_id):
         return '%s.%s.%s.%s.%s.%s' % (
-            self.EVENT_CODE_MAPPING['unit'], unit_id,
-            self.EVENT_CODE_MAPPING['lesson'], lesson_id,
-            self.EVENT_CODE_MAPPING['activity'], 0
+            cls.EVENT_CODE_MAPPING['unit'], unit_id,
+            cls.EVENT_CODE_MAPPING['lesson'], lesson_id,
+            cls.EVENT_CODE_MAPPING['activity'], 0
         )
 
-    def _get_html_key(self, unit_id, lesson_id):
+    @classmethod
+    def _get_html_key(cls, unit_id, lesson_id):
         return '%s.%s.%s.%s.%s.%s' % (
-            self.EVENT_CODE_MAPPING['unit'], unit_id,
-            self.EVENT_CODE_MAPPING['lesson'], lesson_id,
-            self.EVENT_CODE_MAPPING['html'], 0
+            cls.EVENT_CODE_MAPPING['unit'], unit_id,
+            cls.EVENT_CODE_MAPPING['lesson'], lesson_id,
+            cls.EVENT_CODE_MAPPING['html'], 0
         )
 
-    def _get_component_key(self, unit_id, lesson_id, component_id):
+    @classmethod
+    def _get_component_key(cls, unit_id, lesson_id, component_id):
         return '%s.%s.%s.%s.%s.%s.%s.%s' % (
-            self.EVENT_CODE_MAPPING['unit'], unit_id,
-            self.EVENT_CODE_MAPPING['lesson'], lesson_id,
-            self.EVENT_CODE_MAPPING['html'], 0,
-            self.EVENT_CODE_MAPPING['component'], component_id
+            cls.EVENT_CODE_MAPPING['unit'], unit_id,
+            cls.EVENT_CODE_MAPPING['lesson'], lesson_id,
+            cls.EVENT_CODE_MAPPING['html'], 0,
+            cls.EVENT_CODE_MAPPING['component'], component_id
         )
 
-    def _get_block_key(self, unit_id, lesson_id, block_id):
+    @classmethod
+    def _get_block_key(cls, unit_id, lesson_id, block_id):
         return '%s.%s.%s.%s.%s.%s.%s.%s' % (
-            self.EVENT_CODE_MAPPING['unit'], unit_id,
-            self.EVENT_CODE_MAPPING['lesson'], lesson_id,
-            self.EVENT_CODE_MAPPING['activity'], 0,
-            self.EVENT_CODE_MAPPING['block'], block_id
+            cls.EVENT_CODE_MAPPING['unit'], unit_id,
+            cls.EVENT_CODE_MAPPING['lesson'], lesson_id,
+            cls.EVENT_CODE_MAPPING['activity'], 0,
+            cls.EVENT_CODE_MAPPING['block'], block_id
         )
 
-    def _get_assessment_key(self, assessment_id):
+    @classmethod
+    def _make_assessment_key(cls, assessment_id, parent_unit_id=None):
         assessment_key = '%s.%s' % (
-            self.EVENT_CODE_MAPPING['assessment'], assessment_id)
+            cls.EVENT_CODE_MAPPING['assessment'], assessment_id)
 
         # If this assessment is used as a "lesson" within a unit, prepend
         # the unit identifier.
-        parent_unit = self._get_course().get_parent_unit(assessment_id)
-        if parent_unit:
-            assessment_key = '.'.join([self._get_unit_key(parent_unit.unit_id),
+        if parent_unit_id is not None:
+            assessment_key = '.'.join([cls._get_unit_key(parent_unit_id),
                                        assessment_key])
         return assessment_key
 
+    def _get_assessment_key(self, assessment_id):
+        return self._get_outline_index().get_assessment_key(assessment_id)
+
+    def _get_outline_index(self):
+        return self._get_course().get_outline_index()
+
     def get_entity_type_from_key(self, progress_entity_key):
         return progress_entity_key.split('.')[-2]
 
@@ -517,10 +604,11 @@ class UnitLessonCompletionTracker(object):
 
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
         course = self._get_course()
+        index = self._get_outline_index()
         # Next two lines are new in v1.11
         units, lessons = course.get_track_matching_student(student)
         for unit in units:   #  Old loop: for unit in course.get_track_matching_student(student):
-            if course.get_parent_unit(unit.unit_id):
+            if index.get_parent_unit_id(unit.unit_id) is not None:
                 # Completion of an assessment-as-lesson rolls up to its
                 # containing unit; it is not considered for overall course
                 # completion (except insofar as assessment completion
@@ -556,15 +644,16 @@ class UnitLessonCompletionTracker(object):
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
         # Check if all lessons in this unit have been completed.
-        lessons = self._get_course().get_lessons(unit_id)
-        for lesson in lessons:
-            if (self.get_lesson_status(
-                    progress,
-                    unit_id, lesson.lesson_id) != self.COMPLETED_STATE):
+        index = self._get_outline_index()
+        unit = index.find_unit(unit_id)
+        if not unit:
+            return
+        for lesson in index.get_lessons(unit_id):
+            if (self._get_entity_value(progress, lesson.key) !=
+                self.COMPLETED_STATE):
                 return
 
         # Check whether pre/post assessments in this unit have been completed.
-        unit = self._get_course().find_unit_by_id(unit_id)
         pre_assessment_id = unit.pre_assessment
         if (pre_assessment_id and
             not self.get_assessment_status(progress, pre_assessment_id)):
@@ -599,22 +688,21 @@ class UnitLessonCompletionTracker(object):
         # Record that at least one part of this lesson has been completed.
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
-        lessons = self._get_course().get_lessons(unit_id)
-        for lesson in lessons:
-            if str(lesson.lesson_id) == lesson_id and lesson:
-                # Is the activity completed?
-                if (lesson.activity and self.get_activity_status(
-                        progress, unit_id, lesson_id) != self.COMPLETED_STATE):
-                    if DEBUG:
-                      logging.debug('***RAM*** _update_lesson FOUND ACTIVITY NOT COMPLETED: ' + str(lesson_id))
-                    return
-
-                # Are all components of the lesson completed?
-                if (self.get_html_status(
-                        progress, unit_id, lesson_id) != self.COMPLETED_STATE):
-                    if DEBUG:
-                      logging.debug('***RAM*** _update_lesson FOUND COMPONENT NOT COMPLETED: ' + str(lesson_id))
-                    return
+        lesson = self._get_outline_index().find_lesson(unit_id, lesson_id)
+        if lesson:
+            # Is the activity completed?
+            if (lesson.has_activity and self._get_entity_value(
+                    progress, lesson.activity_key) != self.COMPLETED_STATE):
+                if DEBUG:
+                  logging.debug('***RAM*** _update_lesson FOUND ACTIVITY NOT COMPLETED: ' + str(lesson_id))
+                return
+
+            # Are all components of the lesson completed?
+            if (self._get_entity_value(
+                    progress, lesson.html_key) != self.COMPLETED_STATE):
+                if DEBUG:
+                  logging.debug('***RAM*** _update_lesson FOUND COMPONENT NOT COMPLETED: ' + str(lesson_id))
+                return
 
         # Record that all activities in this lesson have been completed.
         if DEBUG:
@@ -685,8 +773,7 @@ class UnitLessonCompletionTracker(object):
         if current_state == state or current_state == self.COMPLETED_STATE:
             return
         self._set_entity_value(progress, event_key, state)
-        progress.updated_on = datetime.datetime.now()
-        progress.put()
+        self._save_progress(progress)
 
     UPDATER_MAPPING = {
         'activity': _update_activity,
@@ -854,7 +941,8 @@ class UnitLessonCompletionTracker(object):
         event_key = self._get_lesson_key(unit_id, lesson_id)
         logging.debug('***RAM*** event_key = ' + str(event_key))
         self._update_lesson(progress, event_key, student)
-        progress.put() 
+        DecodedProgress.flush(progress)
+        progress.put()
         # END CUSTOMIZATION
        
         if not self.get_valid_component_ids(unit_id, lesson_id):
@@ -870,9 +958,43 @@ class UnitLessonCompletionTracker(object):
         self._update_event(
             student, progress, event_entity, event_key, direct_update=True)
 
+        self._save_progress(progress)
+
+    def _save_progress(self, progress):
+        """Serializes pending progress changes once and stores the entity."""
+        if self._batch_depth:
+            self._pending_user_ids.add(progress.key().name())
+            return
+        DecodedProgress.flush(progress)
         progress.updated_on = datetime.datetime.now()
         progress.put()
 
+    def begin_batch(self):
+        """Defers saving progress until the matching end_batch() call.
+
+        While a batch is open, get_or_create_progress() hands out the same
+        entity for a given student to every put_*() call, and saves of that
+        entity are postponed; end_batch() then stores each modified progress
+        entity exactly once.  Batches may be nested; only the outermost
+        end_batch() writes.
+        """
+        self._batch_depth += 1
+
+    def end_batch(self):
+        """Closes a batch opened by begin_batch(), saving modified progress."""
+        assert self._batch_depth > 0, 'end_batch() without begin_batch()'
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return
+        pending = [
+            progress for key_name, progress in
+            self._progress_by_user_id.iteritems()
+            if key_name in self._pending_user_ids]
+        self._progress_by_user_id = {}
+        self._pending_user_ids = set()
+        for progress in pending:
+            self._save_progress(progress)
+
     def _update_event(self, student, progress, event_entity, event_key,
                       direct_update=False):
         """Updates statistics for the given event, and for derived events.
@@ -1034,6 +1156,12 @@ class UnitLessonCompletionTracker(object):
 #             # progress entity via Course.get_progress_tracker().
 #             logging.warning('***RAM*** progess_by_user_id RETURNING ')
 #             return self._progress_by_user_id[student.user_id]
+        # Inside begin_batch()/end_batch() every update for a student must
+        # land on the same entity, or the deferred save would drop some.
+        key_name = StudentPropertyEntity.create_key(
+            student.user_id, self.PROPERTY_KEY)
+        if self._batch_depth and key_name in self._progress_by_user_id:
+            return self._progress_by_user_id[key_name]
         progress = StudentPropertyEntity.get(student, self.PROPERTY_KEY)
         if not progress:
             progress = StudentPropertyEntity.create(
@@ -1041,6 +1169,8 @@ class UnitLessonCompletionTracker(object):
             progress.put()
         #  Next line is new in 1.11
 #        self._progress_by_user_id[student.user_id] = progress
+        if self._batch_depth:
+            self._progress_by_user_id[key_name] = progress
         return progress
 
     def get_course_progress(self, student):
@@ -1071,67 +1201,123 @@ class UnitLessonCompletionTracker(object):
 
         return result
 
-    def get_unit_percent_complete(self, student):
-        """Returns a dict with each unit's completion in [0.0, 1.0]."""
-        if student.is_transient:
-            return {}
+    def get_progress_multi(self, students):
+        """Loads progress entities of many students with one datastore RPC.
 
-        course = self._get_course()
-        units = course.get_units()
-        assessment_scores = {int(s['id']): s['score'] / 100.0
-                             for s in course.get_all_scores(student)}
+        Unlike get_or_create_progress(), this never writes to the datastore.
+        Students without a stored progress entity get a new, unsaved entity
+        with no progress recorded.
+
+        Args:
+          students: a list of Student objects.
+
+        Returns:
+          A dict of {user_id: StudentPropertyEntity}.
+        """
+        students = [
+            student for student in students if not student.is_transient]
+        result = StudentPropertyEntity.get_multi(students, self.PROPERTY_KEY)
+        for student in students:
+            if not result.get(student.user_id):
+                result[student.user_id] = StudentPropertyEntity.create(
+                    student=student, property_name=self.PROPERTY_KEY)
+        return result
+
+    def _get_assessment_scores(self, student):
+        """Returns a dict of {unit_id: score in [0.0, 1.0]} for assessments."""
+        scores = transforms.loads(student.scores) if student.scores else {}
+        return {
+            int(unit_id): score / 100.0 for unit_id, score in scores.items()
+            if unit_id.isdigit()}
+
+    def _compute_unit_percent_complete(
+        self, index, progress, assessment_scores):
+        decoded = DecodedProgress.of(progress)
         result = {}
-        progress = self.get_or_create_progress(student)
-        for unit in units:
+        for unit in index.units:
+            lessons = index.get_lessons(unit.unit_id)
             # Assessments are scored as themselves.
             if unit.type == verify.UNIT_TYPE_ASSESSMENT:
-                result[unit.unit_id] = assessment_scores[unit.unit_id]
+                result[unit.unit_id] = assessment_scores.get(unit.unit_id, 0)
             elif unit.type == verify.UNIT_TYPE_UNIT:
                 if (unit.pre_assessment and
-                    assessment_scores[unit.pre_assessment] >= 1.0):
+                    assessment_scores.get(unit.pre_assessment, 0) >= 1.0):
                     # Use pre-assessment iff it exists and student scored 100%
                     result[unit.unit_id] = 1.0
+                elif not lessons:
+                    result[unit.unit_id] = 0.0
                 else:
                     # Otherwise, count % completion on lessons within unit.
                     num_completed = 0
-                    lesson_progress = self.get_lesson_progress(
-                        student, unit.unit_id, progress=progress)
-                    if not lesson_progress:
-                        result[unit.unit_id] = 0.0
-                    else:
-                        for lesson in lesson_progress.values():
-                            if lesson['has_activity']:
-                                # Lessons that have activities must be
-                                # activity-complete as well as HTML complete.
-                                if (lesson['html'] == self.COMPLETED_STATE and
-                                    lesson['activity'] == self.COMPLETED_STATE):
-                                    num_completed += 1
-                            else:
-                                # Lessons without activities just need HTML
-                                if lesson['html'] == self.COMPLETED_STATE:
-                                    num_completed += 1
-                        result[unit.unit_id] = round(
-                            num_completed / float(len(lesson_progress)), 3)
+                    for lesson in lessons:
+                        if decoded.get(lesson.html_key) != self.COMPLETED_STATE:
+                            continue
+                        # Lessons that have activities must be activity-complete
+                        # as well as HTML complete.
+                        if (lesson.has_activity and
+                            decoded.get(lesson.activity_key) !=
+                            self.COMPLETED_STATE):
+                            continue
+                        num_completed += 1
+                    result[unit.unit_id] = round(
+                        num_completed / float(len(lessons)), 3)
+        return result
+
+    def get_unit_percent_complete(self, student):
+        """Returns a dict with each unit's completion in [0.0, 1.0]."""
+        if student.is_transient:
+            return {}
+
+        result = self._compute_unit_percent_complete(
+            self._get_outline_index(),
+            self.get_or_create_progress(student),
+            self._get_assessment_scores(student))
         if DEBUG:
           logging.debug('***RAM*** get_unit_progress result ' + str(result))
         return result
 
+    def get_unit_percent_complete_multi(self, students, progress_multi=None):
+        """Computes get_unit_percent_complete() for many students at once.
+
+        Progress entities are fetched with one datastore RPC (or taken from
+        progress_multi, as returned by get_progress_multi(), if given) and
+        completion is rolled up over the shared course outline index. No
+        progress entities are created.
+
+        Args:
+          students: a list of Student objects.
+          progress_multi: optional dict of {user_id: StudentPropertyEntity}.
+
+        Returns:
+          A dict of {user_id: {unit_id: completion in [0.0, 1.0]}}.
+        """
+        students = [
+            student for student in students if not student.is_transient]
+        if progress_multi is None:
+            progress_multi = self.get_progress_multi(students)
+        index = self._get_outline_index()
+        result = {}
+        for student in students:
+            result[student.user_id] = self._compute_unit_percent_complete(
+                index, progress_multi[student.user_id],
+                self._get_assessment_scores(student))
+        return result
+
     def get_lesson_progress(self, student, unit_id, progress=None):
         """Returns a dict saying which lessons in this unit are completed."""
         if student.is_transient:
             return {}
 
-        lessons = self._get_course().get_lessons(unit_id)
+        lessons = self._get_outline_index().get_lessons(unit_id)
         if progress is None:
             progress = self.get_or_create_progress(student)
 
         result = {}
         for lesson in lessons:
             result[lesson.lesson_id] = {
-                'html': self.get_html_status(
-                    progress, unit_id, lesson.lesson_id) or 0,
-                'activity': self.get_activity_status(
-                    progress, unit_id, lesson.lesson_id) or 0,
+                'html': self._get_entity_value(progress, lesson.html_key) or 0,
+                'activity': self._get_entity_value(
+                    progress, lesson.activity_key) or 0,
                 'has_activity': lesson.has_activity,
             }
         if DEBUG:
@@ -1151,15 +1337,14 @@ class UnitLessonCompletionTracker(object):
 #             progress, unit_id, lesson_id, cpt_id) or 0
 
     def _get_entity_value(self, progress, event_key):
-        if not progress.value:
-            return None
-        return transforms.loads(progress.value).get(event_key)
+        return DecodedProgress.of(progress).get(event_key)
 
     def _set_entity_value(self, student_property, key, value):
         """Sets the integer value of a student property.
 
         Note: this method does not commit the change. The calling method should
-        call put() on the StudentPropertyEntity.
+        call _save_progress() (or DecodedProgress.flush() and put()) on the
+        StudentPropertyEntity.
 
         Args:
           student_property: the StudentPropertyEntity
@@ -1168,35 +1353,21 @@ class UnitLessonCompletionTracker(object):
         """
         if DEBUG:
           logging.debug('***RAM*** set entity value ' + str(key) + ' =  ' + str(value))
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        progress_dict[key] = value
-        student_property.value = transforms.dumps(progress_dict)
+        DecodedProgress.of(student_property).set(key, value)
 
     def _inc(self, student_property, key, value=1):
         """Increments the integer value of a student property.
 
         Note: this method does not commit the change. The calling method should
-        call put() on the StudentPropertyEntity.
+        call _save_progress() (or DecodedProgress.flush() and put()) on the
+        StudentPropertyEntity.
 
         Args:
           student_property: the StudentPropertyEntity
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        if key not in progress_dict:
-            progress_dict[key] = 0
-
-        progress_dict[key] += value
-        student_property.value = transforms.dumps(progress_dict)
+        DecodedProgress.of(student_property).inc(key, value)
 
     @classmethod
     def get_elements_from_key(cls, key):
@@ -1232,6 +1403,108 @@ class UnitLessonCompletionTracker(object):
         return result
 
 
+OutlineUnit = collections.namedtuple('OutlineUnit', [
+    'unit_id', 'type', 'key', 'lesson_ids',
+    'pre_assessment', 'post_assessment'])
+
+OutlineLesson = collections.namedtuple('OutlineLesson', [
+    'unit_id', 'lesson_id', 'key', 'html_key', 'activity_key',
+    'has_activity'])
+
+
+class CourseOutlineIndex(object):
+    """An immutable, precomputed outline of a course for progress roll-ups.
+
+    Holds the course units and lessons in order, their parent/child
+    relationships and their progress event keys, so that the tracker can
+    roll up progress with dictionary lookups instead of scanning the lists of
+    units and lessons and formatting key strings over and over again.
+
+    The index is built when the course model is indexed (i.e. when the course
+    is loaded from persistence or modified) and is stored with the course
+    in memcache, so it is rebuilt only when the course version changes.
+    """
+
+    def __init__(self, units=None, lessons=None, parent_unit_ids=None):
+        self._units = tuple(units or [])
+        self._units_by_id = dict(
+            (str(unit.unit_id), unit) for unit in self._units)
+        self._lessons_by_id = dict(
+            ((str(lesson.unit_id), str(lesson.lesson_id)), lesson)
+            for lesson in lessons or [])
+        self._parent_unit_ids = dict(parent_unit_ids or {})
+        self._assessment_keys = dict(
+            (unit_id, UnitLessonCompletionTracker._make_assessment_key(
+                unit.unit_id, self._parent_unit_ids.get(unit_id)))
+            for unit_id, unit in self._units_by_id.iteritems()
+            if unit.type == verify.UNIT_TYPE_ASSESSMENT)
+
+    @classmethod
+    def build(cls, model):
+        """Builds the index from a course model (or a courses.Course)."""
+        tracker = UnitLessonCompletionTracker
+        all_units = model.get_units()
+
+        # The first unit using an assessment as pre/post assessment owns it.
+        parent_unit_ids = {}
+        for unit in all_units:
+            for assessment_id in [unit.pre_assessment, unit.post_assessment]:
+                if assessment_id is not None:
+                    parent_unit_ids.setdefault(
+                        str(assessment_id), unit.unit_id)
+
+        units = []
+        lessons = []
+        for unit in all_units:
+            lesson_ids = []
+            for lesson in model.get_lessons(unit.unit_id):
+                lesson_ids.append(lesson.lesson_id)
+                lessons.append(OutlineLesson(
+                    unit.unit_id, lesson.lesson_id,
+                    tracker._get_lesson_key(unit.unit_id, lesson.lesson_id),
+                    tracker._get_html_key(unit.unit_id, lesson.lesson_id),
+                    tracker._get_activity_key(unit.unit_id, lesson.lesson_id),
+                    bool(lesson.has_activity)))
+            if unit.type == verify.UNIT_TYPE_CUSTOM:
+                key = tracker._get_custom_unit_key(unit.unit_id)
+            else:
+                key = tracker._get_unit_key(unit.unit_id)
+            units.append(OutlineUnit(
+                unit.unit_id, unit.type, key, tuple(lesson_ids),
+                unit.pre_assessment, unit.post_assessment))
+        return cls(units=units, lessons=lessons, parent_unit_ids=parent_unit_ids)
+
+    @property
+    def units(self):
+        return self._units
+
+    def get_units_of_type(self, unit_type):
+        return [unit for unit in self._units if unit.type == unit_type]
+
+    def find_unit(self, unit_id):
+        return self._units_by_id.get(str(unit_id))
+
+    def find_lesson(self, unit_id, lesson_id):
+        return self._lessons_by_id.get((str(unit_id), str(lesson_id)))
+
+    def get_lessons(self, unit_id):
+        unit = self.find_unit(unit_id)
+        if not unit:
+            return []
+        return [self.find_lesson(unit_id, lesson_id)
+                for lesson_id in unit.lesson_ids]
+
+    def get_parent_unit_id(self, unit_id):
+        return self._parent_unit_ids.get(str(unit_id))
+
+    def get_assessment_key(self, assessment_id):
+        key = self._assessment_keys.get(str(assessment_id))
+        if key is None:
+            key = UnitLessonCompletionTracker._make_assessment_key(
+                assessment_id, self.get_parent_unit_id(assessment_id))
+        return key
+
+
 class ProgressStats(object):
     """Defines the course structure definition for course progress tracking."""
 
@@ -1304,28 +1577,32 @@ class ProgressStats(object):
     def _get_course(self):
         return self._course
 
+    def _get_outline_index(self):
+        return self._get_course().get_outline_index()
+
     def _get_unit_ids_of_type_unit(self):
-        units = self._get_course().get_units_of_type(verify.UNIT_TYPE_UNIT)
+        units = self._get_outline_index().get_units_of_type(
+            verify.UNIT_TYPE_UNIT)
         return [unit.unit_id for unit in units]
 
     def _get_assessment_ids(self):
         contained = set()
-        for unit in self._get_course().get_units_of_type(verify.UNIT_TYPE_UNIT):
+        index = self._get_outline_index()
+        for unit in index.get_units_of_type(verify.UNIT_TYPE_UNIT):
             if unit.pre_assessment:
                 contained.add(unit.pre_assessment)
             if unit.post_assessment:
                 contained.add(unit.post_assessment)
 
-        assessments = self._get_course().get_assessment_list()
+        assessments = index.get_units_of_type(verify.UNIT_TYPE_ASSESSMENT)
         return [a.unit_id for a in assessments if a.unit_id not in contained]
 
     def _get_lesson_ids(self, unit_id):
-        lessons = self._get_course().get_lessons(unit_id)
-        return [lesson.lesson_id for lesson in lessons]
+        return list(self._get_outline_index().find_unit(unit_id).lesson_ids)
 
     def _get_activity_ids(self, unit_id, lesson_id):
-        unit = self._get_course().find_unit_by_id(unit_id)
-        if self._get_course().find_lesson_by_id(unit, lesson_id).activity:
+        if self._get_outline_index().find_lesson(
+                unit_id, lesson_id).has_activity:
             return [0]
         return []
 
@@ -1383,7 +1660,7 @@ class ProgressStats(object):
 
     def _get_pre_post_assessments(self, unit_id):
         ret = []
-        unit = self._get_course().find_unit_by_id(unit_id)
+        unit = self._get_outline_index().find_unit(unit_id)
         if unit.pre_assessment:
             ret.append(unit.pre_assessment)
         if unit.post_assessment:
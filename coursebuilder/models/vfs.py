@@ -16,11 +16,13 @@
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import bisect
 import datetime
 import os
 import re
 import sys
 import threading
+import time
 import unittest
 
 from config import ConfigProperty
@@ -49,6 +51,13 @@ _MAX_VFS_SHARD_SIZE = 1000 * 1000
 # Max number of shards for a single VFS cached file.
 _MAX_VFS_NUM_SHARDS = 4
 
+# Files larger than this are read from the datastore one shard at a time
+# when needed and are never held in the in-process cache.
+MAX_CACHED_FILE_SIZE_BYTES = MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES
+
+# Sorts after any character of a file name; bounds key range queries.
+_MAX_UNICODE_CHAR = u'\U0010ffff'
+
 # Global memcache controls.
 CAN_USE_VFS_IN_PROCESS_CACHE = ConfigProperty(
     'gcb_can_use_vfs_in_process_cache', bool,
@@ -103,6 +112,10 @@ class AbstractFileSystem(object):
         """Returns a stream with the file content, similar to open(...)."""
         return self._impl.get(filename)
 
+    def get_metadata(self, filename):
+        """Returns file metadata without loading the file content, or None."""
+        return self._impl.get_metadata(filename)
+
     def get(self, filename):
         """Returns bytes with the file content, but no metadata."""
         return self.open(filename).read()
@@ -136,6 +149,15 @@ class AbstractFileSystem(object):
         return stream.metadata.is_draft
 
 
+class LocalFileMetadata(object):
+    """Metadata of a local file; mirrors the fields of FileMetadataEntity."""
+
+    def __init__(self, updated_on, size):
+        self.updated_on = updated_on
+        self.size = size
+        self.is_draft = False
+
+
 class LocalReadOnlyFileSystem(object):
     """A read-only file system serving only local files."""
 
@@ -180,6 +202,13 @@ class LocalReadOnlyFileSystem(object):
             return None
         return open(self._logical_to_physical(filename), 'rb')
 
+    def get_metadata(self, filename):
+        if not self.isfile(filename):
+            return None
+        stat = os.stat(self._logical_to_physical(filename))
+        return LocalFileMetadata(
+            datetime.datetime.utcfromtimestamp(stat.st_mtime), stat.st_size)
+
     def put(self, unused_filename, unused_stream):
         raise Exception('Not implemented.')
 
@@ -233,24 +262,143 @@ class FileDataEntity(BaseEntity):
     data = db.BlobProperty()
 
 
+class FileTombstoneEntity(BaseEntity):
+    """A marker of a deleted file; absolute file name is a key.
+
+    Deleting the metadata of a file leaves nothing behind for other instances
+    to find when they query for files updated since they last looked, so they
+    would keep serving the file from their caches. The tombstone is stamped
+    with the time of deletion and is found by that query instead.
+
+    A tombstone is removed when a file of the same name is put again, and
+    once it is older than CacheFileEntry.CACHE_ENTRY_TTL_SEC, by which time
+    every entry cached before the deletion has expired.
+    """
+    updated_on = db.DateTimeProperty(indexed=True)
+
+    # Maximum number of expired tombstones removed on one delete().
+    MAX_EXPIRED_TO_DELETE = 100
+
+    @classmethod
+    def make_key(cls, filename):
+        return db.Key.from_path(cls.kind(), filename)
+
+    @classmethod
+    def delete_expired(cls):
+        """Removes tombstones no cache entry can be older than."""
+        expired_on = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=CacheFileEntry.CACHE_ENTRY_TTL_SEC)
+        keys = cls.all(keys_only=True).filter(
+            'updated_on < ', expired_on).fetch(cls.MAX_EXPIRED_TO_DELETE)
+        if keys:
+            db.delete(keys)
+
+
 class FileStreamWrapped(object):
     """A class that wraps a file stream, but adds extra attributes to it."""
 
     def __init__(self, metadata, data):
         self._metadata = metadata
         self._data = data
+        self._position = 0
 
-    def read(self):
-        """Emulates stream.read(). Returns all bytes and emulates EOF."""
-        data = self._data
-        self._data = ''
-        return data
+    def read(self, size=-1):
+        """Emulates stream.read(). Returns bytes and emulates EOF."""
+        start = self._position
+        end = len(self._data) if size < 0 else start + size
+        self._position = max(start, min(end, len(self._data)))
+        return self._data[start:self._position]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = _get_seek_position(
+            self._position, len(self._data), offset, whence)
+
+    def tell(self):
+        return self._position
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def has_data(self):
+        """False for a file whose metadata was cached but not its content."""
+        return self._data is not None
+
+
+class FileStreamSharded(object):
+    """A file stream that fetches the data shards of a file as needed.
+
+    Reading from a shard starts fetching the next one in the background, so
+    sequential reads rarely wait for the datastore.
+    """
+
+    def __init__(self, metadata, keys):
+        self._metadata = metadata
+        self._keys = keys
+        self._position = 0
+        self._shard_index = None
+        self._shard_data = None
+        self._next_shard_rpc = None
+
+    def _fetch_shard(self, index):
+        if self._next_shard_rpc and self._next_shard_rpc[0] == index:
+            entity = self._next_shard_rpc[1].get_result()
+        else:
+            entity = db.get(self._keys[index])
+        self._next_shard_rpc = None
+        if index + 1 < len(self._keys):
+            self._next_shard_rpc = (
+                index + 1, db.get_async(self._keys[index + 1]))
+        if not entity:
+            raise IOError('Missing data shard %s.' % self._keys[index].name())
+        return entity.data
+
+    def _get_shard(self, index):
+        if index != self._shard_index:
+            self._shard_data = self._fetch_shard(index)
+            self._shard_index = index
+        return self._shard_data
+
+    def read(self, size=-1):
+        """Emulates stream.read(). Returns bytes and emulates EOF."""
+        end = self._metadata.size
+        if size >= 0:
+            end = min(end, self._position + size)
+        chunks = []
+        while self._position < end:
+            index = self._position // _MAX_VFS_SHARD_SIZE
+            offset = self._position - index * _MAX_VFS_SHARD_SIZE
+            chunk = self._get_shard(index)[
+                offset:offset + end - self._position]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self._position += len(chunk)
+        return ''.join(chunks)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = _get_seek_position(
+            self._position, self._metadata.size, offset, whence)
+
+    def tell(self):
+        return self._position
 
     @property
     def metadata(self):
         return self._metadata
 
 
+def _get_seek_position(position, size, offset, whence):
+    if whence == os.SEEK_CUR:
+        offset += position
+    elif whence == os.SEEK_END:
+        offset += size
+    if offset < 0:
+        raise IOError('Invalid argument.')
+    return offset
+
+
 class StringStream(object):
     """A wrapper to pose a string as a UTF-8 byte stream."""
 
@@ -316,7 +464,8 @@ class ProcessScopedVfsCache(caching.ProcessScopedSingleton):
     def __init__(self):
         self._cache = caching.LRUCache(
             max_size_bytes=MAX_GLOBAL_CACHE_SIZE_BYTES,
-            max_item_size_bytes=MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES)
+            max_item_size_bytes=MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES,
+            name='vfs')
         self._cache.get_entry_size = self._get_entry_size
 
     def _get_entry_size(self, key, value):
@@ -339,7 +488,11 @@ VFS_CACHE_SIZE_BYTES.poll_value = ProcessScopedVfsCache.get_vfs_cache_size
 
 
 class CacheFileEntry(caching.AbstractCacheEntry):
-    """Cache entry representing a file."""
+    """Cache entry representing a file, or only its metadata if body is None."""
+
+    # Deletions are tracked with FileTombstoneEntity, so entries only need to
+    # expire to bound the damage of changes made behind the back of the VFS.
+    CACHE_ENTRY_TTL_SEC = 60 * 60
 
     def __init__(self, filename, metadata, body):
         self.filename = filename
@@ -373,15 +526,69 @@ class CacheFileEntry(caching.AbstractCacheEntry):
 
     @classmethod
     def internalize(cls, key, metadata, data):
-        if metadata and data:
+        if metadata:
             return CacheFileEntry(key, metadata, data)
         return None
 
 
+class CacheListingEntry(caching.AbstractCacheEntry):
+    """Cache entry representing the files in a directory."""
+
+    CACHE_ENTRY_TTL_SEC = CacheFileEntry.CACHE_ENTRY_TTL_SEC
+
+    def __init__(self, filenames, updated_on):
+        self.filenames = sorted(filenames)
+        self._updated_on = updated_on
+        self.created_on = datetime.datetime.utcnow()
+
+    def getsizeof(self):
+        return (
+            sys.getsizeof(self.filenames) +
+            sum(sys.getsizeof(filename) for filename in self.filenames) +
+            sys.getsizeof(self._updated_on) +
+            sys.getsizeof(self.created_on))
+
+    def contains(self, filename):
+        index = bisect.bisect_left(self.filenames, filename)
+        return (
+            index < len(self.filenames) and self.filenames[index] == filename)
+
+    def updated_on(self):
+        return self._updated_on
+
+
+class VfsCacheNamespaceIndex(caching.CacheNamespaceIndex):
+    """Also tracks which of the entries of a namespace are listings.
+
+    There are far fewer listings than files, so finding the listings a
+    changed file is in does not require scanning all keys.
+    """
+
+    def __init__(self):
+        super(VfsCacheNamespaceIndex, self).__init__()
+        self.listing_keys = set()
+
+
+class NoopVfsCacheConnection(caching.NoopCacheConnection):
+    """Connection to no-op cache that also caches no directory listings."""
+
+    def get_listing(self, *unused_args, **unused_kwargs):
+        return None
+
+    def put_listing(self, *unused_args, **unused_kwargs):
+        return None
+
+
 class VfsCacheConnection(caching.AbstractCacheConnection):
 
     PERSISTENT_ENTITY = FileMetadataEntity
+    TOMBSTONE_ENTITY = FileTombstoneEntity
     CACHE_ENTRY = CacheFileEntry
+    NAMESPACE_INDEX = VfsCacheNamespaceIndex
+
+    # All writes to the file system in this process invalidate the cache
+    # directly; only changes made by other instances need to be queried for.
+    RESYNC_INTERVAL_SEC = 5
 
     @classmethod
     def init_counters(cls):
@@ -395,14 +602,93 @@ class VfsCacheConnection(caching.AbstractCacheConnection):
             'gcb-models-VfsCacheConnection-cache-inherited',
             'A number of times an object was obtained from the inherited vfs.')
 
+    # Directory listings share the cache with the files, under keys that
+    # can't clash with the absolute names of the files.
+    LISTING_KEY_PREFIX = 'listing:'
+
     @classmethod
     def is_enabled(cls):
         return CAN_USE_VFS_IN_PROCESS_CACHE.value
 
+    @classmethod
+    def new_connection(cls, *args, **kwargs):
+        if not cls.is_enabled():
+            return NoopVfsCacheConnection()
+        return super(VfsCacheConnection, cls).new_connection(*args, **kwargs)
+
     def __init__(self, namespace):
         super(VfsCacheConnection, self).__init__(namespace)
         self.cache = ProcessScopedVfsCache.instance().cache
 
+    def _make_listing_key(self, dir_name):
+        return self.make_key(
+            self.namespace, '%s%s' % (self.LISTING_KEY_PREFIX, dir_name))
+
+    def get_listing(self, dir_name):
+        """Returns sorted names of the files under dir_name, or None."""
+        _key = self._make_listing_key(dir_name)
+        found, entry = self.cache.get(_key)
+        if not found or not entry:
+            return None
+        if entry.has_expired():
+            self.CACHE_EXPIRE.inc()
+            self._cache_delete(_key)
+            return None
+        return entry.filenames
+
+    def put_listing(self, dir_name, metadatas):
+        """Caches the names of the files under dir_name from their metadata."""
+        updated_on = max([
+            metadata.updated_on for metadata in metadatas
+            if metadata.updated_on] or [None])
+        entry = CacheListingEntry(
+            [metadata.key().name() for metadata in metadatas], updated_on)
+        _key = self._make_listing_key(dir_name)
+        if self.cache.put(_key, entry):
+            self._index_put(_key, entry)
+            self._get_namespace_index().listing_keys.add(_key)
+
+    def _index_delete(self, _key):
+        super(VfsCacheConnection, self)._index_delete(_key)
+        self._get_namespace_index().listing_keys.discard(_key)
+
+    def _delete_stale_listings(self, updates):
+        """Drops listings the files were added to or removed from.
+
+        Listings are only kept up to date for changes to the content of
+        the files they already contain; any other change to a file drops
+        all listings of the directories it is in.
+
+        Args:
+            updates: dict. Maps the names of changed files to their new
+                metadata, or to None if they were deleted.
+        """
+        if not updates:
+            return
+        prefix = self._make_listing_key('')
+        for _key in list(self._get_namespace_index().listing_keys):
+            dir_name = _key[len(prefix):]
+            entry = None
+            for filename, update in updates.iteritems():
+                if not filename.startswith(dir_name):
+                    continue
+                if entry is None:
+                    found, entry = self.cache.get(_key)
+                    entry = entry if found else False
+                if entry and update and entry.contains(filename):
+                    continue
+                self.CACHE_EVICT.inc()
+                self._cache_delete(_key)
+                break
+
+    def apply_updates(self, updates):
+        super(VfsCacheConnection, self).apply_updates(updates)
+        self._delete_stale_listings(updates)
+
+    def delete(self, key):
+        super(VfsCacheConnection, self).delete(key)
+        self._delete_stale_listings({key: None})
+
 
 VfsCacheConnection.init_counters()
 
@@ -555,29 +841,36 @@ class DatastoreBackedFileSystem(object):
         """Gets a file from a datastore. Raw bytes stream, no encodings."""
         filename = self._logical_to_physical(afilename)
         found, stream = self.cache.get(filename)
-        if found and stream:
+        if found and stream and stream.has_data:
             return stream
-        if not found:
+        metadata = None
+        if found and stream:
+            # Only the metadata was cached, e.g. by get_metadata().
+            metadata = stream.metadata
+        elif not found:
             metadata = FileMetadataEntity.get_by_key_name(filename)
-            if metadata:
-                keys = self._generate_file_key_names(filename, metadata.size)
-                data_shards = []
-                for data_entity in FileDataEntity.get_by_key_name(keys):
-                    data_shards.append(data_entity.data)
-                data = ''.join(data_shards)
-                # TODO: Note that this will ask the cache to accept
-                # potentially very large items.  The caching strategy both
-                # for in-memory and Memcache should be revisited to
-                # determine how best to address chunking strategies.
-                self.cache.put(filename, metadata, data)
-                return FileStreamWrapped(metadata, data)
-
-            # lets us cache the (None, None) so next time we asked for this key
-            # we fall right into the inherited section without trying to load
-            # the metadata/data from the datastore; if a new object with this
-            # key is added in the datastore, we will see it in the update list
-            VfsCacheConnection.CACHE_NO_METADATA.inc()
-            self.cache.put(filename, None, None)
+            if not metadata:
+                # lets us cache the (None, None) so next time we asked for this
+                # key we fall right into the inherited section without trying
+                # to load the metadata/data from the datastore; if a new object
+                # with this key is added in the datastore, we will see it in
+                # the update list
+                VfsCacheConnection.CACHE_NO_METADATA.inc()
+                self.cache.put(filename, None, None)
+        if metadata:
+            keys = self._generate_file_key_names(filename, metadata.size)
+            if metadata.size > MAX_CACHED_FILE_SIZE_BYTES:
+                if not found:
+                    self.cache.put(filename, metadata, None)
+                return FileStreamSharded(metadata, [
+                    db.Key.from_path(FileDataEntity.kind(), key)
+                    for key in keys])
+            data_shards = []
+            for data_entity in FileDataEntity.get_by_key_name(keys):
+                data_shards.append(data_entity.data)
+            data = ''.join(data_shards)
+            self.cache.put(filename, metadata, data)
+            return FileStreamWrapped(metadata, data)
 
         result = None
         if self._inherits_from and self._can_inherit(filename):
@@ -588,6 +881,24 @@ class DatastoreBackedFileSystem(object):
         VfsCacheConnection.CACHE_NOT_FOUND.inc()
         return None
 
+    def get_metadata(self, afilename):
+        """Gets file metadata; the content is not loaded unless cached."""
+        filename = self._logical_to_physical(afilename)
+        found, stream = self.cache.get(filename)
+        if found and stream:
+            return stream.metadata
+        if not found:
+            metadata = FileMetadataEntity.get_by_key_name(filename)
+            if metadata:
+                # Only the metadata is cached; open() adds the content.
+                self.cache.put(filename, metadata, None)
+                return metadata
+            VfsCacheConnection.CACHE_NO_METADATA.inc()
+            self.cache.put(filename, None, None)
+        if self._inherits_from and self._can_inherit(filename):
+            return self._inherits_from.get_metadata(afilename)
+        return None
+
     def put(self, filename, stream, is_draft=False, metadata_only=False):
         """Puts a file stream to a database. Raw bytes stream, no encodings."""
         if stream:  # Must be outside the transactional operation
@@ -669,6 +980,7 @@ class DatastoreBackedFileSystem(object):
             entities_put(shard_entities)
 
         metadata.put()
+        db.delete(FileTombstoneEntity.make_key(filename))
         self.cache.delete(filename)
 
     def put_multi_async(self, filedata_list):
@@ -723,34 +1035,53 @@ class DatastoreBackedFileSystem(object):
 
         data_future = db.put_async(data_list)
         metadata_future = db.put_async(metadata_list)
+        tombstone_future = db.delete_async([
+            FileTombstoneEntity.make_key(filename)
+            for filename in filename_list])
 
         def wait_and_finalize():
             data_future.check_success()
             metadata_future.check_success()
+            tombstone_future.check_success()
 
         return wait_and_finalize
 
-    @db.transactional(xg=True)
     def delete(self, filename):
+        self._transactional_delete(filename)
+
+        # Queries can't run in a transaction; an enclosing one leaves expired
+        # tombstones for the next delete() to remove.
+        if not db.is_in_transaction():
+            FileTombstoneEntity.delete_expired()
+
+    @db.transactional(xg=True)
+    def _transactional_delete(self, filename):
         filename = self._logical_to_physical(filename)
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if metadata:
             metadata.delete()
+            FileTombstoneEntity(
+                key_name=filename,
+                updated_on=datetime.datetime.utcnow()).put()
         data = FileDataEntity(key_name=filename)
         if data:
             data.delete()
         self.cache.delete(filename)
 
     def isfile(self, afilename):
-        """Checks file existence by looking up the datastore row."""
-        filename = self._logical_to_physical(afilename)
-        metadata = FileMetadataEntity.get_by_key_name(filename)
-        if metadata:
-            return True
-        result = False
-        if self._inherits_from and self._can_inherit(filename):
-            result = self._inherits_from.isfile(afilename)
-        return result
+        """Checks file existence by looking up the cache or datastore row."""
+        return self.get_metadata(afilename) is not None
+
+    @classmethod
+    def _make_prefix_query(cls, prefix):
+        """Queries metadata of all files whose names start with prefix."""
+        query = FileMetadataEntity.all()
+        if prefix:
+            kind = FileMetadataEntity.kind()
+            query.filter('__key__ >=', db.Key.from_path(kind, prefix))
+            query.filter('__key__ <', db.Key.from_path(
+                kind, prefix + _MAX_UNICODE_CHAR))
+        return query
 
     def list(self, dir_name, include_inherited=False):
         """Lists all files in a directory by using datastore query.
@@ -765,12 +1096,14 @@ class DatastoreBackedFileSystem(object):
             recursively found in dir_name.
         """
         dir_name = self._logical_to_physical(dir_name)
-        result = set()
-        keys = FileMetadataEntity.all(keys_only=True)
-        for key in keys.fetch(1000):
-            filename = key.name()
-            if filename.startswith(dir_name):
-                result.add(self._physical_to_logical(filename))
+        filenames = self.cache.get_listing(dir_name)
+        if filenames is None:
+            metadatas = list(caching.iter_all(
+                self._make_prefix_query(dir_name), batch_size=1000))
+            self.cache.put_listing(dir_name, metadatas)
+            filenames = [metadata.key().name() for metadata in metadatas]
+        result = set(
+            self._physical_to_logical(filename) for filename in filenames)
         if include_inherited and self._inherits_from:
             for inheritable_folder in self._inheritable_folders:
                 logical_folder = self._physical_to_logical(inheritable_folder)
@@ -947,6 +1280,44 @@ class VfsTests(unittest.TestCase):
         self.assertFalse(found)
         self.assertEquals(stream, None)
 
+    def test_most_recent_updated_on_is_tracked(self):
+        ProcessScopedVfsCache.clear_all()
+        conn = VfsCacheConnection('ns_test')
+        other_conn = VfsCacheConnection('ns_other')
+        epoch = datetime.datetime.fromtimestamp(0)
+        self.assertEquals((False, epoch), conn._get_most_recent_updated_on())
+
+        older = datetime.datetime(2016, 1, 1)
+        newer = datetime.datetime(2016, 1, 2)
+        for filename, updated_on in [('a.txt', newer), ('b.txt', older)]:
+            meta = FileMetadataEntity()
+            meta.updated_on = updated_on
+            conn.put(filename, meta, 'file data')
+        other_conn.put('c.txt', None, None)
+        self.assertEquals((True, newer), conn._get_most_recent_updated_on())
+        self.assertEquals(
+            (True, epoch), other_conn._get_most_recent_updated_on())
+
+        # Items evicted by the cache itself are noticed, too.
+        conn.delete('a.txt')
+        conn.cache.delete(conn.make_key('ns_test', 'b.txt'))
+        self.assertEquals((False, epoch), conn._get_most_recent_updated_on())
+        self.assertEquals(
+            (True, epoch), other_conn._get_most_recent_updated_on())
+
+    def test_resync_is_rate_limited(self):
+        conn = self._setup_cache_with_one_entry()
+        conn.RESYNC_INTERVAL_SEC = 60
+        conn.PERSISTENT_ENTITY = None  # Fail if a query is attempted.
+        index = conn._get_namespace_index()
+
+        index.synced_on = time.time()
+        self.assertEquals({}, conn._get_incremental_updates())
+
+        index.synced_on = time.time() - 61
+        with self.assertRaises(AttributeError):
+            conn._get_incremental_updates()
+
 
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
@@ -40,6 +40,10 @@ class Activity(tags.BaseTag):
     def vendor(cls):
         return 'gcb'
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, unused_handler):
         activity_id = node.attrib.get('activityid')
         script = cElementTree.XML("""
@@ -478,6 +478,10 @@ class BaseAdminHandler(ConfigPropertyEditor):
             global_value = all_counters[name].global_value
             if not global_value:
                 global_value = 'NA'
+            flushed_on = counters.Registry.get_last_flushed_on(name)
+            if flushed_on:
+                global_value = '%s (flushed %s sec ago)' % (
+                    global_value, long(time.time() - flushed_on))
             perf_counters[name] = '%s / %s' % (
                 all_counters[name].value, global_value)
         return self.render_dict(
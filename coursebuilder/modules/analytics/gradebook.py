@@ -29,7 +29,6 @@ from mapreduce import context
 from common import catch_and_log
 from common import crypto
 from common import schema_fields
-from common import tags
 from controllers import utils
 from models import courses
 from models import data_sources
@@ -411,10 +410,10 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
     def fill_values(app_context, template_values):
         """Sets values into the dict used to fill out the Jinja template."""
 
-        def _find_q_ids(html, groups):
-            """Returns the list of question IDs referenced from rich HTML."""
+        def _find_q_ids(components, groups):
+            """Returns the list of question IDs referenced by components."""
             question_ids = []
-            for component in tags.get_components_from_html(html):
+            for component in components:
                 if component['cpt_name'] == 'question':
                     question_ids.append(int(component['quid']))
                 elif component['cpt_name'] == 'question-group':
@@ -450,7 +449,8 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
             return '%s.%s.%s' % (unit_id, lesson_id, question_id)
 
         def _add_assessment(unit):
-            q_ids = _find_q_ids(unit.html_content, groups)
+            q_ids = _find_q_ids(
+                course.get_assessment_components(unit.unit_id), groups)
             return (
                 [_q_key(unit.unit_id, None, q_id) for q_id in q_ids],
                 {
@@ -460,7 +460,8 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
                 })
 
         def _add_sub_assessment(unit, assessment):
-            q_ids = _find_q_ids(assessment.html_content, groups)
+            q_ids = _find_q_ids(
+                course.get_assessment_components(assessment.unit_id), groups)
             return (
                 [_q_key(assessment.unit_id, None, q_id) for q_id in q_ids],
                 {
@@ -473,7 +474,8 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
                 })
 
         def _add_lesson(unit, lesson):
-            q_ids = _find_q_ids(lesson.objectives, groups)
+            q_ids = _find_q_ids(
+                course.get_components(unit.unit_id, lesson.lesson_id), groups)
             return (
                 [_q_key(unit.unit_id, lesson.lesson_id, qid) for qid in q_ids],
                 {
@@ -142,6 +142,10 @@ class CodeTag(tags.ContextAwareTag):
         return [os.path.join(
             appengine_config.BUNDLE_ROOT, 'modules', 'code_tags', 'resources')]
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, context):
         code_elt = cElementTree.Element('code')
         code_elt.text = node.text or ''
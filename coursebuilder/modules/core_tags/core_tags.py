@@ -126,6 +126,10 @@ class GoogleDoc(CoreTag):
     def name(cls):
         return 'Google Doc'
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, unused_handler):
         height = node.attrib.get('height') or '300'
         link = node.attrib.get('link')
@@ -388,6 +392,10 @@ class GoogleSpreadsheet(CoreTag):
     def name(cls):
         return 'Google Spreadsheet'
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, unused_handler):
         height = node.attrib.get('height') or '300'
         link = node.attrib.get('link')
@@ -585,6 +593,10 @@ class GoogleGroup(CoreTag):
 
 class IFrame(CoreTag):
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, unused_handler):
         src = node.attrib.get('src')
         title = node.attrib.get('title')
@@ -687,6 +699,10 @@ class Markdown(tags.ContextAwareTag, CoreTag):
     def get_icon_url(self):
         return self.create_icon_url('markdown.png')
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, context):
         # The markdown is "text" type in the schema and so is presented in the
         # tag's body.
@@ -983,14 +983,14 @@ class EventsRESTHandler(utils.BaseRESTHandler):
     URL = '/rest/events'
     NON_PII_RANDOMIZED_ID = 'session_id'
     XSRF_TOKEN = 'event-post'
+    MAX_EVENTS_PER_REQUEST = 100
 
     def get(self):
         """Returns a 404 error; this handler should not be GET-accessible."""
         self.error(404)
         return
 
-    def _add_request_facts(self, payload_json):
-        payload_dict = transforms.loads(payload_json)
+    def _add_request_facts(self, payload_dict):
         if 'loc' not in payload_dict:
             payload_dict['loc'] = {}
         loc = payload_dict['loc']
@@ -1007,12 +1007,49 @@ class EventsRESTHandler(utils.BaseRESTHandler):
         user_agent = self.request.headers.get('User-Agent')
         if user_agent:
             payload_dict['user_agent'] = user_agent
-        payload_json = transforms.dumps(payload_dict).lstrip(
-            models.transforms.JSON_XSSI_PREFIX)
-        return payload_json
+        return payload_dict
+
+    def _get_events(self, request):
+        """Returns a list of (source, payload_dict) posted in the request.
+
+        A request carries either a single event as 'source' and 'payload', or
+        a batch of up to MAX_EVENTS_PER_REQUEST events as a list of such
+        dicts under 'events'.  Payloads are normally JSON strings, but are
+        also accepted already decoded; either way each is parsed only once.
+
+        Raises:
+          ValueError: if the request is malformed or the batch too large;
+              no event of the request is recorded then.
+        """
+        if 'events' in request:
+            items = request['events']
+            if not isinstance(items, list):
+                raise ValueError('Expected a list of events.')
+            if len(items) > self.MAX_EVENTS_PER_REQUEST:
+                raise ValueError(
+                    'Expected at most %d events, got %d.' % (
+                        self.MAX_EVENTS_PER_REQUEST, len(items)))
+        else:
+            items = [request]
+        events = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError('Expected an event, got %r.' % item)
+            payload = item.get('payload')
+            if isinstance(payload, basestring):
+                payload = transforms.loads(payload)
+            if not isinstance(payload, dict):
+                raise ValueError('Expected an event payload, got %r.' % payload)
+            events.append((item.get('source'), payload))
+        return events
 
     def post(self):
-        """Receives event and puts it into datastore."""
+        """Receives one event or a batch of events and puts them into datastore.
+
+        All events in a request are written with a single datastore call,
+        and all resulting progress updates are applied to the student's
+        progress entity, which is then saved once.
+        """
 
         COURSE_EVENTS_RECEIVED.inc()
         if not self.can_record_student_events():
@@ -1022,6 +1059,16 @@ class EventsRESTHandler(utils.BaseRESTHandler):
         if not self.assert_xsrf_token_or_fail(request, self.XSRF_TOKEN, {}):
             return
 
+        try:
+            events = self._get_events(request)
+        except ValueError:
+            self.error(400)
+            return
+        if not events:
+            return
+        # The request itself was counted above; count the rest of a batch.
+        COURSE_EVENTS_RECEIVED.inc(increment=len(events) - 1)
+
         user = self.get_user()
         if not user:
             return
@@ -1045,20 +1092,31 @@ class EventsRESTHandler(utils.BaseRESTHandler):
                     self.NON_PII_RANDOMIZED_ID, value=user_id,
                     path=self.app_context.get_slug())
 
-        source = request.get('source')
-        payload_json = request.get('payload')
-        payload_json = self._add_request_facts(payload_json)
-        models.EventEntity.record(source, user, payload_json, user_id)
-        COURSE_EVENTS_RECORDED.inc()
+        entities = []
+        for source, payload in events:
+            self._add_request_facts(payload)
+            entities.append(
+                models.EventEntity.create(source, user, payload, user_id))
+        rpc = db.put_async(entities)
 
         if student:
-            self.process_event(student, source, payload_json)
+            tracker = self.get_course().get_progress_tracker()
+            tracker.begin_batch()
+            try:
+                for source, payload in events:
+                    self._process_event_payload(student, source, payload)
+            finally:
+                tracker.end_batch()
+
+        rpc.get_result()
+        COURSE_EVENTS_RECORDED.inc(increment=len(entities))
 
     def process_event(self, student, source, payload_json):
         """Processes an event after it has been recorded in the event stream."""
+        self._process_event_payload(
+            student, source, transforms.loads(payload_json))
 
-        payload = transforms.loads(payload_json)
-
+    def _process_event_payload(self, student, source, payload):
         if 'location' not in payload:
             return
 
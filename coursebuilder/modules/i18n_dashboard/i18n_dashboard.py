@@ -21,6 +21,7 @@ import cgi
 import collections
 import cStringIO
 import datetime
+import hashlib
 import logging
 import os
 import re
@@ -62,6 +63,7 @@ from modules.courses import unit_lesson_editor
 from modules.dashboard import dashboard
 from modules.i18n_dashboard import messages
 from modules.oeditor import oeditor
+from modules.warmup import warmup
 from tools import verify
 
 from google.appengine.ext import db
@@ -104,6 +106,9 @@ RESOURCE_BUNDLE_CACHE_NAME = 'resource_bundle'
 RESOURCE_BUNDLE_CACHE_MAX_SIZE_BYTES = 16 * 1024 * 1024
 RESOURCE_BUNDLE_CACHE_TTL_SEC = 5 * 60
 
+TRANSLATED_HTML_CACHE_MAX_SIZE_BYTES = 8 * 1024 * 1024
+TRANSLATED_HTML_CACHE_TTL_SEC = 60 * 60
+
 custom_module = None
 
 
@@ -1716,14 +1721,28 @@ class I18nProgressManager(caching.RequestScopedSingleton):
         return cls.instance(course)._get(rsrc, type_str, key)
 
 
-class I18nTranslationContext(caching.RequestScopedSingleton):
+class I18nTranslationContext(object):
+    """Provides the xcontent configuration used to translate course content.
+
+    The configuration depends only on the registered custom tags, not on the
+    course, so it is built once per process and rebuilt only when the tag
+    bindings change or more modules get enabled.
+    """
 
-    def __init__(self, app_context):
-        self.app_context = app_context
-        self._xcontent_config = None
+    # A tuple (version, configuration); kept in a single attribute so that
+    # concurrent requests never see a version paired with another config.
+    _xcontent_config = None
 
     @classmethod
-    def _init_xcontent_configuration(cls, app_context):
+    def _get_version(cls):
+        # Modules can be enabled but never disabled, so the number of enabled
+        # modules is enough to tell that the set of them has changed.
+        return (
+            tags.Registry.get_version(),
+            len(custom_modules.Registry.enabled_module_names))
+
+    @classmethod
+    def _init_xcontent_configuration(cls):
         inline_tag_names = list(xcontent.DEFAULT_INLINE_TAG_NAMES)
         opaque_decomposable_tag_names = list(
             xcontent.DEFAULT_OPAQUE_DECOMPOSABLE_TAG_NAMES)
@@ -1757,16 +1776,18 @@ class I18nTranslationContext(caching.RequestScopedSingleton):
             omit_empty_opaque_decomposable=False,
             sort_attributes=True)
 
-    def _get_xcontent_configuration(self):
-        if self._xcontent_config is None:
-            self._xcontent_config = self._init_xcontent_configuration(
-                self.app_context)
-        return self._xcontent_config
+    @classmethod
+    def get(cls, unused_app_context=None):
+        version = cls._get_version()
+        if cls._xcontent_config is None or cls._xcontent_config[0] != version:
+            cls._xcontent_config = (
+                version, cls._init_xcontent_configuration())
+        return cls._xcontent_config[1]
 
     @classmethod
-    def get(cls, app_context):
-        # pylint: disable=protected-access
-        return cls.instance(app_context)._get_xcontent_configuration()
+    def warm_up(cls):
+        """Builds the configuration ahead of the first translated request."""
+        cls.get()
 
 
 def swapcase(text):
@@ -2898,6 +2919,20 @@ class I18nProgressDeferredUpdater(jobs.DurableJob):
             key, sections, resource_bundle_dto, i18n_progress_dto)
 
 
+class ProcessScopedTranslatedHtmlCache(caching.ProcessScopedSingleton):
+    """Holds the outcome of HTML translations, shared by all requests."""
+
+    def __init__(self):
+        self.cache = caching.LRUCache(
+            max_size_bytes=TRANSLATED_HTML_CACHE_MAX_SIZE_BYTES,
+            ttl_sec=TRANSLATED_HTML_CACHE_TTL_SEC, name='i18n-html')
+        self.cache.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, key, value):
+        unused_status, errm, body = value
+        return sys.getsizeof(key) + sys.getsizeof(errm) + sys.getsizeof(body)
+
+
 class LazyTranslator(object):
     NOT_STARTED_TRANSLATION = 0
     VALID_TRANSLATION = 1
@@ -2963,8 +2998,47 @@ class LazyTranslator(object):
         self._status = self.VALID_TRANSLATION
         return self.translation_dict['data'][0]['target_value']
 
+    def _make_translated_html_key(self):
+        """Makes a key which changes whenever any input to translation does."""
+        source_value = self.source_value
+        if isinstance(source_value, unicode):
+            source_value = source_value.encode('utf-8')
+        digest = hashlib.sha1(source_value)
+        # The translation dict is the resource bundle section being applied;
+        # its content stands in for the version of the bundle.
+        digest.update(transforms.dumps(self.translation_dict, sort_keys=True))
+        return 'i18n-html:%s:%s:%s' % (
+            self._app_context.get_current_locale(),
+            tags.Registry.get_version(), digest.hexdigest())
+
     def _translate_html(self):
-        self._status = self.INVALID_TRANSLATION
+        """Translates HTML via the process and memcache caches, if possible.
+
+        Only the outcome of the translation is cached: a tuple of status,
+        error message and body. The error details shown to translators
+        depend on the current user and are added on every call.
+        """
+        key = self._make_translated_html_key()
+        namespace = self._app_context.get_namespace_name()
+        local_key = '%s:%s' % (namespace, key)
+        cache = ProcessScopedTranslatedHtmlCache.instance().cache
+        found, outcome = cache.get(local_key)
+        if not found:
+            outcome = models.MemcacheManager.get(key, namespace=namespace)
+            if outcome is None:
+                outcome = self._do_translate_html()
+                models.MemcacheManager.set(
+                    key, outcome, ttl=TRANSLATED_HTML_CACHE_TTL_SEC,
+                    namespace=namespace)
+            cache.put(local_key, outcome)
+
+        self._status, self._errm, body = outcome
+        if self._status == self.VALID_TRANSLATION:
+            return body
+        return self._detailed_error(self._errm, body)
+
+    def _do_translate_html(self):
+        """Returns a tuple (status, error message, body) of the translation."""
         try:
             context = xcontent.Context(xcontent.ContentIO.fromstring(
                 self.source_value))
@@ -2999,22 +3073,21 @@ class LazyTranslator(object):
             transformer.recompose(context, resource_bundle, errors)
             body = xcontent.ContentIO.tostring(context.tree)
             if count_misses == 0 and not errors:
-                self._status = self.VALID_TRANSLATION
-                return body
+                return self.VALID_TRANSLATION, '', body
             else:
                 parts = 'part' if count_misses == 1 else 'parts'
                 are = 'is' if count_misses == 1 else 'are'
-                self._errm = (
+                errm = (
                     'The content has changed and {n} {parts} of the '
                     'translation {are} out of date.'.format(
                     n=count_misses, parts=parts, are=are))
-                return self._detailed_error(self._errm, self._fallback(body))
+                return self.INVALID_TRANSLATION, errm, self._fallback(body)
 
         except Exception as ex:  # pylint: disable=broad-except
             logging.exception('Unable to translate: %s', self.source_value)
-            self._errm = str(ex)
-            return self._detailed_error(
-                str(ex), self._fallback(self.source_value))
+            return (
+                self.INVALID_TRANSLATION, str(ex),
+                self._fallback(self.source_value))
 
     def _fallback(self, default_body):
         """Try to fallback to the last known good translation."""
@@ -3332,6 +3405,7 @@ def notify_module_enabled():
     courses.Course.COURSE_ENV_POST_SAVE_HOOKS.append(
         I18nProgressDeferredUpdater.on_course_settings_changed)
     settings.CourseSettingsHandler.register_settings_section('i18n')
+    warmup.WarmupHandler.WARMUP_HOOKS.append(I18nTranslationContext.warm_up)
 
     # Implementation in Babel 0.9.6 is buggy; replace with corrected version.
     pofile.denormalize = denormalize
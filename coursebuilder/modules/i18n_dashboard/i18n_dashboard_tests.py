@@ -33,6 +33,7 @@ import appengine_config
 
 from common import crypto
 from common import resource
+from common import schema_fields
 from common import tags
 from common import users
 from common import utils
@@ -1404,6 +1405,82 @@ class LazyTranslatorTests(actions.TestBase):
             'of the translation is out of date.',
             lazy_translator.errm)
 
+    def test_lazy_translator_caches_translated_html(self):
+        source_value = '<p>hello</p>'
+        translation_dict = {
+            'type': 'html',
+            'source_value': source_value,
+            'data': [
+                {'source_value': 'hello', 'target_value': 'HELLO'}]}
+        key = ResourceBundleKey(
+            resources_display.ResourceLesson.TYPE, '23', 'el')
+
+        translations = []
+        original_do_translate_html = LazyTranslator._do_translate_html
+
+        def counting_do_translate_html(translator):
+            translations.append(translator.source_value)
+            return original_do_translate_html(translator)
+
+        self.swap(
+            LazyTranslator, '_do_translate_html', counting_do_translate_html)
+
+        def translate(expected_value):
+            lazy_translator = LazyTranslator(
+                self.app_context, key, source_value, translation_dict)
+            self.assertEquals(expected_value, unicode(lazy_translator))
+            self.assertEquals(
+                LazyTranslator.VALID_TRANSLATION, lazy_translator.status)
+
+        translate('<p>HELLO</p>')
+        translate('<p>HELLO</p>')
+        self.assertEquals(1, len(translations))
+
+        # Another process finds the outcome in memcache.
+        i18n_dashboard.ProcessScopedTranslatedHtmlCache.clear_instance()
+        translate('<p>HELLO</p>')
+        self.assertEquals(1, len(translations))
+
+        # Any change to the resource bundle yields a new translation.
+        translation_dict['data'][0]['target_value'] = 'BONJOUR'
+        translate('<p>BONJOUR</p>')
+        self.assertEquals(2, len(translations))
+
+
+class I18nTranslationContextTests(actions.TestBase):
+
+    def test_configuration_is_shared_until_tags_change(self):
+        context = i18n_dashboard.I18nTranslationContext
+        config = context.get(None)
+        self.assertIs(config, context.get(None))
+
+        class TranslatableTag(tags.BaseTag):
+
+            def get_schema(self, unused_handler):
+                reg = schema_fields.FieldRegistry('Translatable')
+                reg.add_property(schema_fields.SchemaField(
+                    'caption', 'Caption', 'string'))
+                return reg
+
+        tags.Registry.add_tag_binding('translatable-tag', TranslatableTag)
+        try:
+            new_config = context.get(None)
+            self.assertIsNot(config, new_config)
+            self.assertIn('TRANSLATABLE-TAG', new_config.inline_tag_names)
+            self.assertNotIn('TRANSLATABLE-TAG', config.inline_tag_names)
+        finally:
+            tags.Registry.remove_tag_binding('translatable-tag')
+        self.assertNotIn(
+            'TRANSLATABLE-TAG', context.get(None).inline_tag_names)
+
+    def test_configuration_is_built_on_warmup(self):
+        # pylint: disable=protected-access
+        self.swap(i18n_dashboard.I18nTranslationContext, '_xcontent_config',
+                  None)
+        self.get('/_ah/warmup')
+        self.assertIsNotNone(
+            i18n_dashboard.I18nTranslationContext._xcontent_config)
+
 
 class CourseContentTranslationTests(actions.TestBase):
     ADMIN_EMAIL = 'admin@foo.com'
@@ -204,6 +204,10 @@ class KhanExerciseTag(tags.BaseTag):
     def vendor(cls):
         return 'psimakov'
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, unused_handler):
         """Embed just a <script> tag that will in turn create an <iframe>."""
         name = node.attrib.get('name')
@@ -22,6 +22,7 @@ from models import courses
 from models import models
 from models import transforms
 from modules.analytics import analytics
+from modules.courses import lessons
 from modules.manual_progress import manual_progress
 from tests.functional import actions
 
@@ -345,6 +346,79 @@ class ManualProgressTest(actions.TestBase):
         response = self._get_lesson(self._lesson_2_2.lesson_id)
         self._expect_payload(response, 2)
 
+    def test_events_handler_processes_batched_events(self):
+        url = '/%s/rest/events' % COURSE_NAME
+
+        def make_event(lesson):
+            return {
+                'source': 'attempt-lesson',
+                'payload': transforms.dumps({
+                    'location':
+                    'http://localhost:8081/%s/unit?unit=%s&lesson=%s' % (
+                        COURSE_NAME, self._unit_two.unit_id,
+                        lesson.lesson_id)})}
+
+        xsrf_token = crypto.XsrfTokenManager.create_xsrf_token('event-post')
+        request = make_event(self._lesson_2_1)
+        request['xsrf_token'] = xsrf_token
+        self.post(url, {'request': transforms.dumps(request)})
+
+        # Count progress writes; both events must share a single put().
+        puts = []
+        original_put = models.StudentPropertyEntity.put
+
+        def counting_put(entity):
+            puts.append(entity.key().name())
+            return original_put(entity)
+
+        self.swap(models.StudentPropertyEntity, 'put', counting_put)
+        request = transforms.dumps({
+            'xsrf_token': xsrf_token,
+            'events': [make_event(self._lesson_2_1),
+                       make_event(self._lesson_2_2)]})
+        self.post(url, {'request': request})
+        self.assertEquals(1, len(puts))
+
+        response = self._get_lesson(self._lesson_2_1.lesson_id)
+        self._expect_payload(response, 2)
+        response = self._get_lesson(self._lesson_2_2.lesson_id)
+        self._expect_payload(response, 2)
+        with common_utils.Namespace(NAMESPACE):
+            self.assertEquals(3, models.EventEntity.all().count())
+
+    def test_events_handler_rejects_malformed_batches(self):
+        url = '/%s/rest/events' % COURSE_NAME
+        xsrf_token = crypto.XsrfTokenManager.create_xsrf_token('event-post')
+        event = {
+            'source': 'attempt-lesson',
+            'payload': transforms.dumps({'location': 'http://localhost/'})}
+        handler = lessons.EventsRESTHandler
+
+        for events in [
+                'not a list',
+                [event, 'not an event'],
+                [event, {'source': 'attempt-lesson', 'payload': '[]'}],
+                [event] * (handler.MAX_EVENTS_PER_REQUEST + 1)]:
+            request = transforms.dumps({
+                'xsrf_token': xsrf_token, 'events': events})
+            response = self.post(
+                url, {'request': request}, expect_errors=True)
+            self.assertEquals(400, response.status_int)
+
+        # None of the events of a rejected batch are recorded.
+        with common_utils.Namespace(NAMESPACE):
+            self.assertEquals(0, models.EventEntity.all().count())
+
+        request = transforms.dumps({
+            'xsrf_token': xsrf_token,
+            'events': [event] * handler.MAX_EVENTS_PER_REQUEST})
+        response = self.post(url, {'request': request})
+        self.assertEquals(200, response.status_int)
+        with common_utils.Namespace(NAMESPACE):
+            self.assertEquals(
+                handler.MAX_EVENTS_PER_REQUEST,
+                models.EventEntity.all().count())
+
     def test_manual_complete_course(self):
         response = self._get_course()
         self._expect_payload(response, 0)
@@ -46,6 +46,10 @@ class MathTag(tags.ContextAwareTag):
     def vendor(cls):
         return 'gcb'
 
+    @classmethod
+    def is_student_dependent(cls):
+        return False
+
     def render(self, node, context):
         math_script = cElementTree.XML('<script/>')
 
@@ -24,9 +24,9 @@ import logging
 from common import utils as common_utils
 from controllers import sites
 from controllers import utils as controllers_utils
-from models import utils as model_utils
 from modules.notifications import notifications
 
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 
@@ -34,84 +34,198 @@ from google.appengine.ext import deferred
 _LOG = logging.getLogger('modules.notifications.cron')
 logging.basicConfig()
 
+# Number of notifications read, and then written back, per datastore batch; the
+# re-sends of one batch fit in a single Queue.add.
+_BATCH_SIZE = taskqueue.MAX_TASKS_PER_ADD
+# Batches processed by one namespace task before it continues in a new task.
+_MAX_BATCHES_PER_TASK = 50
+# Queue receiving the per-namespace tasks and the re-enqueued notifications.
+_QUEUE_NAME = 'default'
+# Where, and how, deferred.defer() posts its tasks.
+_DEFERRED_URL = '/_ah/queue/deferred'
+_DEFERRED_HEADERS = {'Content-Type': 'application/octet-stream'}
+
+
+def _make_deferred_task(fn, *args, **kwargs):
+    """Makes an unsaved task that calls fn like deferred.defer() would."""
+    name = kwargs.pop('_name', None)
+    retry_options = kwargs.pop('_retry_options', None)
+    return taskqueue.Task(
+        payload=deferred.serialize(fn, *args, **kwargs), url=_DEFERRED_URL,
+        headers=_DEFERRED_HEADERS, name=name, retry_options=retry_options)
+
+
+def _add_tasks(tasks):
+    queue = taskqueue.Queue(_QUEUE_NAME)
+    for start in xrange(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+        try:
+            queue.add(tasks[start:start + taskqueue.MAX_TASKS_PER_ADD])
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError), e:
+            # Another run of this cron already re-enqueued some of these
+            # notifications; the rest of the batch has still been added.
+            _LOG.info('Skipped re-enqueueing some notifications: %s', e)
 
-@db.transactional(xg=True)
-def process_notification(notification, now, stats):
-    notification_key = notification.key()
-    policy = None
-    stats.started += 1
 
+def _get_send_mail_task_name(notification):
+    """Names the task re-sending notification in its current state.
+
+    Two concurrent cron runs that read the same notification produce the same
+    name, so the task queue refuses the second copy of the task.
+    """
     # Treat as module-protected. pylint: disable=protected-access
-    if notification._done_date:
-        _LOG.info(
-            'Skipping offline processing of notification with key %s; already '
-            'done at %s', notification_key, notification._done_date
-            )
-        stats.skipped_already_done += 1
-        return
+    last_enqueue_date = notification._last_enqueue_date
+    return 'notification-%s-%s' % (
+        notification.key(),
+        notifications._dt_to_epoch_usec(last_enqueue_date)
+        if last_enqueue_date else 0)
 
-    if notifications.Manager._is_still_enqueued(notification, now):
-        _LOG.info(
-            'Skipping offline processing of notification with key %s; still on '
-            'queue (last enqueued: %s)', notification_key,
-            notification._last_enqueue_date)
-        stats.skipped_still_enqueued += 1
-        return
 
-    payload_key = db.Key.from_path(
-        notifications.Payload.kind(),
-        notifications.Payload.key_name(
-            notification.to, notification.intent, notification.enqueue_date)
-        )
-    payload = db.get(payload_key)
+def process_notifications(notifications_list, now, stats):
+    """Re-enqueues or expires a batch of pending notifications.
 
-    if not payload:
-        _LOG.error(
-            'Could not process notification with key %s; associated payload '
-            'with key %s not found', notification_key, payload_key
-        )
-        stats.missing_payload += 1
+    All payloads are read with one datastore get, all changes are written with
+    one datastore put, and all re-sends are added to the queue together. The
+    writes are not transactional; re-sends use task names that keep two
+    concurrent runs from sending the same notification twice.
+
+    Args:
+        notifications_list: list of notifications.Notification. The batch.
+        now: datetime. The time this cron run started.
+        stats: _Stats. Updated with the outcome for each notification.
+    """
+    pending = []
+    for notification in notifications_list:
+        stats.started += 1
+
+        # Treat as module-protected. pylint: disable=protected-access
+        if notification._done_date:
+            _LOG.info(
+                'Skipping offline processing of notification with key %s; '
+                'already done at %s', notification.key(),
+                notification._done_date)
+            stats.skipped_already_done += 1
+            continue
+
+        if notifications.Manager._is_still_enqueued(notification, now):
+            _LOG.info(
+                'Skipping offline processing of notification with key %s; '
+                'still on queue (last enqueued: %s)', notification.key(),
+                notification._last_enqueue_date)
+            stats.skipped_still_enqueued += 1
+            continue
+
+        pending.append(notification)
+
+    if not pending:
         return
 
-    if notifications.Manager._is_too_old_to_reenqueue(
-        notification.enqueue_date, now):
-
-        stats.too_old += 1
-        exception = notifications.NotificationTooOldError((
-            'Notification %s with enqueue_date %s too old to re-enqueue at %s; '
-            'limit is %s days') % (
-                notification_key, notification.enqueue_date, now,
-                notifications._MAX_RETRY_DAYS,
-        ))
-        notifications.Manager._mark_failed(
-            notification, now, exception, permanent=True)
-
-    if notification._fail_date or notification._send_date:
-        policy = notifications._RETENTION_POLICIES.get(
-            notification._retention_policy)
-        notifications.Manager._mark_done(notification, now)
-
-        if policy:
-            policy.run(notification, payload)
-            stats.policy_run += 1
-        else:
-            _LOG.warning(
-                'Cannot apply retention policy %s to notification %s and '
-                'payload %s; policy not found. Existing policies are: %s',
-                notification._retention_policy, notification_key, payload_key,
-                ', '.join(sorted(notifications._RETENTION_POLICIES.keys()))
-                )
-            stats.missing_policy += 1
-        db.put([notification, payload])
-    else:
-        notifications.Manager._mark_enqueued(notification, now)
-        db.put(notification)
-        deferred.defer(
-            notifications.Manager._transactional_send_mail_task,
-            notification_key, payload_key,
-            _retry_options=notifications.Manager._get_retry_options()
+    payload_keys = [
+        db.Key.from_path(
+            notifications.Payload.kind(),
+            notifications.Payload.key_name(
+                notification.to, notification.intent,
+                notification.enqueue_date))
+        for notification in pending]
+    payloads = db.get(payload_keys)
+
+    entities_to_put = []
+    tasks = []
+    for notification, payload_key, payload in zip(
+        pending, payload_keys, payloads):
+        notification_key = notification.key()
+
+        if not payload:
+            _LOG.error(
+                'Could not process notification with key %s; associated '
+                'payload with key %s not found', notification_key, payload_key
             )
-        stats.reenqueued += 1
+            stats.missing_payload += 1
+            continue
+
+        # Treat as module-protected. pylint: disable=protected-access
+        if notifications.Manager._is_too_old_to_reenqueue(
+            notification.enqueue_date, now):
+
+            stats.too_old += 1
+            exception = notifications.NotificationTooOldError((
+                'Notification %s with enqueue_date %s too old to re-enqueue at '
+                '%s; limit is %s days') % (
+                    notification_key, notification.enqueue_date, now,
+                    notifications._MAX_RETRY_DAYS,
+            ))
+            notifications.Manager._mark_failed(
+                notification, now, exception, permanent=True)
+
+        if notification._fail_date or notification._send_date:
+            policy = notifications._RETENTION_POLICIES.get(
+                notification._retention_policy)
+            notifications.Manager._mark_done(notification, now)
+
+            if policy:
+                policy.run(notification, payload)
+                stats.policy_run += 1
+            else:
+                _LOG.warning(
+                    'Cannot apply retention policy %s to notification %s and '
+                    'payload %s; policy not found. Existing policies are: %s',
+                    notification._retention_policy, notification_key,
+                    payload_key,
+                    ', '.join(sorted(notifications._RETENTION_POLICIES.keys()))
+                    )
+                stats.missing_policy += 1
+            entities_to_put.extend([notification, payload])
+        else:
+            tasks.append(_make_deferred_task(
+                notifications.Manager._transactional_send_mail_task,
+                notification_key, payload_key,
+                _name=_get_send_mail_task_name(notification),
+                _retry_options=notifications.Manager._get_retry_options()))
+            notifications.Manager._mark_enqueued(notification, now)
+            entities_to_put.append(notification)
+            stats.reenqueued += 1
+
+    if entities_to_put:
+        db.put(entities_to_put)
+    if tasks:
+        _add_tasks(tasks)
+
+
+def process_notification(notification, now, stats):
+    """Re-enqueues or expires a single pending notification."""
+    process_notifications([notification], now, stats)
+
+
+def process_namespace(namespace, now, cursor=None):
+    """Task processing the pending notifications of one course namespace.
+
+    Args:
+        namespace: string. The namespace of the course.
+        now: datetime. The time this cron run started.
+        cursor: string or None. Where a previous task for the same namespace
+            and cron run stopped.
+    """
+    stats = _Stats(namespace)
+    _LOG.info("Begin processing notifications for namespace '%s'", namespace)
+    with common_utils.Namespace(namespace):
+        # Treating as module-protected. pylint: disable=protected-access
+        query = notifications.Manager._get_in_process_notifications_query()
+        for _ in xrange(_MAX_BATCHES_PER_TASK):
+            if cursor:
+                query.with_cursor(start_cursor=cursor)
+            batch = query.fetch(limit=_BATCH_SIZE)
+            process_notifications(batch, now, stats)
+            cursor = query.cursor() if len(batch) == _BATCH_SIZE else None
+            if not cursor:
+                break
+    _LOG.info('Done processing. %s', stats)
+
+    if cursor:
+        _LOG.info(
+            "Continuing processing notifications for namespace '%s' in a new "
+            "task", namespace)
+        _add_tasks([_make_deferred_task(
+            process_namespace, namespace, now, cursor=cursor)])
 
 
 class _Stats(object):
@@ -142,13 +256,13 @@ class _Stats(object):
 
 
 class ProcessPendingNotificationsHandler(controllers_utils.BaseHandler):
-    """Iterates through all courses, re-enqueueing or expiring pending items.
+    """Fans out one task per course to re-enqueue or expire pending items.
 
     Only one of these jobs runs at any given time. This is enforced by App
     Engine's 10 minute limit plus scheduling this to run daily.
 
-    However, write operations here must still be atomic because admins could
-    manually visit the handler at any time.
+    However, admins could manually visit the handler at any time, so the
+    tasks must tolerate running concurrently with the tasks of another run.
     """
 
     def get(self):
@@ -161,17 +275,6 @@ class ProcessPendingNotificationsHandler(controllers_utils.BaseHandler):
             'Begin process_pending_notifications cron; found namespaces %s at '
             '%s', ', '.join(["'%s'" % n for n in namespaces]), now
         )
-
-        for namespace in namespaces:
-            stats = _Stats(namespace)
-            _LOG.info("Begin processing notifications for namespace '%s'",
-                      namespace)
-            self._process_records(namespace, now, stats)
-            _LOG.info('Done processing. %s', stats)
-
-    def _process_records(self, namespace, now, stats):
-        with common_utils.Namespace(namespace):
-            # Treating as module-protected. pylint: disable=protected-access
-            mapper = model_utils.QueryMapper(
-                notifications.Manager._get_in_process_notifications_query())
-            mapper.run(process_notification, now, stats)
+        _add_tasks([
+            _make_deferred_task(process_namespace, namespace, now)
+            for namespace in namespaces])
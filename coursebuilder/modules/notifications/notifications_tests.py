@@ -271,6 +271,88 @@ class CronTest(actions.TestBase):
         self.assertEqual(1, self.stats.skipped_still_enqueued)
         self.assertEqual(1, self.stats.started)
 
+    def _put_notifications(self, count, send_date=None, first_index=0):
+        notification_keys = []
+        for index in xrange(first_index, first_index + count):
+            notification, payload = notifications.Manager._make_unsaved_models(
+                self.audit_trail, self.body,
+                self.now - datetime.timedelta(seconds=index), self.intent,
+                notifications.RetainAuditTrail.NAME, self.sender, self.subject,
+                self.to)
+            notification._send_date = send_date
+            notification_keys.append(db.put([notification, payload])[0])
+        return notification_keys
+
+    def test_process_notifications_makes_one_get_put_and_queue_add(self):
+        pending_keys = self._put_notifications(3)
+        sent_keys = self._put_notifications(
+            2, send_date=self.now, first_index=3)
+
+        calls = []
+        def counting(name, fn):
+            def wrapper(*args, **kwargs):
+                calls.append(name)
+                return fn(*args, **kwargs)
+            return wrapper
+        self.swap(db, 'get', counting('get', db.get))
+        self.swap(db, 'put', counting('put', db.put))
+        self.swap(cron.taskqueue.Queue, 'add', counting(
+            'add', cron.taskqueue.Queue.add))
+
+        later_date = self.now + datetime.timedelta(seconds=1)
+        cron.process_notifications(
+            db.get(pending_keys + sent_keys), later_date, self.stats)
+        self.assertEqual(['get', 'get', 'put', 'add'], calls)
+
+        self.assertEqual(3, len(self.taskq.GetTasks('default')))
+        self.assertEqual(5, self.stats.started)
+        self.assertEqual(3, self.stats.reenqueued)
+        self.assertEqual(2, self.stats.policy_run)
+        for notification in db.get(sent_keys):
+            self.assertTrue(notification._done_date)
+
+        self.execute_all_deferred_tasks()
+        for notification in db.get(pending_keys):
+            self.assertTrue(notification._done_date)
+
+    def test_concurrent_runs_enqueue_each_notification_once(self):
+        notification_key = self._put_notifications(1)[0]
+        later_date = self.now + datetime.timedelta(seconds=1)
+
+        # Both runs read the notification before either has written it.
+        first, second = db.get(notification_key), db.get(notification_key)
+        cron.process_notification(first, later_date, self.stats)
+        cron.process_notification(second, later_date, self.stats)
+
+        self.assert_task_enqueued()
+        self.assertEqual(2, self.stats.reenqueued)
+
+    def test_handler_enqueues_one_task_per_namespace(self):
+        sites.setup_courses('course:/a::ns_a, course:/b::ns_b')
+        with common_utils.Namespace('ns_a'):
+            notification_key = self._put_notifications(1)[0]
+
+        self.get('/cron/process_pending_notifications')
+        self.assertEqual(2, len(self.taskq.GetTasks('default')))
+
+        self.execute_all_deferred_tasks()
+        with common_utils.Namespace('ns_a'):
+            self.assertTrue(db.get(notification_key)._done_date)
+
+    def test_process_namespace_continues_in_new_task(self):
+        self.swap(cron, '_BATCH_SIZE', 2)
+        self.swap(cron, '_MAX_BATCHES_PER_TASK', 1)
+        notification_keys = self._put_notifications(3, send_date=self.now)
+
+        cron.process_namespace('', self.now)
+        self.assertEqual(
+            2, len([n for n in db.get(notification_keys) if n._done_date]))
+        self.assert_task_enqueued()
+
+        self.execute_all_deferred_tasks()
+        for notification in db.get(notification_keys):
+            self.assertTrue(notification._done_date)
+
 
 class DatetimeConversionTest(actions.TestBase):
 
@@ -0,0 +1,493 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process search index with the same interface as search.Index.
+
+LocalIndex implements the subset of the App Engine Search API used by the
+search module: put(), delete(), get_range() and search(). Documents are kept
+in a pure-Python inverted index and ranked with BM25. The documents of an index
+are stored as zlib-compressed JSON, split over as many datastore entities as
+needed, and a small head entity records which version of them is current; the
+inverted index itself is rebuilt from them when an index is loaded and kept in
+a process-wide LRU cache until the head refers to a newer version.
+
+Queries are the conjunction of their terms, matched case-insensitively against
+every text field; the Search API query language (operators, field
+restrictions, stemming) is not supported.
+"""
+
+import cgi
+import datetime
+import math
+import re
+import sys
+import uuid
+import zlib
+
+from common import caching
+from common import utils as common_utils
+from models import entities
+from models import transforms
+
+from google.appengine.api import search
+from google.appengine.ext import db
+
+# Documents of one index are split into entities of at most this many bytes.
+MAX_SHARD_SIZE_BYTES = 900 * 1000
+
+# All indexes loaded by this process share a cache of this size.
+CACHE_MAX_SIZE_BYTES = 16 * 1024 * 1024
+
+# Number of times a load or save is attempted when another save interferes.
+MAX_ATTEMPTS = 3
+
+# BM25 term frequency saturation and document length normalization.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Approximate number of characters in a snippet.
+SNIPPET_LENGTH = 160
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+_FIELD_TYPES = {
+    'text': search.TextField,
+    'html': search.HtmlField,
+    'atom': search.AtomField,
+    'number': search.NumberField,
+    'date': search.DateField,
+}
+_FIELD_TYPE_NAMES = dict(
+    (field_type, type_name) for type_name, field_type in _FIELD_TYPES.items())
+_SEARCHABLE_FIELD_TYPES = frozenset(['text', 'html', 'atom'])
+
+
+def tokenize(text):
+    """Splits text into lower-case words."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _field_to_dict(field):
+    type_name = _FIELD_TYPE_NAMES.get(type(field))
+    if not type_name:
+        raise ValueError(
+            'Unsupported field type: %s' % type(field).__name__)
+    value = field.value
+    if type_name == 'date':
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        value = value.strftime(_DATE_FORMAT)
+    return [field.name, type_name, value]
+
+
+def _dict_to_field(field_dict):
+    name, type_name, value = field_dict
+    if type_name == 'date':
+        value = datetime.datetime.strptime(value, _DATE_FORMAT)
+    return _FIELD_TYPES[type_name](name=name, value=value)
+
+
+def _get_text(field_dict):
+    """Returns the searchable text of a serialized field, or None."""
+    unused_name, type_name, value = field_dict
+    if type_name not in _SEARCHABLE_FIELD_TYPES or not value:
+        return None
+    if type_name == 'html':
+        value = _TAG_RE.sub(' ', value)
+    return value
+
+
+def make_snippet(text, terms):
+    """Returns an HTML excerpt of text around the first occurrence of terms.
+
+    Args:
+        text: unicode. The plain text to excerpt.
+        terms: set of unicode. The lower-case query terms; these are wrapped
+            in <b> tags.
+    Returns:
+        A unicode string of escaped HTML.
+    """
+    matches = list(_TOKEN_RE.finditer(text))
+    start = 0
+    for match in matches:
+        if match.group().lower() in terms:
+            start = max(0, match.start() - SNIPPET_LENGTH / 4)
+            break
+    end = min(len(text), start + SNIPPET_LENGTH)
+
+    parts = []
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        if match.group().lower() in terms:
+            parts.append(cgi.escape(text[position:match.start()]))
+            parts.append('<b>%s</b>' % cgi.escape(match.group()))
+            position = match.end()
+    parts.append(cgi.escape(text[position:end]))
+
+    snippet = ''.join(parts).strip()
+    if start > 0:
+        snippet = '...' + snippet
+    if end < len(text):
+        snippet += '...'
+    return snippet
+
+
+class LocalSearchIndexEntity(entities.BaseEntity):
+    """The current version of a LocalIndex; the index name is the key name.
+
+    A save writes the documents to shards of a new version, then switches
+    this entity to that version in a transaction which checks that it still
+    refers to the version the documents were loaded from. Readers therefore
+    only ever see complete versions, and a save that fails halfway leaves the
+    index as it was.
+    """
+
+    version = db.StringProperty(indexed=False)
+    num_shards = db.IntegerProperty(indexed=False)
+
+
+class LocalSearchIndexShardEntity(entities.BaseEntity):
+    """One slice of the serialized documents of one version of a LocalIndex.
+
+    Key names are '<index name>:<version>:shard:<number>'. Shards of a version
+    are deleted once the index is switched to another version; shards of
+    saves that failed before switching are left behind.
+    """
+
+    data = db.BlobProperty()
+
+    @classmethod
+    def key_names(cls, index_name, version, num_shards):
+        return [
+            '%s:%s:shard:%d' % (index_name, version, number)
+            for number in xrange(num_shards)]
+
+
+def _get_fields_size(fields):
+    return sys.getsizeof(fields) + sum(
+        sys.getsizeof(field_dict) + sys.getsizeof(field_dict[2])
+        for field_dict in fields)
+
+
+class _IndexData(object):
+    """The documents of an index and the inverted index built from them."""
+
+    def __init__(self, version, docs):
+        """Builds the inverted index.
+
+        Args:
+            version: str or None. The version these documents were saved as.
+            docs: dict. Maps doc_id to a list of serialized fields.
+        """
+        self.version = version
+        self.docs = docs
+        self.postings = {}
+        self.lengths = {}
+        for doc_id, fields in docs.iteritems():
+            length = 0
+            for field_dict in fields:
+                text = _get_text(field_dict)
+                if text is None:
+                    continue
+                for term in tokenize(text):
+                    term_postings = self.postings.setdefault(term, {})
+                    term_postings[doc_id] = term_postings.get(doc_id, 0) + 1
+                    length += 1
+            self.lengths[doc_id] = length
+        self.average_length = (
+            float(sum(self.lengths.itervalues())) / len(docs) if docs else 0)
+
+        # Approximates the memory held, which is mostly the dicts themselves;
+        # doc_ids are shared by all of them and counted once.
+        self.size_bytes = (
+            sys.getsizeof(self.docs) + sys.getsizeof(self.postings) +
+            sys.getsizeof(self.lengths))
+        for doc_id, fields in docs.iteritems():
+            self.size_bytes += sys.getsizeof(doc_id) + _get_fields_size(fields)
+        for term, term_postings in self.postings.iteritems():
+            self.size_bytes += (
+                sys.getsizeof(term) + sys.getsizeof(term_postings))
+
+    def match(self, terms):
+        """Returns the doc_ids containing all terms, best BM25 score first."""
+        if not terms:
+            return sorted(self.docs)
+        term_postings = [self.postings.get(term, {}) for term in set(terms)]
+        term_postings.sort(key=len)
+        doc_ids = set(term_postings[0])
+        for postings in term_postings[1:]:
+            doc_ids.intersection_update(postings)
+
+        num_docs = len(self.docs)
+        scores = []
+        for doc_id in doc_ids:
+            length_norm = 1 - BM25_B + BM25_B * (
+                self.lengths[doc_id] / self.average_length)
+            score = 0.0
+            for postings in term_postings:
+                doc_freq = len(postings)
+                idf = math.log(
+                    1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                freq = postings[doc_id]
+                score += idf * freq * (BM25_K1 + 1) / (
+                    freq + BM25_K1 * length_norm)
+            scores.append((-score, doc_id))
+        scores.sort()
+        return [doc_id for unused_score, doc_id in scores]
+
+
+class ProcessScopedLocalIndexCache(caching.ProcessScopedSingleton):
+    """Holds the loaded LocalIndex data of all namespaces in this process."""
+
+    def __init__(self):
+        self.cache = caching.LRUCache(
+            max_size_bytes=CACHE_MAX_SIZE_BYTES, name='search-local-index')
+        self.cache.get_entry_size = self._get_entry_size
+
+    def _get_entry_size(self, unused_key, value):
+        return value.size_bytes
+
+
+class LocalIndex(object):
+    """A search index stored in the datastore and searched in process."""
+
+    def __init__(self, name, namespace=None):
+        self._name = name
+        self._namespace = namespace
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    def _cache_key(self):
+        return (self._namespace, self._name)
+
+    def _load(self):
+        """Returns the _IndexData of the current version of this index."""
+        with common_utils.Namespace(self._namespace):
+            for unused_attempt in xrange(MAX_ATTEMPTS):
+                data = self._load_version(
+                    LocalSearchIndexEntity.get_by_key_name(self._name))
+                if data:
+                    return data
+        raise search.TransientError('Index %s is being updated.' % self._name)
+
+    def _load_version(self, head):
+        """Returns the _IndexData of the version head refers to, if any.
+
+        Args:
+            head: LocalSearchIndexEntity or None. The head of this index.
+        Returns:
+            The _IndexData, or None if a save has switched the index to
+            another version and deleted the shards of this one since head was
+            read.
+        """
+        if not head:
+            return _IndexData(None, {})
+        cache = ProcessScopedLocalIndexCache.instance().cache
+        found, data = cache.get(self._cache_key())
+        if found and data.version == head.version:
+            return data
+
+        shards = LocalSearchIndexShardEntity.get_by_key_name(
+            LocalSearchIndexShardEntity.key_names(
+                self._name, head.version, head.num_shards))
+        if None in shards:
+            return None
+        docs = transforms.loads(zlib.decompress(
+            ''.join([shard.data for shard in shards])))
+        data = _IndexData(head.version, docs)
+        cache.put(self._cache_key(), data)
+        return data
+
+    def _switch_version(self, from_version, to_version, num_shards):
+        """Points the head to to_version if it still points to from_version.
+
+        Must be run in a transaction.
+
+        Returns:
+            A tuple of whether the head was switched, and the number of shards
+            of from_version.
+        """
+        head = LocalSearchIndexEntity.get_by_key_name(self._name)
+        if (head.version if head else None) != from_version:
+            return False, None
+        from_num_shards = head.num_shards if head else 0
+        if not head:
+            head = LocalSearchIndexEntity(key_name=self._name)
+        head.version = to_version
+        head.num_shards = num_shards
+        head.put()
+        return True, from_num_shards
+
+    def _save(self, from_version, docs):
+        """Saves docs as a new version replacing from_version.
+
+        Returns:
+            The _IndexData of the new version, or None if another save has
+            replaced from_version first.
+        """
+        version = uuid.uuid4().hex
+        blob = zlib.compress(transforms.dumps(docs))
+        chunks = [
+            blob[offset:offset + MAX_SHARD_SIZE_BYTES]
+            for offset in xrange(0, len(blob), MAX_SHARD_SIZE_BYTES)]
+        key_names = LocalSearchIndexShardEntity.key_names(
+            self._name, version, len(chunks))
+        with common_utils.Namespace(self._namespace):
+            db.put([
+                LocalSearchIndexShardEntity(
+                    key_name=key_name, data=db.Blob(chunk))
+                for key_name, chunk in zip(key_names, chunks)])
+            switched, from_num_shards = db.run_in_transaction(
+                self._switch_version, from_version, version, len(chunks))
+            if not switched:
+                key_names_to_delete = key_names
+            else:
+                key_names_to_delete = LocalSearchIndexShardEntity.key_names(
+                    self._name, from_version, from_num_shards)
+            if key_names_to_delete:
+                db.delete([
+                    db.Key.from_path(
+                        LocalSearchIndexShardEntity.kind(), key_name)
+                    for key_name in key_names_to_delete])
+        if not switched:
+            return None
+        data = _IndexData(version, docs)
+        ProcessScopedLocalIndexCache.instance().cache.put(
+            self._cache_key(), data)
+        return data
+
+    def _update(self, update_docs):
+        """Saves the documents as changed in place by update_docs(docs).
+
+        If another save replaces the documents in the meantime, the change is
+        made again to the documents it saved, so that no change is lost.
+        """
+        for unused_attempt in xrange(MAX_ATTEMPTS):
+            data = self._load()
+            docs = dict(data.docs)
+            update_docs(docs)
+            if self._save(data.version, docs):
+                return
+        raise search.TransientError(
+            'Index %s is being updated concurrently.' % self._name)
+
+    def put(self, documents):
+        """Adds or replaces documents; see search.Index.put.
+
+        Unlike search.Index.put, there is no limit on the number of documents;
+        since every put rewrites the whole index, it is best to put all of
+        the documents at once.
+        """
+        if isinstance(documents, search.Document):
+            documents = [documents]
+        new_docs = {}
+        results = []
+        for document in documents:
+            doc_id = document.doc_id or uuid.uuid4().hex
+            new_docs[doc_id] = [
+                _field_to_dict(field) for field in document.fields]
+            results.append(search.PutResult(
+                code=search.OperationResult.OK, id=doc_id))
+        self._update(lambda docs: docs.update(new_docs))
+        return results
+
+    def delete(self, document_ids):
+        """Removes documents by doc_id; see search.Index.delete."""
+        if isinstance(document_ids, basestring):
+            document_ids = [document_ids]
+
+        def delete_docs(docs):
+            for doc_id in document_ids:
+                docs.pop(doc_id, None)
+
+        self._update(delete_docs)
+
+    def get_range(self, start_id=None, include_start_object=True, limit=100,
+                  ids_only=False):
+        """Returns documents in doc_id order; see search.Index.get_range.
+
+        Unlike search.Index.get_range, a limit of None returns all documents.
+        """
+        data = self._load()
+        documents = []
+        for doc_id in sorted(data.docs):
+            if start_id is not None and (
+                doc_id < start_id or
+                (doc_id == start_id and not include_start_object)):
+                continue
+            if limit is not None and len(documents) >= limit:
+                break
+            fields = [] if ids_only else [
+                _dict_to_field(field_dict) for field_dict in data.docs[doc_id]]
+            documents.append(search.Document(doc_id=doc_id, fields=fields))
+        return search.GetResponse(results=documents)
+
+    def search(self, query):
+        """Runs a query; see search.Index.search.
+
+        Only the limit, offset, cursor, ids_only, returned_fields and
+        snippeted_fields query options are honored. Cursors are opaque but
+        only valid for the index they were returned from.
+        """
+        if isinstance(query, basestring):
+            query = search.Query(query_string=query)
+        options = query.options or search.QueryOptions()
+        terms = tokenize(query.query_string)
+        if query.query_string.strip() and not terms:
+            raise search.QueryError(
+                'Failed to parse query "%s"' % query.query_string)
+
+        data = self._load()
+        doc_ids = data.match(terms)
+
+        offset = options.offset or 0
+        if options.cursor and options.cursor.web_safe_string:
+            offset = int(options.cursor.web_safe_string)
+        page = doc_ids[offset:offset + options.limit]
+        cursor = None
+        if options.cursor and offset + len(page) < len(doc_ids):
+            cursor = search.Cursor(
+                web_safe_string=str(offset + len(page)))
+
+        term_set = set(terms)
+        returned_fields = set(options.returned_fields or [])
+        snippeted_fields = set(options.snippeted_fields or [])
+        results = []
+        for doc_id in page:
+            fields = []
+            expressions = []
+            for field_dict in data.docs[doc_id]:
+                name = field_dict[0]
+                if options.ids_only:
+                    continue
+                if not returned_fields or name in returned_fields:
+                    fields.append(_dict_to_field(field_dict))
+                if name in snippeted_fields:
+                    text = _get_text(field_dict) or ''
+                    expressions.append(search.HtmlField(
+                        name=name, value=make_snippet(text, term_set)))
+            results.append(search.ScoredDocument(
+                doc_id=doc_id, fields=fields, expressions=expressions))
+        return search.SearchResults(
+            number_found=len(doc_ids), results=results, cursor=cursor)
@@ -0,0 +1,232 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for modules/search/local_index.py."""
+
+import datetime
+import logging
+import random
+import time
+
+from common import utils as common_utils
+from modules.search import local_index
+from tests.functional import actions
+
+from google.appengine.api import search
+from google.appengine.ext import db
+
+NAMESPACE = 'ns_local_index'
+
+WORDS = [
+    'apple', 'banana', 'cherry', 'dog', 'elephant', 'falcon', 'grape',
+    'harbor', 'island', 'jungle', 'kettle', 'lemon', 'mountain', 'night',
+    'ocean', 'pepper', 'quartz', 'river', 'sunset', 'tiger', 'umbrella',
+    'valley', 'walrus', 'xylophone', 'yellow', 'zebra']
+
+
+def _make_doc(doc_id, title, content):
+    return search.Document(doc_id=doc_id, fields=[
+        search.TextField(name='title', value=title),
+        search.TextField(name='content', value=content),
+        search.TextField(name='type', value='Lesson'),
+        search.DateField(name='date', value=datetime.datetime(2016, 1, 1))])
+
+
+class LocalIndexTests(actions.TestBase):
+    """Tests for LocalIndex."""
+
+    def setUp(self):
+        super(LocalIndexTests, self).setUp()
+        self.index = local_index.LocalIndex('test_index', namespace=NAMESPACE)
+        local_index.ProcessScopedLocalIndexCache.clear_instance()
+
+    def _search(self, query_string, **kwargs):
+        return self.index.search(search.Query(
+            query_string=query_string,
+            options=search.QueryOptions(**kwargs)))
+
+    def test_search_ranks_and_snippets_matches(self):
+        self.index.put([
+            _make_doc('dogs', 'Dogs', 'A page about dogs and cats.'),
+            _make_doc('cats', 'Cats', 'Cats, cats and more cats.'),
+            _make_doc('birds', 'Birds', 'Nothing about the others.')])
+
+        results = self._search(
+            'CATS', returned_fields=['title'], snippeted_fields=['content'])
+        self.assertEquals(2, results.number_found)
+        self.assertEquals(
+            ['cats', 'dogs'], [result.doc_id for result in results])
+        self.assertEquals(['title'], [
+            field.name for field in results.results[0].fields])
+        self.assertEquals(
+            'A page about dogs and <b>cats</b>.',
+            results.results[1].expressions[0].value)
+
+        results = self._search('dogs cats')
+        self.assertEquals(['dogs'], [result.doc_id for result in results])
+
+        results = self._search('')
+        self.assertEquals(3, results.number_found)
+
+        with self.assertRaises(search.QueryError):
+            self._search(':')
+
+    def test_cursor_pages_through_all_documents(self):
+        self.index.put([
+            _make_doc('doc%d' % number, 'Title', 'content')
+            for number in xrange(5)])
+
+        doc_ids = []
+        cursor = search.Cursor()
+        while cursor:
+            results = self._search('', limit=2, cursor=cursor)
+            doc_ids += [result.doc_id for result in results]
+            cursor = results.cursor
+        self.assertEquals(['doc%d' % number for number in xrange(5)], doc_ids)
+
+    def test_get_range_and_delete(self):
+        self.index.put([
+            _make_doc('doc%d' % number, 'Title', 'content')
+            for number in xrange(3)])
+        self.assertEquals(['doc0', 'doc1', 'doc2'], [
+            doc.doc_id for doc in self.index.get_range(ids_only=True)])
+        doc = self.index.get_range(start_id='doc1', limit=1).results[0]
+        self.assertEquals('doc1', doc.doc_id)
+        self.assertEquals(datetime.datetime(2016, 1, 1), doc['date'][0].value)
+
+        self.index.delete(['doc0', 'doc2'])
+        self.assertEquals(['doc1'], [
+            doc.doc_id for doc in self.index.get_range(ids_only=True)])
+        self.assertEquals(1, self._search('content').number_found)
+
+    def test_documents_are_sharded(self):
+        self.swap(local_index, 'MAX_SHARD_SIZE_BYTES', 64)
+        rng = random.Random(0)
+        self.index.put([
+            _make_doc('doc%d' % number, 'Title', ' '.join(
+                rng.choice(WORDS) for _ in xrange(20)))
+            for number in xrange(10)])
+
+        with common_utils.Namespace(NAMESPACE):
+            head = local_index.LocalSearchIndexEntity.get_by_key_name(
+                'test_index')
+        self.assertTrue(head.num_shards > 1)
+
+        local_index.ProcessScopedLocalIndexCache.clear_instance()
+        self.assertEquals(10, self._search('').number_found)
+
+    def test_stale_cached_index_is_reloaded(self):
+        self.index.put([_make_doc('first', 'Title', 'content')])
+        cache = local_index.ProcessScopedLocalIndexCache.instance().cache
+        unused_found, stale_data = cache.get((NAMESPACE, 'test_index'))
+
+        # Another instance adds a document after this one loaded the index.
+        self.index.put([_make_doc('second', 'Title', 'content')])
+        cache.put((NAMESPACE, 'test_index'), stale_data)
+
+        self.assertEquals(2, self._search('content').number_found)
+
+    def test_half_finished_save_is_ignored(self):
+        self.index.put([_make_doc('first', 'Title', 'content')])
+
+        # A save that failed after writing its shards, but before switching
+        # the index to them, leaves them behind.
+        with common_utils.Namespace(NAMESPACE):
+            local_index.LocalSearchIndexShardEntity(
+                key_name=local_index.LocalSearchIndexShardEntity.key_names(
+                    'test_index', 'failed', 2)[0],
+                data=db.Blob('not an index')).put()
+
+        local_index.ProcessScopedLocalIndexCache.clear_instance()
+        self.assertEquals(1, self._search('content').number_found)
+        self.index.put([_make_doc('second', 'Title', 'content')])
+        self.assertEquals(2, self._search('content').number_found)
+
+    def test_concurrent_saves_keep_all_documents(self):
+        self.index.put([_make_doc('first', 'Title', 'content')])
+        other_index = local_index.LocalIndex('test_index', namespace=NAMESPACE)
+        save = local_index.LocalIndex._save
+        interleaved = []
+
+        def save_after_other_index(index, from_version, docs):
+            # Another writer saves after this one has loaded the documents.
+            if not interleaved:
+                interleaved.append(True)
+                other_index.put([_make_doc('second', 'Title', 'content')])
+            return save(index, from_version, docs)
+
+        self.swap(local_index.LocalIndex, '_save', save_after_other_index)
+        self.index.put([_make_doc('third', 'Title', 'content')])
+        self.assertEquals(['first', 'second', 'third'], [
+            doc.doc_id for doc in self.index.get_range(ids_only=True)])
+
+        # Only the shards of the current version are kept.
+        with common_utils.Namespace(NAMESPACE):
+            head = local_index.LocalSearchIndexEntity.get_by_key_name(
+                'test_index')
+            self.assertEquals(
+                head.num_shards,
+                local_index.LocalSearchIndexShardEntity.all().count())
+
+
+class LocalIndexBenchmarkTest(actions.TestBase):
+    """Compares query latency of LocalIndex and the Search API."""
+
+    NUM_DOCS = 400
+    NUM_WORDS_PER_DOC = 60
+    NUM_REPETITIONS = 5
+    QUERIES = ['apple', 'zebra', 'river sunset', 'lemon tiger quartz',
+               'xylophone walrus umbrella yellow']
+
+    def _time_queries(self, index):
+        matches = {}
+        start = time.time()
+        for _ in xrange(self.NUM_REPETITIONS):
+            for query_string in self.QUERIES:
+                results = index.search(search.Query(
+                    query_string=query_string,
+                    options=search.QueryOptions(
+                        limit=1000, returned_fields=['title'],
+                        snippeted_fields=['content'])))
+                matches[query_string] = sorted(
+                    result.doc_id for result in results)
+        num_queries = self.NUM_REPETITIONS * len(self.QUERIES)
+        return (time.time() - start) / num_queries, matches
+
+    def test_query_latency_compared_to_search_api(self):
+        rng = random.Random(0)
+        docs = [
+            _make_doc('doc%d' % number, 'Document %d' % number, ' '.join(
+                rng.choice(WORDS) for _ in xrange(self.NUM_WORDS_PER_DOC)))
+            for number in xrange(self.NUM_DOCS)]
+
+        indexes = [
+            ('Search API', search.Index(name='benchmark', namespace=NAMESPACE)),
+            ('LocalIndex', local_index.LocalIndex(
+                'benchmark', namespace=NAMESPACE))]
+        all_matches = []
+        for name, index in indexes:
+            for offset in xrange(
+                0, len(docs), search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST):
+                index.put(docs[
+                    offset:offset + search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST])
+            self._time_queries(index)  # Warm up any caches.
+            latency, matches = self._time_queries(index)
+            all_matches.append(matches)
+            logging.info(
+                '%s: %.2f ms per query over %d documents.',
+                name, latency * 1000, self.NUM_DOCS)
+
+        search_api_matches, local_matches = all_matches
+        self.assertEquals(search_api_matches, local_matches)
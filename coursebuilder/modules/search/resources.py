@@ -21,11 +21,12 @@ import datetime
 import gettext
 import HTMLParser
 import logging
-import operator
 import os
 import Queue
 import re
 import robotparser
+import threading
+import time
 import urllib
 import urlparse
 from xml.dom import minidom
@@ -49,6 +50,9 @@ YOUTUBE_TIMED_TEXT_URL = 'https://youtube.com/api/timedtext'
 # and more docs in the index.
 YOUTUBE_CAPTION_SIZE_SECS = 30
 
+# The maximum number of external pages fetched at the same time while indexing.
+MAX_CONCURRENT_FETCHES = 10
+
 
 class URLNotParseableException(Exception):
     """Exception thrown when the resource at a URL cannot be parsed."""
@@ -153,6 +157,43 @@ def get_minidom_from_xml(url, ignore_robots=False):
     return xmldoc
 
 
+def map_concurrently(function, items, max_workers=MAX_CONCURRENT_FETCHES):
+    """Calls function on each item using a bounded pool of threads.
+
+    Args:
+        function: callable. Takes one item; typically blocks on network I/O.
+        items: list. The items to process.
+        max_workers: int. The maximum number of concurrent calls.
+    Returns:
+        A list of (result, exception) pairs in the order of items; exactly one
+        of the two is None.
+    """
+    work = Queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+    results = [None] * len(items)
+
+    def worker():
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = (function(item), None)
+            except Exception as e:  # pylint: disable=broad-except
+                results[index] = (None, e)
+
+    threads = [
+        threading.Thread(target=worker)
+        for _ in xrange(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 def _url_allows_robots(url):
     """Checks robots.txt for user agent * at URL."""
     url = url.encode('utf-8')
@@ -374,9 +415,13 @@ class ExternalLinkResource(Resource):
     # TODO(emichael): Allow the user to turn off external links in the dashboard
 
     @classmethod
-    def generate_all_from_dist_dict(cls, link_dist, link_unit_id, timestamps):
+    def generate_all_from_dist_dict(cls, link_dist, link_unit_id, timestamps,
+                                    stage_times=None):
         """Generate all external links from a map from URL to distance.
 
+        Pages are fetched concurrently, one distance level at a time; links
+        found on pages at distance 0 are followed one level further.
+
         Args:
             link_dist: dict. a map from URL to distance in the link graph from
                 the course.
@@ -384,39 +429,37 @@ class ExternalLinkResource(Resource):
                 the link is found.
             timestamps: dict from doc_ids to last indexed datetimes. An empty
                 dict indicates that all documents should be generated.
+            stage_times: collections.Counter or None. If given, the seconds
+                spent fetching pages are added under 'fetching_links'.
         Yields:
             A sequence of ExternalLinkResource.
         """
 
-        url_queue = Queue.LifoQueue()
-        for url, dist in sorted(link_dist.iteritems(),
-                                key=operator.itemgetter(1)):
-            url_queue.put(url)
-
-        while not url_queue.empty():
-            url = url_queue.get()
-            doc_id = cls._get_doc_id(url)
-
-            if (cls._indexed_within_num_days(timestamps, doc_id,
-                                             cls.FRESHNESS_THRESHOLD_DAYS)):
-                continue
-
-            dist = link_dist[url]
-            unit_id = link_unit_id.get(url)
-            if dist > 1:
-                break
-
-            try:
-                resource = ExternalLinkResource(url, unit_id)
-            except URLNotParseableException as e:
-                logging.info(e)
-            else:
+        for dist in xrange(2):
+            urls = sorted([
+                url for url, url_dist in link_dist.iteritems()
+                if url_dist == dist and not cls._indexed_within_num_days(
+                    timestamps, cls._get_doc_id(url),
+                    cls.FRESHNESS_THRESHOLD_DAYS)])
+
+            start_time = time.time()
+            results = map_concurrently(
+                lambda url: ExternalLinkResource(url, link_unit_id.get(url)),
+                urls)
+            if stage_times is not None:
+                stage_times['fetching_links'] += time.time() - start_time
+
+            for resource, error in results:
+                if isinstance(error, URLNotParseableException):
+                    logging.info(error)
+                    continue
+                elif error:
+                    raise error  # pylint: disable=raising-bad-type
                 if dist < 1:
                     for new_link in resource.get_links():
                         if new_link not in link_dist:
                             link_dist[new_link] = dist + 1
-                            url_queue.put(new_link)
-                            link_unit_id[new_link] = unit_id
+                            link_unit_id[new_link] = resource.unit_id
                 yield resource
 
     def __init__(self, url, unit_id):
@@ -756,13 +799,15 @@ def get_snippeted_fields():
     return list(snippeted_fields)
 
 
-def generate_all_documents(course, timestamps):
+def generate_all_documents(course, timestamps, stage_times=None):
     """A generator for all docs for a given course.
 
     Args:
         course: models.courses.Course. the course to be indexed.
         timestamps: dict from doc_ids to last indexed datetimes. An empty dict
             indicates that all documents should be generated.
+        stage_times: collections.Counter or None. If given, the seconds spent
+            fetching external pages are added under 'fetching_links'.
     Yields:
         A sequence of search.Document. If a document is within the freshness
         threshold, no document will be generated. This function does not modify
@@ -785,7 +830,7 @@ def generate_all_documents(course, timestamps):
             yield resource.get_document()
 
     for resource in ExternalLinkResource.generate_all_from_dist_dict(
-            link_dist, link_unit_id, timestamps):
+            link_dist, link_unit_id, timestamps, stage_times=stage_times):
         yield resource.get_document()
 
 
@@ -18,6 +18,7 @@ __author__ = 'Ellis Michael (emichael@google.com)'
 
 import collections
 import gettext
+import itertools
 import logging
 import math
 import mimetypes
@@ -26,6 +27,7 @@ import time
 import traceback
 
 import jinja2
+import local_index
 import messages
 import resources
 import webapp2
@@ -57,6 +59,12 @@ DEPRECATED = config.ConfigProperty(
         'will not generate no-such-variable error messages for existing '
         'installations that have this property set.'),
     default_value=False, label='Automatically index search', deprecated=True)
+USE_LOCAL_INDEX = config.ConfigProperty(
+    'gcb_search_use_local_index', bool, safe_dom.Text(
+        'Whether course search indexes are kept in the datastore and searched '
+        'by Course Builder itself instead of by the App Engine Search API. '
+        'Courses must be re-indexed after this setting is changed.'),
+    default_value=False, label='Local search index')
 SEARCH_QUERIES_MADE = counters.PerfCounter(
     'gcb-search-queries-made',
     'The number of student queries made to the search module.')
@@ -73,6 +81,8 @@ RESULTS_LIMIT = 10
 GCB_SEARCH_FOLDER_NAME = os.path.normpath('/modules/search/')
 
 MAX_RETRIES = 5
+# The Search API rejects puts of more documents than this.
+MAX_DOCS_PER_PUT = search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST
 
 # Name of a per-course setting determining whether automatic indexing is enabled
 AUTO_INDEX_SETTING = 'auto_index'
@@ -87,25 +97,91 @@ class ModuleDisabledException(Exception):
 
 
 def get_index(namespace, locale):
+    """Returns the search.Index, or an equivalent LocalIndex, for a locale."""
     assert locale, 'Must have a non-null locale'
+    if USE_LOCAL_INDEX.value:
+        return local_index.LocalIndex(
+            name=INDEX_NAME % locale, namespace=namespace)
     return search.Index(name=INDEX_NAME % locale, namespace=namespace)
 
 
+def _get_max_docs_per_request(index):
+    """Returns how many docs to put into or delete from index at once.
+
+    Every put() or delete() rewrites a LocalIndex as a whole, so it is given
+    all of the docs at once; None stands for no limit.
+    """
+    if isinstance(index, local_index.LocalIndex):
+        return None
+    return MAX_DOCS_PER_PUT
+
+
+def _put_docs(index, docs, timestamps, doc_types):
+    """Put a batch of docs into the index, retrying only transient failures.
+
+    Args:
+        index: search.Index. the index to put the docs into.
+        docs: list of search.Document. at most as many docs as
+            _get_max_docs_per_request() allows.
+        timestamps: dict from doc_ids to last indexed datetimes. Updated with
+            the docs that were indexed.
+        doc_types: dict from doc_ids to resource types. Updated with the docs
+            that were indexed.
+    """
+
+    retry_count = 0
+    while docs:
+        try:
+            index.put(docs)
+            codes = [search.OperationResult.OK] * len(docs)
+        except search.Error, e:
+            results = getattr(e, 'results', None)
+            if results:
+                codes = [result.code for result in results]
+            else:
+                codes = [search.OperationResult.TRANSIENT_ERROR] * len(docs)
+
+        retry_docs = []
+        for doc, code in zip(docs, codes):
+            if code == search.OperationResult.OK:
+                timestamps[doc.doc_id] = doc['date'][0].value
+                doc_types[doc.doc_id] = doc['type'][0].value
+            elif code == search.OperationResult.TRANSIENT_ERROR:
+                retry_docs.append(doc)
+            else:
+                logging.error('Failed to index doc_id: %s', doc.doc_id)
+
+        retry_count += 1
+        if retry_docs and retry_count >= MAX_RETRIES:
+            for doc in retry_docs:
+                logging.error(
+                    'Multiple transient errors indexing doc_id: %s',
+                    doc.doc_id)
+            break
+        docs = retry_docs
+
+
 def index_all_docs(course, incremental):
     """Index all of the docs for a given models.Course object.
 
+    Documents are put into the index in batches of up to MAX_DOCS_PER_PUT,
+    or all at once into a LocalIndex.
+
     Args:
         course: models.courses.Course. the course to index.
         incremental: boolean. whether or not to index only new or out-of-date
             items.
     Returns:
-        A dict with three keys.
+        A dict with four keys.
         'num_indexed_docs' maps to an int, the number of documents added to the
             index.
         'doc_type' maps to a counter with resource types as keys mapping to the
             number of that resource added to the index.
         'indexing_time_secs' maps to a float representing the number of seconds
             the indexing job took.
+        'stage_times_secs' maps to a counter with the stages 'generating_docs',
+            'fetching_links' and 'putting_docs' as keys mapping to the number
+            of seconds spent in each.
     Raises:
         ModuleDisabledException: The search module is currently disabled.
     """
@@ -119,31 +195,31 @@ def index_all_docs(course, incremental):
         course.app_context.get_current_locale())
     timestamps, doc_types = (_get_index_metadata(index) if incremental
                              else ({}, {}))
-    for doc in resources.generate_all_documents(course, timestamps):
-        retry_count = 0
-        while retry_count < MAX_RETRIES:
-            try:
-                index.put(doc)
-                timestamps[doc.doc_id] = doc['date'][0].value
-                doc_types[doc.doc_id] = doc['type'][0].value
-                break
-            except search.Error, e:
-                if e.results[0].code == search.OperationResult.TRANSIENT_ERROR:
-                    retry_count += 1
-                    if retry_count >= MAX_RETRIES:
-                        logging.error(
-                            'Multiple transient errors indexing doc_id: %s',
-                            doc.doc_id)
-                else:
-                    logging.error('Failed to index doc_id: %s', doc.doc_id)
-                    break
+    max_docs_per_put = _get_max_docs_per_request(index)
+
+    stage_times = collections.Counter(
+        generating_docs=0, fetching_links=0, putting_docs=0)
+    all_docs = resources.generate_all_documents(
+        course, timestamps, stage_times=stage_times)
+    while True:
+        stage_start_time = time.time()
+        docs = list(itertools.islice(all_docs, max_docs_per_put))
+        stage_times['generating_docs'] += time.time() - stage_start_time
+        if not docs:
+            break
+        stage_start_time = time.time()
+        _put_docs(index, docs, timestamps, doc_types)
+        stage_times['putting_docs'] += time.time() - stage_start_time
+    # Fetching links happens while generating docs; report the two separately.
+    stage_times['generating_docs'] -= stage_times['fetching_links']
 
     indexed_doc_types = collections.Counter()
     for type_name in doc_types.values():
         indexed_doc_types[type_name] += 1
     return {'num_indexed_docs': len(timestamps),
             'doc_types': indexed_doc_types,
-            'indexing_time_secs': time.time() - start_time}
+            'indexing_time_secs': time.time() - start_time,
+            'stage_times_secs': stage_times}
 
 
 def clear_index(namespace, locale):
@@ -153,12 +229,14 @@ def clear_index(namespace, locale):
         raise ModuleDisabledException('The search module is disabled.')
 
     index = get_index(namespace, locale)
-    doc_ids = [document.doc_id for document in index.get_range(ids_only=True)]
+    limit = _get_max_docs_per_request(index)
+    doc_ids = [document.doc_id
+               for document in index.get_range(ids_only=True, limit=limit)]
     total_docs = len(doc_ids)
     while doc_ids:
         index.delete(doc_ids)
         doc_ids = [document.doc_id
-                   for document in index.get_range(ids_only=True)]
+                   for document in index.get_range(ids_only=True, limit=limit)]
     return {'deleted_docs': total_docs}
 
 
@@ -475,6 +553,7 @@ class IndexCourse(jobs.DurableJob):
             'num_indexed_docs': 0,
             'doc_types': collections.Counter(),
             'indexing_time_secs': 0,
+            'stage_times_secs': collections.Counter(),
             'locales': []
         }
         for locale in app_context.get_allowed_locales():
@@ -487,6 +566,7 @@ class IndexCourse(jobs.DurableJob):
             indexing_stats['num_indexed_docs'] += stats['num_indexed_docs']
             indexing_stats['doc_types'] += stats['doc_types']
             indexing_stats['indexing_time_secs'] += stats['indexing_time_secs']
+            indexing_stats['stage_times_secs'].update(stats['stage_times_secs'])
             indexing_stats['locales'].append(locale)
         return indexing_stats
 
@@ -16,12 +16,14 @@
 
 __author__ = 'Ellis Michael (emichael@google.com)'
 
+import datetime
 import logging
 import re
 import urllib
 
 from common import utils as common_utils
 from controllers import sites
+from models import config
 from models import courses
 from models import resources_display
 from models import models
@@ -33,6 +35,7 @@ from modules.search import search_unit_tests
 from tests.functional import actions
 
 from google.appengine.api import namespace_manager
+from google.appengine.api import search as gae_search
 
 
 class SearchTest(search_unit_tests.SearchTestBase):
@@ -166,6 +169,74 @@ class SearchTest(search_unit_tests.SearchTestBase):
         self.assertNotIn('gcb-search-result', response.body)
         self.assertNotIn(search_unit_tests.SECOND_LINK_PAGE_URL, response.body)
 
+    def test_docs_are_put_in_batches(self):
+        sites.setup_courses('course:/test::ns_test, course:/:/')
+        course = courses.Course(None, app_context=sites.get_all_courses()[0])
+        unit = course.add_unit()
+        unit.availability = courses.AVAILABILITY_AVAILABLE
+        for _ in xrange(3):
+            lesson = course.add_lesson(unit)
+            lesson.objectives = 'batched lesson'
+            lesson.availability = courses.AVAILABILITY_AVAILABLE
+        course.update_unit(unit)
+        course.save()
+
+        puts = []
+        real_put_docs = search._put_docs
+        def counting_put_docs(index, docs, timestamps, doc_types):
+            puts.append(len(docs))
+            real_put_docs(index, docs, timestamps, doc_types)
+        self.swap(search, '_put_docs', counting_put_docs)
+        self.swap(search, 'MAX_DOCS_PER_PUT', 2)
+
+        self.index_test_course()
+
+        self.assertTrue(puts)
+        self.assertTrue(all(num_docs <= 2 for num_docs in puts))
+        self.assertIn(2, puts)
+        response = self.get('/test/search?query=batched')
+        self.assertEqual(
+            3, response.body.count('class="gcb-search-result-title"'))
+
+        response = self.get('/test/dashboard?action=settings_search')
+        self.assertIn('fetching external links took', response.body)
+
+    def test_put_retries_only_transient_failures(self):
+        def make_doc(doc_id):
+            return gae_search.Document(doc_id=doc_id, fields=[
+                gae_search.DateField(name='date', value=datetime.date.today()),
+                gae_search.AtomField(name='type', value='Lesson')])
+        docs = [make_doc('ok'), make_doc('transient'), make_doc('permanent')]
+
+        class FlakyIndex(object):
+
+            def __init__(self):
+                self.puts = []
+
+            def put(self, docs):
+                self.puts.append([doc.doc_id for doc in docs])
+                if len(self.puts) == 1:
+                    raise gae_search.PutError('flaky', [
+                        gae_search.PutResult(
+                            code=gae_search.OperationResult.OK),
+                        gae_search.PutResult(
+                            code=gae_search.OperationResult.TRANSIENT_ERROR),
+                        gae_search.PutResult(
+                            code=gae_search.OperationResult.INVALID_REQUEST)])
+
+        index = FlakyIndex()
+        timestamps = {}
+        doc_types = {}
+        self.swap(logging, 'error', self.error_report)
+        search._put_docs(index, docs, timestamps, doc_types)
+
+        self.assertEqual(
+            [['ok', 'transient', 'permanent'], ['transient']], index.puts)
+        self.assertEqual(set(['ok', 'transient']), set(timestamps))
+        self.assertEqual({'ok': 'Lesson', 'transient': 'Lesson'}, doc_types)
+        self.assertEqual(
+            'Failed to index doc_id: permanent', self.logged_error)
+
     def test_youtube(self):
         sites.setup_courses('course:/test::ns_test, course:/:/')
         default_namespace = namespace_manager.get_namespace()
@@ -451,3 +522,15 @@ class SearchTest(search_unit_tests.SearchTestBase):
         self.execute_all_deferred_tasks()
         response = search.fetch(course, 'color')
         self.assertEquals(1, response['total_found'])
+
+
+class LocalIndexSearchTest(SearchTest):
+    """Runs all of the search module tests against the local index."""
+
+    def setUp(self):
+        super(LocalIndexSearchTest, self).setUp()
+        config.Registry.test_overrides[search.USE_LOCAL_INDEX.name] = True
+
+    def tearDown(self):
+        del config.Registry.test_overrides[search.USE_LOCAL_INDEX.name]
+        super(LocalIndexSearchTest, self).tearDown()
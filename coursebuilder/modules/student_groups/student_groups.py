@@ -896,6 +896,9 @@ class StudentGroupDTO(object):
         CONTENT_TRIGGERS_PROPERTY: list,
     }
 
+    # Set by the entity cache when the DTO is built from a cached entity.
+    updated_on = None
+
     def __init__(self, the_id, the_dict):
         self.id = the_id
         self.dict = the_dict
@@ -1648,12 +1651,11 @@ def _add_student_group_to_profile(handler, app_context, student):
     return ret
 
 
-def modify_course_environment(app_context, env):
-    """Callback: Inject overrides into course-level environment settings."""
+def _get_student_group_overriding_environment(app_context):
     student_group = StudentGroupMembership.get_student_group_for_current_user(
         app_context)
     if not student_group:
-        return
+        return None
 
     # Consider a user who has been added to a student group.  Now, whenever
     # that user is in session, we override the course-level settings to
@@ -1668,7 +1670,25 @@ def modify_course_environment(app_context, env):
         path = sites.get_path_info()
         if (path.endswith(StudentGroupRestHandler.URL) or
             path.endswith(StudentGroupAvailabilityRestHandler.URL)):
-            return
+            return None
+    return student_group
+
+
+def get_course_environment_key(app_context):
+    """Callback: Identify the overrides modify_course_environment applies."""
+    student_group = _get_student_group_overriding_environment(app_context)
+    if not student_group:
+        return None
+    return (
+        student_group.id, student_group.updated_on,
+        users.get_current_user().email())
+
+
+def modify_course_environment(app_context, env):
+    """Callback: Inject overrides into course-level environment settings."""
+    student_group = _get_student_group_overriding_environment(app_context)
+    if not student_group:
+        return
 
     # Apply overrides as applicable.
     # pylint: disable=protected-access
@@ -1714,6 +1734,13 @@ def modify_unit_and_lesson_attributes(course, units, lessons):
             lesson.availability = lesson_availability
 
 
+def get_student_view_key(course, unused_student):
+    """Callback from Course to identify the current user's view variant."""
+    student_group = StudentGroupMembership.get_student_group_for_current_user(
+        course.app_context)
+    return student_group.id if student_group else None
+
+
 def act_on_all_triggers(course):
     """Hourly cron callback that updates availability based on triggers."""
     logged_ns = common_utils.get_ns_name_for_logging(course=course)
@@ -1942,11 +1969,15 @@ def register_module():
         # appropriate.
         courses.Course.COURSE_ELEMENT_STUDENT_VIEW_HOOKS.append(
             modify_unit_and_lesson_attributes)
+        courses.Course.COURSE_ELEMENT_STUDENT_VIEW_KEY_PROVIDERS.append(
+            get_student_view_key)
 
         # Register a callback with Course so that when the environment is
         # fetched, we can submit overwrite items.
         courses.Course.COURSE_ENV_POST_COPY_HOOKS.append(
             modify_course_environment)
+        courses.Course.COURSE_ENV_POST_COPY_KEY_PROVIDERS.append(
+            get_course_environment_key)
 
         # Register callbacks that alter course explorer course cards.
         graphql.notify_module_enabled(CourseOverrideTrigger, MODULE_NAME)
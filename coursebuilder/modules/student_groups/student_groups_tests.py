@@ -24,6 +24,7 @@ import zlib
 from common import crypto
 from common import resource
 from common import users
+from common import utc
 from common import utils as common_utils
 from controllers import sites
 from models import courses
@@ -1160,6 +1161,23 @@ class AvailabilityTests(StudentGroupsTestBase):
         self.group_id = transforms.loads(response['payload'])['key']
         self._put_availability(self.group_id, [self.IN_GROUP_STUDENT_EMAIL])
 
+    def test_course_environment_key_follows_group_updates(self):
+        actions.login(self.IN_GROUP_STUDENT_EMAIL)
+        group_id, updated_on, unused_email = (
+            student_groups.get_course_environment_key(self.app_context))
+        self.assertEquals(self.group_id, group_id)
+        self.assertIsNotNone(updated_on)
+
+        later = updated_on + datetime.timedelta(seconds=1)
+        self.swap(utc, 'now_as_datetime', lambda: later)
+        actions.login(self.ADMIN_EMAIL)
+        self._put_group(self.group_id, 'Group One', 'changed description')
+        actions.login(self.IN_GROUP_STUDENT_EMAIL)
+        group_id, updated_on, unused_email = (
+            student_groups.get_course_environment_key(self.app_context))
+        self.assertEquals(self.group_id, group_id)
+        self.assertEquals(later, updated_on)
+
     def test_group_creation_defaults_pass_through_to_course(self):
         actions.login(self.IN_GROUP_STUDENT_EMAIL)
 
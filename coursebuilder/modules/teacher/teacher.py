@@ -515,7 +515,9 @@ class TeacherDashboardHandler(
           #  logging.debug('***RAM*** calc lessons = ' + str(lessons))
         return lessons
 
-    def calculate_student_progress_data(self, student, course, tracker, units):
+    def calculate_student_progress_data(self, student, course, tracker, units,
+                                        unit_progress_raw=None,
+                                        student_progress=None):
         """ Returns a dict that summarizes student progress for course, units, and lessons.
 
            The dict takes the form: {'course_progress': c, 'unit_completion': u, 'lessons_progress': p}
@@ -526,7 +528,8 @@ class TeacherDashboardHandler(
         """
 
         # Progress on each unit in the course -- an unitid index dict
-        unit_progress_raw = tracker.get_unit_percent_complete(student)
+        if unit_progress_raw is None:
+            unit_progress_raw = tracker.get_unit_percent_complete(student)
         unit_progress_data = {}
         course_progress = 0
         for key in unit_progress_raw:
@@ -541,7 +544,8 @@ class TeacherDashboardHandler(
             logging.debug('***BAH*** course_progress ' + str(course_progress) + ' for ' + str(len(unit_progress_data)) + ' units. unit_progress_data ' + str(unit_progress_data))
 
         # An object that summarizes student progress
-        student_progress = tracker.get_or_create_progress(student)
+        if student_progress is None:
+            student_progress = tracker.get_or_create_progress(student)
         if GLOBAL_DEBUG:
             logging.debug('***RAM*** student_progress ' + str(student_progress))
 
@@ -606,11 +610,17 @@ class TeacherDashboardHandler(
                 filtered_answers[unit][lesson]['numCorrect'] = str(n_correct)
         return filtered_answers
 
-    def create_student_table(self, email, course, tracker, units, get_scores=False):
+    def create_student_table(self, email, course, tracker, units, get_scores=False,
+                             student=None, unit_progress_raw=None,
+                             student_progress=None):
         student_dict = {}
-        student = Student.get_first_by_email(email)[0]  # returns a tuple
+        if student is None:
+            student = Student.get_first_by_email(email)[0]  # returns a tuple
         if student:
-            progress_dict = self.calculate_student_progress_data(student,course,tracker,units)
+            progress_dict = self.calculate_student_progress_data(
+                student, course, tracker, units,
+                unit_progress_raw=unit_progress_raw,
+                student_progress=student_progress)
             #if get_scores:
             # Using StudentAnswersEntity
             scores = self.retrieve_student_scores_and_attempts(email, course)
@@ -643,8 +653,23 @@ class TeacherDashboardHandler(
 
         students = []
         if len(index) > 0:
+            # Look up all students first, so that their progress is loaded and
+            # rolled up in bulk rather than with several RPCs per student.
+            found = []
             for email in index:
-                student_dict = self.create_student_table(email, course, tracker, units, get_scores=False)
+                student = Student.get_first_by_email(email)[0]  # returns a tuple
+                if student:
+                    found.append((email, student))
+            progress_multi = tracker.get_progress_multi(
+                [student for _, student in found])
+            percent_multi = tracker.get_unit_percent_complete_multi(
+                [student for _, student in found], progress_multi)
+            for email, student in found:
+                student_dict = self.create_student_table(
+                    email, course, tracker, units, get_scores=False,
+                    student=student,
+                    unit_progress_raw=percent_multi[student.user_id],
+                    student_progress=progress_multi[student.user_id])
                 if student_dict:
                     students.append(student_dict)
         return students
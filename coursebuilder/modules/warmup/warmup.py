@@ -35,7 +35,16 @@ class WarmupHandler(webapp2.RequestHandler):
 
     URL = '/_ah/warmup'
 
+    # Modules may add functions to this list; each is called with no arguments
+    # when a new instance starts, to precompute state ahead of user requests.
+    WARMUP_HOOKS = []
+
     def get(self):
+        for hook in self.WARMUP_HOOKS:
+            try:
+                hook()
+            except Exception:  # On purpose. pylint: disable=broad-except
+                _LOG.exception('Warmup hook failed: %s', hook)
         if not appengine_config.PRODUCTION_MODE:
             port = urlparse.urlparse(self.request.url).port
             _LOG.info(' -------------------------------')
@@ -44,3 +44,15 @@ class WarmupTests(actions.TestBase):
             self.assertLogDoesNotContain('or http://0.0.0.0:8081')
         finally:
             appengine_config.PRODUCTION_MODE = False
+
+    def test_warmup_hooks_are_run(self):
+        calls = []
+
+        def failing_hook():
+            raise ValueError('Oops')
+
+        self.swap(warmup.WarmupHandler, 'WARMUP_HOOKS', [
+            failing_hook, lambda: calls.append(True)])
+        self.get('http://localhost:8081' + warmup.WarmupHandler.URL)
+        self.assertEquals([True], calls)
+        self.assertLogContains('Warmup hook failed')
@@ -51,7 +51,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.admin_settings.HtmlHookTest': 17,
     'tests.functional.admin_settings.JinjaContextTest': 2,
     'tests.functional.admin_settings.WelcomePageTests': 2,
-    'tests.functional.assets_rest.AssetsRestTest': 13,
+    'tests.functional.assets_rest.AssetsRestTest': 18,
     'tests.functional.common_crypto.EncryptionManagerTests': 5,
     'tests.functional.common_crypto.XsrfTokenManagerTests': 3,
     'tests.functional.common_crypto.PiiObfuscationHmac': 2,
@@ -71,7 +71,8 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_analytics.ProgressAnalyticsTest': 9,
     'tests.functional.model_analytics.QuestionAnalyticsTest': 3,
     'tests.functional.model_config.ValueLoadingTests': 2,
-    'tests.functional.model_courses.CourseCachingTest': 5,
+    'tests.functional.model_courses.CourseCachingTest': 11,
+    'tests.functional.model_courses.CourseEnvironTest': 2,
     'tests.functional.model_courses.PermissionsTest': 4,
     'tests.functional.model_data_sources.PaginatedTableTest': 17,
     'tests.functional.model_data_sources.PiiExportTest': 4,
@@ -82,8 +83,9 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_jobs.MapReduceMethodTypeTests': 2,
     'tests.functional.model_models.BaseJsonDaoTestCase': 1,
     'tests.functional.model_models.ContentChunkTestCase': 16,
+    'tests.functional.model_models.CounterDeltaBufferTestCase': 3,
     'tests.functional.model_models.EventEntityTestCase': 1,
-    'tests.functional.model_models.MemcacheManagerTestCase': 4,
+    'tests.functional.model_models.MemcacheManagerTestCase': 6,
     'tests.functional.model_models.PersonalProfileTestCase': 1,
     'tests.functional.model_models.QuestionDAOTestCase': 3,
     'tests.functional.model_models.StudentAnswersEntityTestCase': 1,
@@ -97,19 +99,22 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_student_work.ReviewTest': 3,
     'tests.functional.model_student_work.SubmissionTest': 4,
     'tests.functional.model_utils.QueryMapperTest': 4,
+    'tests.functional.model_vfs.VfsCacheTombstoneTest': 4,
     'tests.functional.model_vfs.VfsLargeFileSupportTest': 6,
+    'tests.functional.model_vfs.VfsListingTest': 6,
+    'tests.functional.model_vfs.VfsStreamingTest': 2,
     'tests.functional.module_config_test.ManipulateAppYamlFileTest': 8,
     'tests.functional.module_config_test.ModuleIncorporationTest': 12,
     'tests.functional.module_config_test.ModuleManifestTest': 7,
     'tests.functional.modules_data_source_providers.CourseElementsTest': 11,
     'tests.functional.modules_data_source_providers.StudentScoresTest': 6,
     'tests.functional.modules_data_source_providers.StudentsTest': 5,
-    'tests.functional.progress_percent.ProgressPercent': 4,
+    'tests.functional.progress_percent.ProgressPercent': 5,
     'tests.functional.student_answers.StudentAnswersAnalyticsTest': 1,
     'tests.functional.student_labels.StudentLabelsTest': 32,
     'tests.functional.student_last_location.NonRootCourse': 9,
     'tests.functional.student_last_location.RootCourse': 3,
-    'tests.functional.student_tracks.StudentTracksTest': 10,
+    'tests.functional.student_tracks.StudentTracksTest': 11,
     'tests.functional.roles.RolesTest': 24,
     'tests.functional.test_classes.ActivityTest': 1,
     'tests.functional.test_classes.AdminAspectTest': 10,
@@ -170,8 +175,10 @@ ALL_TEST_CLASSES = {
     'tests.unit.common_safe_dom.ScriptElementTests': 3,
     'tests.unit.common_safe_dom.EntityTests': 11,
     'tests.unit.common_tags.CustomTagTests': 13,
+    'tests.unit.common_tags.RenderCacheTests': 2,
     'tests.unit.common_utc.UtcUnitTests': 4,
     'tests.unit.common_utils.CommonUnitTests': 11,
+    'tests.unit.common_utils.CopyOnWriteDictTests': 2,
     'tests.unit.common_utils.ParseTimedeltaTests': 8,
     'tests.unit.common_utils.ValidateTimedeltaTests': 6,
     'tests.unit.common_utils.ValidateYoutubeVideoRecognizer': 1,
@@ -179,7 +186,12 @@ ALL_TEST_CLASSES = {
     'tests.unit.javascript_tests.AllJavaScriptTests': 2,
     'tests.unit.models_analytics.AnalyticsTests': 6,
     'tests.unit.models_config.ValidateIntegerRangeTests': 3,
+    'tests.unit.models_courses.CourseElementStudentViewTests': 4,
+    'tests.unit.models_courses.CourseModel13IndexTests': 3,
+    'tests.unit.models_courses.WorkflowParsingTests': 3,
     'tests.unit.models_courses.WorkflowValidationTests': 13,
+    'tests.unit.models_progress.CourseOutlineIndexTests': 2,
+    'tests.unit.models_progress.DecodedProgressTests': 5,
     'tests.unit.models_transforms.JsonToDictTests': 13,
     'tests.unit.models_transforms.JsonParsingTests': 3,
     'tests.unit.models_transforms.SchemaValidationTests': 21,
@@ -21,7 +21,10 @@ import os
 import urllib
 
 from common import crypto
+from common import utils as common_utils
+from controllers import sites
 from models import transforms
+from models import vfs
 from modules.dashboard import filer
 from tests.functional import actions
 
@@ -223,3 +226,120 @@ class AssetsRestTest(actions.TestBase):
         asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
         response = self.get(asset_url, expect_errors=True)
         self.assertEquals(404, response.status_int)
+
+    def test_conditional_get(self):
+        base = 'assets/img'
+        name = 'foo.jpg'
+        _post_asset(self, base, name, name, 'xyzzy')
+        asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
+
+        response = self.get(asset_url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertEquals('bytes', response.headers['Accept-Ranges'])
+
+        # Revalidation only needs the metadata, not the file content.
+        def open_not_expected(*unused_args, **unused_kwargs):
+            self.fail('File content should not be loaded.')
+
+        self.swap(vfs.DatastoreBackedFileSystem, 'open', open_not_expected)
+        response = self.get(asset_url, headers={'If-None-Match': etag})
+        self.assertEquals(304, response.status_int)
+        self.assertEquals('', response.body)
+        response = self.get(
+            asset_url, headers={'If-Modified-Since': last_modified})
+        self.assertEquals(304, response.status_int)
+
+    def test_conditional_get_after_update(self):
+        base = 'assets/img'
+        name = 'foo.jpg'
+        _post_asset(self, base, name, name, 'xyzzy')
+        asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
+        etag = self.get(asset_url).headers['ETag']
+
+        _post_asset(self, base, name, name, 'plugh')
+        response = self.get(asset_url, headers={'If-None-Match': etag})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('plugh', response.body)
+        self.assertNotEquals(etag, response.headers['ETag'])
+
+        # Inherited files from the bundled course are validated, too.
+        response = self.get('/%s/assets/css/main.css' % COURSE_NAME)
+        response = self.get(
+            '/%s/assets/css/main.css' % COURSE_NAME,
+            headers={'If-None-Match': response.headers['ETag']})
+        self.assertEquals(304, response.status_int)
+
+    def test_file_without_updated_on_is_served(self):
+        base = 'assets/img'
+        name = 'foo.jpg'
+        _post_asset(self, base, name, name, 'xyzzy')
+        asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
+        with common_utils.Namespace(NAMESPACE):
+            metadata = vfs.FileMetadataEntity.get_by_key_name(
+                '/%s/%s' % (base, name))
+            metadata.updated_on = None
+            metadata.put()
+        vfs.ProcessScopedVfsCache.clear_all()
+
+        response = self.get(asset_url, headers={
+            'If-None-Match': '*',
+            'If-Modified-Since': 'Fri, 01 Jan 2016 00:00:00 GMT'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('xyzzy', response.body)
+        self.assertNotIn('ETag', response.headers)
+        self.assertNotIn('Last-Modified', response.headers)
+
+    def test_range_requests(self):
+        base = 'assets/img'
+        name = 'foo.jpg'
+        _post_asset(self, base, name, name, '0123456789')
+        asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
+
+        response = self.get(asset_url, headers={'Range': 'bytes=2-5'})
+        self.assertEquals(206, response.status_int)
+        self.assertEquals('2345', response.body)
+        self.assertEquals('bytes 2-5/10', response.headers['Content-Range'])
+
+        response = self.get(asset_url, headers={'Range': 'bytes=7-'})
+        self.assertEquals('789', response.body)
+        response = self.get(asset_url, headers={'Range': 'bytes=-4'})
+        self.assertEquals('6789', response.body)
+        response = self.get(asset_url, headers={'Range': 'bytes=8-100'})
+        self.assertEquals('89', response.body)
+
+        # Ranges we don't support, invalid ranges, and ranges of a changed
+        # file, get it all.
+        response = self.get(asset_url, headers={'Range': 'bytes=0-1,4-5'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('0123456789', response.body)
+        response = self.get(asset_url, headers={'Range': 'bytes=5-2'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('0123456789', response.body)
+        response = self.get(asset_url, headers={
+            'Range': 'bytes=2-5', 'If-Range': '"stale"'})
+        self.assertEquals(200, response.status_int)
+        self.assertEquals('0123456789', response.body)
+
+        response = self.get(
+            asset_url, headers={'Range': 'bytes=10-'}, expect_errors=True)
+        self.assertEquals(416, response.status_int)
+        self.assertEquals('bytes */10', response.headers['Content-Range'])
+
+    def test_large_file_is_streamed(self):
+        self.swap(vfs, '_MAX_VFS_SHARD_SIZE', 10)
+        self.swap(vfs, '_MAX_VFS_NUM_SHARDS', 10)
+        self.swap(vfs, 'MAX_CACHED_FILE_SIZE_BYTES', 20)
+        self.swap(sites.AssetHandler, 'CHUNK_SIZE_BYTES', 10)
+        base = 'assets/img'
+        name = 'foo.jpg'
+        content = '0123456789' * 5
+        _post_asset(self, base, name, name, content)
+        asset_url = '/%s/%s/%s' % (COURSE_NAME, base, name)
+
+        response = self.get(asset_url)
+        self.assertEquals(content, response.body)
+        response = self.get(asset_url, headers={'Range': 'bytes=15-34'})
+        self.assertEquals(206, response.status_int)
+        self.assertEquals(content[15:35], response.body)
+        self.assertEquals('bytes 15-34/50', response.headers['Content-Range'])
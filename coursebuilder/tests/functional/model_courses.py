@@ -18,6 +18,10 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+import base64
+import os
+
+from common import tags
 from common import utils as common_utils
 from controllers import sites
 from models import config
@@ -45,6 +49,8 @@ sollicitudin orci imperdiet fermentum semper. Curabitur id ornare elit. Proin
 pharetra, diam ac iaculis sed.
 """ * 10
 
+QUESTION_HTML = '<p>Question:</p><question quid="%s" instanceid="q"></question>'
+
 
 class CourseCachingTest(actions.TestBase):
 
@@ -64,36 +70,54 @@ class CourseCachingTest(actions.TestBase):
         del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
         super(CourseCachingTest, self).tearDown()
 
-    def _add_large_unit(self, num_lessons):
+    def _add_large_unit(self, num_lessons, make_objectives=None):
         unit = self.course.add_unit()
         for unused in range(num_lessons):
             lesson = self.course.add_lesson(unit)
-            lesson.objectives = LOREM_IPSUM
+            lesson.objectives = (
+                make_objectives() if make_objectives else LOREM_IPSUM)
         self.course.save()
         return unit
 
-    def test_large_course_is_cached_in_memcache(self):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
-        unit = self._add_large_unit(num_lessons)
+    def _add_incompressible_unit(self, num_bytes):
+        # Random text does not compress much, so the course cannot fit in
+        # a single memcache shard.
+        lesson_bytes = 10 * 1000
+        return self._add_large_unit(
+            num_bytes // lesson_bytes,
+            lambda: base64.b64encode(os.urandom(lesson_bytes)))
+
+    def _get_manifest(self):
+        return models.MemcacheManager.get(
+            courses.CachedCourse13._make_manifest_key(), self.NAMESPACE)
 
-        memcache_keys = courses.CachedCourse13._make_keys()
+    def _get_shard_keys(self, manifest):
+        return courses.CachedCourse13._make_shard_keys(
+            manifest['generation'], manifest['num_shards'])
+
+    def _load_course_from_memcache(self):
+        courses.ProcessScopedCourseCache.clear_instance()
+        return courses.Course(handler=None, app_context=self.app_context)
+
+    def test_large_course_is_cached_in_memcache(self):
+        unit = self._add_incompressible_unit(models.MEMCACHE_MAX * 3 // 2)
 
         # Verify memcache has no contents upon initial save.
-        memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
-        self.assertEquals({}, memcache_values)
+        self.assertIsNone(self._get_manifest())
 
         # Load course.  It won't be in memcache, so Course will fetch it
         # from VFS and save it in memcache.
         course = courses.Course(handler=None, app_context=self.app_context)
+        lessons = course.get_lessons(unit.unit_id)
 
         # Check that things have gotten into memcache.
+        manifest = self._get_manifest()
+        self.assertEquals(2, manifest['num_shards'])
+        memcache_keys = self._get_shard_keys(manifest)
         memcache_values = models.MemcacheManager.get_multi(
             memcache_keys, self.NAMESPACE)
         self.assertEquals(
-            memcache_keys[0:2],
-            sorted(memcache_values.keys()),
-            'Only two keys should be present.')
+            sorted(memcache_keys), sorted(memcache_values.keys()))
         self.assertEquals(
             models.MEMCACHE_MAX,
             len(memcache_values[memcache_keys[0]]),
@@ -114,20 +138,42 @@ class CourseCachingTest(actions.TestBase):
             shard_1.delete()
 
         # Re-load course to force load from memcache.
-        course = courses.Course(handler=None, app_context=self.app_context)
+        course = self._load_course_from_memcache()
 
         # Verify contents.
-        lessons = course.get_lessons(unit.unit_id)
-        self.assertEquals(num_lessons, len(lessons))
-        for lesson in lessons:
-            self.assertEquals(lesson.objectives, LOREM_IPSUM)
+        self.assertEquals(
+            [lesson.objectives for lesson in lessons],
+            [lesson.objectives for lesson in course.get_lessons(unit.unit_id)])
 
         # Delete items from memcache, and verify that loading fails.  This
         # re-verifies that the loaded data was, in fact, coming from memcache.
         courses.CachedCourse13.delete(self.app_context)
+        self.assertEquals(
+            {}, models.MemcacheManager.get_multi(memcache_keys, self.NAMESPACE))
         with self.assertRaises(AttributeError):
             course = courses.Course(handler=None, app_context=self.app_context)
 
+    def test_compressible_course_is_compressed(self):
+        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
+        unit = self._add_large_unit(num_lessons)
+        compressed = courses.COURSE_CACHE_BYTES_COMPRESSED.value
+        uncompressed = courses.COURSE_CACHE_BYTES_UNCOMPRESSED.value
+
+        courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(1, self._get_manifest()['num_shards'])
+        self.assertGreater(
+            courses.COURSE_CACHE_BYTES_UNCOMPRESSED.value - uncompressed,
+            models.MEMCACHE_MAX)
+        self.assertLess(
+            courses.COURSE_CACHE_BYTES_COMPRESSED.value - compressed,
+            models.MEMCACHE_MAX)
+
+        course = self._load_course_from_memcache()
+        lessons = course.get_lessons(unit.unit_id)
+        self.assertEquals(num_lessons, len(lessons))
+        for lesson in lessons:
+            self.assertEquals(lesson.objectives, LOREM_IPSUM)
+
     def test_recovery_from_missing_initial_shard(self):
         self._test_recovery_from_missing_shard(0)
 
@@ -135,57 +181,216 @@ class CourseCachingTest(actions.TestBase):
         self._test_recovery_from_missing_shard(1)
 
     def _test_recovery_from_missing_shard(self, shard_index):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
-        unit = self._add_large_unit(num_lessons)
-        memcache_keys = courses.CachedCourse13._make_keys()
+        unit = self._add_incompressible_unit(models.MEMCACHE_MAX * 3 // 2)
 
         # Load course.  It won't be in memcache, so Course will fetch it
         # from VFS and save it in memcache.
         course = courses.Course(handler=None, app_context=self.app_context)
-
-        models.MemcacheManager.delete(memcache_keys[shard_index])
+        objectives = [
+            lesson.objectives for lesson in course.get_lessons(unit.unit_id)]
+        manifest = self._get_manifest()
+        models.MemcacheManager.delete(
+            self._get_shard_keys(manifest)[shard_index], self.NAMESPACE)
 
         # Re-load course to force load from memcache.  This should fail back
         # to VFS, and still load successfully.
-        course = courses.Course(handler=None, app_context=self.app_context)
+        course = self._load_course_from_memcache()
+        self.assertNotEquals(
+            manifest['generation'], self._get_manifest()['generation'])
 
         # Verify contents.
-        lessons = course.get_lessons(unit.unit_id)
-        self.assertEquals(num_lessons, len(lessons))
-        for lesson in lessons:
-            self.assertEquals(lesson.objectives, LOREM_IPSUM)
+        self.assertEquals(
+            objectives,
+            [lesson.objectives for lesson in course.get_lessons(unit.unit_id)])
+
+    def test_recovery_from_corrupt_shard(self):
+        unit = self._add_large_unit(num_lessons=1)
+        courses.Course(handler=None, app_context=self.app_context)
+        manifest = self._get_manifest()
+        shard_key = self._get_shard_keys(manifest)[0]
+        shard = models.MemcacheManager.get(shard_key, self.NAMESPACE)
+        models.MemcacheManager.set(
+            shard_key, shard[:-1] + chr(ord(shard[-1]) ^ 1),
+            namespace=self.NAMESPACE)
+
+        # The checksum does not match, so the course is loaded from VFS.
+        course = self._load_course_from_memcache()
+        self.assertNotEquals(
+            manifest['generation'], self._get_manifest()['generation'])
+        self.assertEquals(
+            LOREM_IPSUM, course.get_lessons(unit.unit_id)[0].objectives)
 
     def test_course_that_is_too_large_to_cache_is_not_cached(self):
-        num_lessons = courses.CachedCourse13._max_size() / len(LOREM_IPSUM)
-        # Fudge factor to get size of course as saved to under the VFS limit
-        # but over the memcache limit.
-        num_lessons -= 19
-        unit = self._add_large_unit(num_lessons)
-        memcache_keys = courses.CachedCourse13._make_keys()
+        self._add_large_unit(num_lessons=1)
+        self.swap(models, 'MEMCACHE_MULTI_MAX', models.MEMCACHE_MAX)
 
         # Load the course, which would normally populate memcache with the
         # loaded content, but will not have, because the course is too large.
         # Verify that.
-        course = courses.Course(handler=None, app_context=self.app_context)
-        memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
-        self.assertEquals(
-            {}, memcache_values,
+        courses.Course(handler=None, app_context=self.app_context)
+        self.assertIsNone(
+            self._get_manifest(),
             'Memcache for too-large course should be cleared.')
 
     def test_small_course_occupies_only_one_shard(self):
         self._add_large_unit(num_lessons=1)
-        memcache_keys = courses.CachedCourse13._make_keys()
 
         # Load course to get shard put into memcache.
-        course = courses.Course(handler=None, app_context=self.app_context)
+        courses.Course(handler=None, app_context=self.app_context)
+        manifest = self._get_manifest()
+        self.assertEquals(1, manifest['num_shards'])
         memcache_values = models.MemcacheManager.get_multi(
-            memcache_keys, self.NAMESPACE)
+            self._get_shard_keys(manifest), self.NAMESPACE)
         self.assertEquals(
-            memcache_keys[0:1],
+            self._get_shard_keys(manifest),
             memcache_values.keys(),
             'Only shard zero should be present in memcache.')
 
+    def test_course_is_cached_in_process(self):
+        unit = self._add_large_unit(num_lessons=1)
+
+        # Load course to get it into memcache and into in-process cache.
+        courses.Course(handler=None, app_context=self.app_context)
+
+        # Remove the shards, but not the manifest, from memcache; the course
+        # must now come from the in-process cache.
+        models.MemcacheManager.delete_multi(
+            self._get_shard_keys(self._get_manifest()), self.NAMESPACE)
+        hits = courses.COURSE_CACHE_HIT_LOCAL.value
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(hits + 1, courses.COURSE_CACHE_HIT_LOCAL.value)
+        self.assertEquals(1, len(course.get_lessons(unit.unit_id)))
+
+        # Changes to the course invalidate the in-process copy.
+        course.add_unit()
+        course.save()
+        misses = courses.COURSE_CACHE_MISS_LOCAL.value
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(misses + 1, courses.COURSE_CACHE_MISS_LOCAL.value)
+        self.assertEquals(2, len(course.get_units()))
+
+    def test_in_process_cached_course_is_not_shared(self):
+        unit = self._add_large_unit(num_lessons=1)
+
+        # Load course to get it into the in-process cache.
+        courses.Course(handler=None, app_context=self.app_context)
+
+        hits = courses.COURSE_CACHE_HIT_LOCAL.value
+        course = courses.Course(handler=None, app_context=self.app_context)
+        course.find_unit_by_id(unit.unit_id).title = 'Modified'
+        lesson = course.get_lessons(unit.unit_id)[0]
+        lesson.objectives = 'Modified'
+        lesson.properties['modified'] = True
+
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(hits + 2, courses.COURSE_CACHE_HIT_LOCAL.value)
+        self.assertNotEquals(
+            'Modified', course.find_unit_by_id(unit.unit_id).title)
+        other_lesson = course.get_lessons(unit.unit_id)[0]
+        self.assertEquals(LOREM_IPSUM, other_lesson.objectives)
+        self.assertNotIn('modified', other_lesson.properties)
+
+        # Both courses wrap the same cached lesson instead of copying it.
+        self.assertIs(lesson.get_element(), other_lesson.get_element())
+
+    def _add_unit_with_question(self, quid):
+        unit = self.course.add_unit()
+        lesson = self.course.add_lesson(unit)
+        lesson.objectives = QUESTION_HTML % quid
+        self.course.save()
+        return unit, lesson
+
+    def test_component_manifest_is_cached_with_course(self):
+        unit, lesson = self._add_unit_with_question('1')
+
+        # Loading the course into memcache finds the components once.
+        self._load_course_from_memcache()
+
+        def parsing_not_expected(*unused_args, **unused_kwargs):
+            self.fail('Lesson HTML should not be parsed again.')
+
+        self.swap(tags, 'get_components_from_html', parsing_not_expected)
+        course = self._load_course_from_memcache()
+        self.assertEquals(
+            [{'cpt_name': 'question', 'instanceid': 'q', 'quid': '1'}],
+            course.get_question_components(unit.unit_id, lesson.lesson_id))
+
+    def test_component_manifest_is_only_used_for_unchanged_html(self):
+        unit, lesson = self._add_unit_with_question('1')
+        course = self._load_course_from_memcache()
+        lesson = course.find_lesson_by_id(unit, lesson.lesson_id)
+
+        lesson.objectives = QUESTION_HTML % '2'
+        self.assertEquals(
+            [{'cpt_name': 'question', 'instanceid': 'q', 'quid': '2'}],
+            course.get_question_components(unit.unit_id, lesson.lesson_id))
+
+        # Lessons cached before they had manifests are parsed every time.
+        del lesson._components
+        lesson.objectives = QUESTION_HTML % '3'
+        self.assertEquals(
+            [{'cpt_name': 'question', 'instanceid': 'q', 'quid': '3'}],
+            course.get_question_components(unit.unit_id, lesson.lesson_id))
+
+
+class CourseEnvironTest(actions.TestBase):
+
+    COURSE_NAME = 'environ_course'
+    ADMIN_EMAIL = 'admin@foo.com'
+
+    def setUp(self):
+        super(CourseEnvironTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Environ Course')
+
+    def test_environ_is_copy_on_write_view(self):
+        self.app_context.get_environ()
+        views = courses.COURSE_ENVIRON_VIEWS.value
+        env = self.app_context.get_environ()
+        self.assertIsInstance(env, common_utils.CopyOnWriteDict)
+        self.assertEquals(views + 1, courses.COURSE_ENVIRON_VIEWS.value)
+
+        env['course']['title'] = 'Changed'
+        self.assertEquals(
+            'Environ Course', self.app_context.get_environ()['course']['title'])
+
+        # Views can be saved back as course settings.
+        course = courses.Course(None, app_context=self.app_context)
+        self.assertTrue(course.save_settings(env))
+        self.assertEquals(
+            'Changed', self.app_context.get_environ()['course']['title'])
+
+    def test_post_copy_hooks_run_once_per_request_and_key(self):
+        key = ['A']
+        envs_in_hooks = []
+
+        def hook(app_context, env):
+            self.assertIs(env, app_context.get_environ())
+            env['course']['title'] = 'Hooked %s' % key[0]
+            envs_in_hooks.append(env)
+
+        self.swap(courses.Course, 'COURSE_ENV_POST_COPY_HOOKS', [hook])
+        self.swap(courses.Course, 'COURSE_ENV_POST_COPY_KEY_PROVIDERS', [
+            lambda unused_app_context: key[0]])
+
+        for _ in xrange(2):
+            self.assertEquals(
+                'Hooked A', self.app_context.get_environ()['course']['title'])
+        self.assertEquals(1, len(envs_in_hooks))
+
+        key[0] = 'B'
+        self.assertEquals(
+            'Hooked B', self.app_context.get_environ()['course']['title'])
+        key[0] = 'A'
+        self.assertEquals(
+            'Hooked A', self.app_context.get_environ()['course']['title'])
+        self.assertEquals(2, len(envs_in_hooks))
+
+        self.app_context.clear_per_request_cache()
+        self.assertEquals(
+            'Hooked A', self.app_context.get_environ()['course']['title'])
+        self.assertEquals(3, len(envs_in_hooks))
+
 
 class PermissionsTest(actions.TestBase):
 
@@ -26,6 +26,7 @@ import appengine_config
 from common import users
 from common import utils as common_utils
 from models import config
+from models import counters
 from models import entities
 from models import models
 from models import services
@@ -337,6 +338,12 @@ class PersonalProfileTestCase(actions.ExportTestBase):
             self.transform(user_id), exported.safe_key.name())
 
 
+class _CachedValue(object):
+
+    def __init__(self, items):
+        self.items = items
+
+
 class MemcacheManagerTestCase(actions.TestBase):
 
     def setUp(self):
@@ -379,6 +386,86 @@ class MemcacheManagerTestCase(actions.TestBase):
         data = models.MemcacheManager.get_multi(['a', 'b', 'c'])
         self.assertEquals(0, len(data.keys()))
 
+    def test_readonly_values_are_copied_unless_immutable(self):
+        value = _CachedValue([1, 2])
+        models.MemcacheManager.begin_readonly()
+        try:
+            models.MemcacheManager.set('a', value)
+            cached = models.MemcacheManager.get('a')
+            self.assertIsNot(value, cached)
+            self.assertEquals([1, 2], cached.items)
+            self.assertIsNot(cached, models.MemcacheManager.get('a'))
+
+            models.MemcacheManager.register_immutable_type(_CachedValue)
+            models.MemcacheManager.set('b', value)
+            self.assertIs(value, models.MemcacheManager.get('b'))
+        finally:
+            models.MemcacheManager.end_readonly()
+            models.MemcacheManager.unregister_immutable_type(_CachedValue)
+
+    def test_modified_immutable_value_is_detected(self):
+        self.swap(models.MemcacheManager, 'CHECK_IMMUTABLE_VALUES', True)
+        models.MemcacheManager.register_immutable_type(_CachedValue)
+        mutated = models.CACHE_MUTATED_LOCAL.value
+        models.MemcacheManager.begin_readonly()
+        try:
+            models.MemcacheManager.set('a', _CachedValue([1, 2]))
+            models.MemcacheManager.get('a').items.append(3)
+            self.assertEquals(
+                [1, 2, 3], models.MemcacheManager.get('a').items)
+            self.assertEquals(
+                mutated + 1, models.CACHE_MUTATED_LOCAL.value)
+        finally:
+            models.MemcacheManager.end_readonly()
+            models.MemcacheManager.unregister_immutable_type(_CachedValue)
+        self.assertEquals(mutated + 2, models.CACHE_MUTATED_LOCAL.value)
+
+
+class CounterDeltaBufferTestCase(actions.TestBase):
+
+    def setUp(self):
+        super(CounterDeltaBufferTestCase, self).setUp()
+        config.Registry.test_overrides = {
+            models.CAN_USE_MEMCACHE.name: True,
+            models.CAN_AGGREGATE_COUNTERS.name: True}
+        models.CounterDeltaBuffer.clear()
+        counters.Registry._clear_all()
+        self.counter = counters.PerfCounter(
+            'gcb-test-buffered-counter', 'A counter for tests.')
+
+    def tearDown(self):
+        models.CounterDeltaBuffer.clear()
+        del counters.Registry.registered[self.counter.name]
+        config.Registry.test_overrides = {}
+        super(CounterDeltaBufferTestCase, self).tearDown()
+
+    def test_inc_is_buffered_until_flush(self):
+        self.counter.inc()
+        self.counter.inc(increment=2)
+        self.assertEquals(3, self.counter.value)
+        self.assertIsNone(self.counter.global_value)
+        self.assertIsNone(
+            counters.Registry.get_last_flushed_on(self.counter.name))
+
+        counters.flush_counter_global_values()
+        self.assertEquals(3, self.counter.global_value)
+        self.assertIsNotNone(
+            counters.Registry.get_last_flushed_on(self.counter.name))
+
+        counters.flush_counter_global_values()
+        self.assertEquals(3, self.counter.global_value)
+
+    def test_inc_not_buffered_when_aggregation_disabled(self):
+        del config.Registry.test_overrides[models.CAN_AGGREGATE_COUNTERS.name]
+        self.counter.inc()
+        counters.flush_counter_global_values()
+        self.assertIsNone(
+            counters.Registry.get_last_flushed_on(self.counter.name))
+
+    def test_request_flushes_buffer(self):
+        self.testapp.get('/')
+        self.assertTrue(counters.Registry.last_flushed_on)
+
 
 class TestEntity(entities.BaseEntity):
     data = db.TextProperty(indexed=False)
@@ -18,6 +18,7 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+import datetime
 import os
 import random
 import StringIO
@@ -199,3 +200,240 @@ class VfsLargeFileSupportTest(actions.TestBase):
         # from AppEngine about cross-group transaction having too many
         # entities involved.
         self.course.save()
+
+
+class VfsCacheTombstoneTest(actions.TestBase):
+
+    NAMESPACE = 'ns_foo'
+
+    def setUp(self):
+        super(VfsCacheTombstoneTest, self).setUp()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.fs.put('/foo', StringIO.StringIO('file contents'))
+
+        # Read the file once to get it into the cache.
+        self.assertEquals('file contents', self.fs.get('/foo').read())
+
+    def test_delete_leaves_tombstone(self):
+        self.fs.delete('/foo')
+        with common_utils.Namespace(self.NAMESPACE):
+            tombstone = vfs.FileTombstoneEntity.get_by_key_name('/foo')
+        self.assertIsNotNone(tombstone.updated_on)
+        self.assertIsNone(self.fs.get('/foo'))
+
+    def test_file_deleted_by_other_instance_is_evicted(self):
+        # Delete the file the way another instance would, without touching
+        # the cache of this one.
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity.get_by_key_name('/foo').delete()
+            vfs.FileTombstoneEntity(
+                key_name='/foo',
+                updated_on=datetime.datetime.utcnow()).put()
+        self.assertEquals('file contents', self.fs.get('/foo').read())
+
+        # The next connection to the cache sees the tombstone.
+        self.swap(vfs.VfsCacheConnection, 'RESYNC_INTERVAL_SEC', 0)
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.assertIsNone(fs.get('/foo'))
+
+    def test_tombstone_is_applied_once(self):
+        self.fs.put('/bar', StringIO.StringIO('other contents'))
+        self.assertEquals('other contents', self.fs.get('/bar').read())
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity.get_by_key_name('/foo').delete()
+            vfs.FileTombstoneEntity(
+                key_name='/foo',
+                updated_on=datetime.datetime.utcnow()).put()
+
+        self.swap(vfs.VfsCacheConnection, 'RESYNC_INTERVAL_SEC', 0)
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.assertIsNone(fs.get('/foo'))
+
+        # The tombstone is newer than the only file left in the cache, but
+        # is not fetched again.
+        updates = vfs.VfsCacheConnection.CACHE_UPDATE_COUNT.value
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.assertEquals('other contents', fs.get('/bar').read())
+        self.assertEquals(
+            updates, vfs.VfsCacheConnection.CACHE_UPDATE_COUNT.value)
+
+    def test_tombstones_are_removed(self):
+        self.fs.delete('/foo')
+        self.fs.put('/foo', StringIO.StringIO('new contents'))
+        with common_utils.Namespace(self.NAMESPACE):
+            self.assertIsNone(vfs.FileTombstoneEntity.get_by_key_name('/foo'))
+
+            # Tombstones older than any cache entry go on the next delete.
+            vfs.FileTombstoneEntity(
+                key_name='/expired',
+                updated_on=datetime.datetime.utcnow() - datetime.timedelta(
+                    seconds=vfs.CacheFileEntry.CACHE_ENTRY_TTL_SEC + 1)).put()
+        self.fs.delete('/foo')
+        with common_utils.Namespace(self.NAMESPACE):
+            self.assertIsNone(
+                vfs.FileTombstoneEntity.get_by_key_name('/expired'))
+            self.assertIsNotNone(
+                vfs.FileTombstoneEntity.get_by_key_name('/foo'))
+
+
+class VfsListingTest(actions.TestBase):
+
+    NAMESPACE = 'ns_foo'
+
+    def setUp(self):
+        super(VfsListingTest, self).setUp()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+
+    def _put_metadata(self, filenames):
+        # Write files the way another instance would, without touching the
+        # cache of this one.
+        now = datetime.datetime.utcnow()
+        with common_utils.Namespace(self.NAMESPACE):
+            entities = [
+                vfs.FileMetadataEntity(
+                    key_name=filename, updated_on=now, size=0, is_draft=False)
+                for filename in filenames]
+            for offset in xrange(0, len(entities), 500):
+                vfs.db.put(entities[offset:offset + 500])
+
+    def _fail(self, *unused_args, **unused_kwargs):
+        self.fail('Expected to be served from the cache.')
+
+    def test_list_has_no_limit_on_number_of_files(self):
+        filenames = ['/assets/img/%04d.png' % i for i in xrange(1200)]
+        self._put_metadata(filenames + ['/assets/css/main.css', '/assets/imgs'])
+        self.assertEquals(filenames, self.fs.list('/assets/img/'))
+        self.assertEquals(
+            filenames + ['/assets/imgs'], self.fs.list('/assets/img'))
+
+    def test_listing_is_cached_until_files_are_changed(self):
+        queried_prefixes = []
+        make_prefix_query = vfs.DatastoreBackedFileSystem._make_prefix_query
+
+        def make_prefix_query_and_count(unused_self, prefix):
+            queried_prefixes.append(prefix)
+            return make_prefix_query(prefix)
+
+        self.swap(
+            vfs.DatastoreBackedFileSystem, '_make_prefix_query',
+            make_prefix_query_and_count)
+
+        self.fs.put('/assets/img/a.png', StringIO.StringIO('a'))
+        self.assertEquals(['/assets/img/a.png'], self.fs.list('/assets/img'))
+        self.assertEquals(['/assets/img/a.png'], self.fs.list('/assets/img'))
+        self.assertEquals(['/assets/img'], queried_prefixes)
+
+        # Files outside of the directory leave its listing alone.
+        self.fs.put('/assets/css/a.css', StringIO.StringIO('a'))
+        self.assertEquals(['/assets/img/a.png'], self.fs.list('/assets/img'))
+        self.assertEquals(1, len(queried_prefixes))
+
+        self.fs.put('/assets/img/b.png', StringIO.StringIO('b'))
+        self.assertEquals(
+            ['/assets/img/a.png', '/assets/img/b.png'],
+            self.fs.list('/assets/img'))
+        self.fs.delete('/assets/img/a.png')
+        self.assertEquals(['/assets/img/b.png'], self.fs.list('/assets/img'))
+        self.assertEquals(3, len(queried_prefixes))
+
+    def test_file_added_by_other_instance_invalidates_listing(self):
+        self.fs.put('/assets/img/a.png', StringIO.StringIO('a'))
+        self.assertEquals(['/assets/img/a.png'], self.fs.list('/assets/img'))
+        self._put_metadata(['/assets/img/b.png'])
+
+        # The next connection to the cache sees the new file.
+        self.swap(vfs.VfsCacheConnection, 'RESYNC_INTERVAL_SEC', 0)
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.assertEquals(
+            ['/assets/img/a.png', '/assets/img/b.png'],
+            fs.list('/assets/img'))
+
+    def test_isfile_uses_cache(self):
+        self.fs.put('/foo', StringIO.StringIO('file contents'))
+        self.fs.get('/foo')
+        self.assertFalse(self.fs.isfile('/bar'))
+
+        self.swap(vfs.FileMetadataEntity, 'get_by_key_name', self._fail)
+        self.assertTrue(self.fs.isfile('/foo'))
+        self.assertFalse(self.fs.isfile('/bar'))
+
+    def test_isfile_caches_metadata_of_files_not_opened(self):
+        self._put_metadata(['/foo'])
+        self.assertTrue(self.fs.isfile('/foo'))
+
+        get_by_key_name = vfs.FileMetadataEntity.get_by_key_name
+        self.swap(vfs.FileMetadataEntity, 'get_by_key_name', self._fail)
+        self.assertTrue(self.fs.isfile('/foo'))
+
+        # Changes to the file drop the cached metadata.
+        self.swap(
+            vfs.FileMetadataEntity, 'get_by_key_name', get_by_key_name)
+        self.fs.put('/foo', StringIO.StringIO('foo'))
+        self.assertEquals('foo', self.fs.open('/foo').read())
+        self.fs.delete('/foo')
+        self.assertFalse(self.fs.isfile('/foo'))
+
+    def test_list_files_without_updated_on(self):
+        self._put_metadata(['/assets/img/a.png'])
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity(
+                key_name='/assets/img/b.png', size=0, is_draft=False).put()
+        self.assertEquals(
+            ['/assets/img/a.png', '/assets/img/b.png'],
+            self.fs.list('/assets/img'))
+
+
+class VfsStreamingTest(actions.TestBase):
+
+    NAMESPACE = 'ns_foo'
+    CONTENT = ''.join(chr(ord('a') + i % 26) for i in xrange(35))
+
+    def setUp(self):
+        super(VfsStreamingTest, self).setUp()
+        self.swap(vfs, '_MAX_VFS_SHARD_SIZE', 10)
+        self.swap(vfs, '_MAX_VFS_NUM_SHARDS', 10)
+        self.swap(vfs, 'MAX_CACHED_FILE_SIZE_BYTES', 20)
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+
+    def _fail(self, *unused_args, **unused_kwargs):
+        self.fail('Expected to be served from the cache.')
+
+    def test_large_file_is_read_by_shard_with_metadata_cached(self):
+        self.fs.put('/big', StringIO.StringIO(self.CONTENT))
+        stream = self.fs.open('/big')
+        self.assertIsInstance(stream, vfs.FileStreamSharded)
+        self.assertEquals(35, stream.metadata.size)
+        self.assertEquals(self.CONTENT, stream.read())
+        self.assertEquals('', stream.read())
+
+        # Only the metadata is cached; the content is read again.
+        found, cached = self.fs.cache.get('/big')
+        self.assertTrue(found)
+        self.assertFalse(cached.has_data)
+        self.swap(vfs.FileMetadataEntity, 'get_by_key_name', self._fail)
+        self.assertTrue(self.fs.isfile('/big'))
+        stream = self.fs.open('/big')
+        self.assertIsInstance(stream, vfs.FileStreamSharded)
+        self.assertEquals(self.CONTENT[:4], stream.read(4))
+        self.assertEquals(self.CONTENT[4:17], stream.read(13))
+        stream.seek(-7, os.SEEK_END)
+        self.assertEquals(28, stream.tell())
+        self.assertEquals(self.CONTENT[28:], stream.read(100))
+        stream.seek(-20, os.SEEK_CUR)
+        self.assertEquals(self.CONTENT[15:25], stream.read(10))
+        stream.seek(50)
+        self.assertEquals('', stream.read())
+        with self.assertRaises(IOError):
+            stream.seek(-1)
+
+    def test_small_file_is_cached_and_seekable(self):
+        self.fs.put('/small', StringIO.StringIO(self.CONTENT[:15]))
+        stream = self.fs.open('/small')
+        self.assertIsInstance(stream, vfs.FileStreamWrapped)
+        stream.seek(0, os.SEEK_END)
+        self.assertEquals(15, stream.tell())
+        stream.seek(5)
+        self.assertEquals(self.CONTENT[5:10], stream.read(5))
+        self.assertEquals(self.CONTENT[10:15], stream.read())
+        found, unused_stream = self.fs.cache.get('/small')
+        self.assertTrue(found)
@@ -234,3 +234,29 @@ class ProgressPercent(actions.TestBase):
         with Namespace(NAMESPACE):
             self.assertEquals(1.000, self.tracker.get_unit_percent_complete(
                 self.student)[self.unit.unit_id])
+
+    def test_progress_multi_matches_single_student(self):
+        response = self._get_unit_page(self.unit)
+        self._click_next_button(response)
+
+        actions.login('bar@foo.com')
+        actions.register(self, 'bar@foo.com', COURSE_NAME)
+        with Namespace(NAMESPACE):
+            other = models.Student.get_by_user(users.get_current_user())
+            other_key_name = models.StudentPropertyEntity.create_key(
+                other.user_id, self.tracker.PROPERTY_KEY)
+            models.StudentPropertyEntity(key_name=other_key_name).delete()
+
+            percent_multi = self.tracker.get_unit_percent_complete_multi(
+                [self.student, other])
+            self.assertEquals(
+                self.tracker.get_unit_percent_complete(self.student),
+                percent_multi[self.student.user_id])
+            self.assertEquals(
+                0.667, percent_multi[self.student.user_id][self.unit.unit_id])
+            self.assertEquals(
+                0.0, percent_multi[other.user_id][self.unit.unit_id])
+
+            # Students without progress have no entity created for them.
+            self.assertIsNone(
+                models.StudentPropertyEntity.get_by_key_name(other_key_name))
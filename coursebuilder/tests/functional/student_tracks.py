@@ -22,6 +22,8 @@ from models import courses
 from models import models
 from tests.functional import actions
 
+from google.appengine.api import users
+
 COURSE_NAME = 'tracks_test'
 COURSE_TITLE = 'Tracks Test'
 NAMESPACE = 'ns_%s' % COURSE_NAME
@@ -229,3 +231,38 @@ class StudentTracksTest(actions.TestBase):
         self.assertEquals(200, self.get('unit?unit=%d' %
                                         self._unit_labels_foo_quux.unit_id,
                                         response).status_int)
+
+    def test_track_views_are_shared_and_leave_course_unchanged(self):
+        actions.login(REGISTERED_STUDENT_EMAIL)
+        self._choose_tracks([self.bar_id])
+
+        def make_unavailable(unused_course, units, unused_lessons):
+            for unit in units:
+                unit.availability = courses.AVAILABILITY_UNAVAILABLE
+        self.swap(courses.Course, 'COURSE_ELEMENT_STUDENT_VIEW_HOOKS',
+                  [make_unavailable])
+
+        course = courses.Course(None, app_context=sites.get_all_courses()[0])
+        with common_utils.Namespace(NAMESPACE):
+            student = models.Student.get_by_user(users.get_current_user())
+            units, lessons = course.get_track_matching_student(student)
+            self.assertEquals(
+                [self._unit_no_labels.title, self._unit_labels_foo_bar.title,
+                 self._unit_labels_quux.title],
+                [unit.title for unit in units])
+            self.assertEquals(
+                [courses.AVAILABILITY_UNAVAILABLE] * 3,
+                [unit.availability for unit in units])
+            self.assertFalse(course.is_unit_available(units[0]))
+            self.assertEquals(
+                courses.AVAILABILITY_AVAILABLE,
+                course.find_unit_by_id(units[0].unit_id).availability)
+
+            # Students with the same track labels share one view.
+            self.assertIs(
+                units, course.get_track_matching_student(student)[0])
+            self.assertIs(
+                lessons, course.get_track_matching_student(student)[1])
+            all_units, unused_lessons = course.get_track_matching_student(
+                models.TransientStudent())
+            self.assertEquals(5, len(all_units))
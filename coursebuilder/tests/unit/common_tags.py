@@ -151,3 +151,90 @@ class CustomTagTests(unittest.TestCase):
                 '<Count>2</Count></div><div>foot</div>'
             ),
             str(safe_dom))
+
+
+class RenderCacheTests(unittest.TestCase):
+    """Unit tests for caching of rendered content."""
+
+    def setUp(self):
+
+        class StaticTag(tags.BaseTag):
+
+            @classmethod
+            def is_student_dependent(cls):
+                return False
+
+            def render(self, unused_node, handler):
+                handler.static_renders += 1
+                return cElementTree.Element('Static')
+
+        class StudentTag(tags.BaseTag):
+
+            def render(self, unused_node, handler):
+                elt = cElementTree.Element('Student')
+                elt.text = handler.student_name
+                return elt
+
+        def new_get_tag_bindings():
+            return {'static': StaticTag, 'student': StudentTag}
+
+        self.old_get_tag_bindings = tags.get_tag_bindings
+        tags.get_tag_bindings = new_get_tag_bindings
+        tags.ProcessScopedRenderCache.clear_instance()
+
+    def tearDown(self):
+        tags.ProcessScopedRenderCache.clear_instance()
+        tags.get_tag_bindings = self.old_get_tag_bindings
+
+    def _make_handler(self, student_name, locale='en_US'):
+
+        class MockAppContext(object):
+
+            def get_namespace_name(self):
+                return 'ns_test'
+
+            def get_current_locale(self):
+                return locale
+
+        class MockHandler(object):
+
+            def __init__(self):
+                self.app_context = MockAppContext()
+                self.student_name = student_name
+                self.static_renders = 0
+
+        return MockHandler()
+
+    def test_static_parts_are_rendered_once(self):
+        html = '<div><static></static><student></student>tail</div>'
+        alice = self._make_handler('Alice')
+        bob = self._make_handler('Bob')
+
+        self.assertEquals(
+            '<div><Static></Static><Student>Alice</Student>tail</div>',
+            str(tags.html_to_safe_dom(html, alice)))
+        self.assertEquals(
+            '<div><Static></Static><Student>Bob</Student>tail</div>',
+            str(tags.html_to_safe_dom(html, bob)))
+        self.assertEquals(1, alice.static_renders)
+        self.assertEquals(0, bob.static_renders)
+
+        cache = tags.ProcessScopedRenderCache.instance().cache
+        self.assertEquals(1, cache.hit_count)
+        self.assertEquals(1, cache.miss_count)
+
+    def test_locale_and_registry_version_are_part_of_key(self):
+        html = '<static></static>'
+        tags.html_to_safe_dom(html, self._make_handler('Alice'))
+        handler = self._make_handler('Alice', locale='ru_RU')
+        tags.html_to_safe_dom(html, handler)
+        self.assertEquals(1, handler.static_renders)
+
+        tags.Registry.remove_tag_binding('no-such-tag')
+        handler = self._make_handler('Alice')
+        tags.html_to_safe_dom(html, handler)
+        self.assertEquals(0, handler.static_renders)
+
+        tags.Registry._version += 1  # pylint: disable=protected-access
+        tags.html_to_safe_dom(html, handler)
+        self.assertEquals(1, handler.static_renders)
@@ -16,8 +16,10 @@
 
 __author__ = 'Mike Gainer (mgainer@google.com)'
 
+import copy
 import datetime
 import os
+import pickle
 import unittest
 
 import appengine_config
@@ -349,3 +351,53 @@ class ValidateYoutubeVideoRecognizer(unittest.TestCase):
 
         self.assertIsNone(utils.find_youtube_video_id(''))
         self.assertIsNone(utils.find_youtube_video_id(VIDEO_ID[1:]))
+
+
+class CopyOnWriteDictTests(unittest.TestCase):
+
+    def setUp(self):
+        super(CopyOnWriteDictTests, self).setUp()
+        self.original = {
+            'course': {'title': 'Title', 'admins': ['a@example.com']},
+            'locales': [{'locale': 'en'}],
+            'number': 1,
+            'date': datetime.date(2016, 1, 1)}
+        self.expected = copy.deepcopy(self.original)
+
+    def test_changes_do_not_reach_original(self):
+        view = utils.CopyOnWriteDict(self.original)
+        view['course']['title'] = 'Changed'
+        view.get('course')['admins'].append('b@example.com')
+        view.setdefault('locales', [])[0]['locale'] = 'fr'
+        view['number'] = 2
+        del view['date']
+        self.assertEquals(self.expected, self.original)
+        self.assertEquals({
+            'course': {
+                'title': 'Changed',
+                'admins': ['a@example.com', 'b@example.com']},
+            'locales': [{'locale': 'fr'}],
+            'number': 2}, view)
+
+        other_view = utils.CopyOnWriteDict(view)
+        other_view['course']['title'] = 'Changed again'
+        for value in other_view.itervalues():
+            if isinstance(value, list):
+                value.append(None)
+        self.assertEquals('Changed', view['course']['title'])
+        self.assertEquals([{'locale': 'fr'}], view['locales'])
+        self.assertEquals(self.expected, self.original)
+
+    def test_values_are_shared_until_read(self):
+        view = utils.CopyOnWriteDict(self.original)
+        self.assertIs(self.original['course'], dict.get(view, 'course'))
+        self.assertIsNot(self.original['course'], view['course'])
+        self.assertIs(view['course'], view['course'])
+        self.assertIs(self.original['locales'], dict.get(view, 'locales'))
+
+        self.assertEquals(self.expected, copy.deepcopy(view))
+        self.assertIs(dict, type(copy.deepcopy(view)))
+        self.assertEquals(self.expected, pickle.loads(pickle.dumps(view)))
+        self.assertIs(dict, type(pickle.loads(pickle.dumps(view))))
+        self.assertEquals(self.expected, dict(view.items()))
+        self.assertIsNot(self.original['locales'], dict.get(view, 'locales'))
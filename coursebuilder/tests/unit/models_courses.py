@@ -13,16 +13,30 @@
 # limitations under the License.
 
 
-"""Unit tests for the Workflow class in models.courses."""
+"""Unit tests for models.courses."""
 
 __author__ = 'Sean Lip (sll@google.com)'
 
+import copy
+import datetime
+import logging
+import pickle
+import time
 import unittest
 
 import yaml
 
+from models.courses import AVAILABILITY_AVAILABLE
+from models.courses import AVAILABILITY_COURSE
+from models.courses import AVAILABILITY_UNAVAILABLE
+from models.courses import CourseElementStudentView
+from models.courses import CourseModel13
+from models.courses import HUMAN_GRADER
 from models.courses import LEGACY_HUMAN_GRADER_WORKFLOW
+from models.courses import Lesson13
+from models.courses import Unit13
 from models.courses import Workflow
+from tools import verify
 
 DATE_FORMAT_ERROR = (
     'dates should be formatted as YYYY-MM-DD hh:mm (e.g. 1997-07-16 19:20) and '
@@ -234,3 +248,237 @@ class WorkflowValidationTests(unittest.TestCase):
         workflow = Workflow(self.to_yaml(workflow_dict))
         workflow.validate(self.errors)
         self.assertFalse(self.errors)
+
+
+class WorkflowParsingTests(unittest.TestCase):
+    """Unit tests for parsing Workflow objects."""
+
+    def setUp(self):
+        super(WorkflowParsingTests, self).setUp()
+        self.num_parsed = 0
+        self.old_safe_load = yaml.safe_load
+
+        def safe_load(*args, **kwargs):
+            self.num_parsed += 1
+            return self.old_safe_load(*args, **kwargs)
+        yaml.safe_load = safe_load
+
+    def tearDown(self):
+        yaml.safe_load = self.old_safe_load
+        super(WorkflowParsingTests, self).tearDown()
+
+    def test_workflow_is_parsed_once(self):
+        workflow = Workflow(LEGACY_HUMAN_GRADER_WORKFLOW)
+        self.assertEquals(HUMAN_GRADER, workflow.get_grader())
+        self.assertEquals('peer', workflow.get_matcher())
+        self.assertEquals(
+            datetime.datetime(2099, 3, 14, 12, 0),
+            workflow.get_submission_due_date())
+        self.assertEquals(
+            datetime.datetime(2099, 3, 21, 12, 0),
+            workflow.get_review_due_date())
+        self.assertEquals(2, workflow.get_review_min_count())
+        self.assertFalse(workflow.is_single_submission())
+
+        # Changes to the dict returned do not affect the workflow.
+        workflow.to_dict()['grader'] = 'auto'
+        self.assertEquals(HUMAN_GRADER, workflow.get_grader())
+        self.assertEquals(1, self.num_parsed)
+
+    def test_invalid_due_date_fails_when_used(self):
+        workflow = Workflow(
+            'grader: human\nsubmission_due_date: not a date\n')
+        self.assertEquals(HUMAN_GRADER, workflow.get_grader())
+        self.assertIsNone(workflow.get_review_due_date())
+        with self.assertRaises(ValueError):
+            workflow.get_submission_due_date()
+
+    def test_unit_keeps_workflow_until_yaml_changes(self):
+        unit = Unit13()
+        unit.type = verify.UNIT_TYPE_ASSESSMENT
+        workflow = unit.workflow
+        self.assertIs(workflow, unit.workflow)
+        self.assertEquals('auto', workflow.get_grader())
+
+        unit.workflow_yaml = LEGACY_HUMAN_GRADER_WORKFLOW
+        self.assertIsNot(workflow, unit.workflow)
+        self.assertEquals(HUMAN_GRADER, unit.workflow.get_grader())
+        self.assertEquals(2, self.num_parsed)
+
+        # The parsed workflow is cached along with the unit.
+        copied = pickle.loads(pickle.dumps(unit))
+        self.assertEquals(
+            datetime.datetime(2099, 3, 21, 12, 0),
+            copied.workflow.get_review_due_date())
+        self.assertEquals(2, self.num_parsed)
+
+
+def _make_course_model(num_units, num_lessons_per_unit):
+    """Makes a course model directly, as loading it from storage does."""
+    units = []
+    lessons = []
+    next_id = 1
+    for _ in xrange(num_units):
+        unit = Unit13()
+        unit.unit_id = next_id
+        unit.type = verify.UNIT_TYPE_UNIT
+        units.append(unit)
+        next_id += 1
+        for _ in xrange(num_lessons_per_unit):
+            lesson = Lesson13()
+            lesson.lesson_id = next_id
+            lesson.unit_id = unit.unit_id
+            lessons.append(lesson)
+            next_id += 1
+    return CourseModel13(
+        None, next_id=next_id, units=units, lessons=lessons)
+
+
+class CourseModel13IndexTests(unittest.TestCase):
+    """Unit tests for the id indexes of CourseModel13."""
+
+    def test_find_by_id_tracks_changes(self):
+        model = CourseModel13(None)
+        unit = model.add_unit(verify.UNIT_TYPE_UNIT, 'Unit')
+        other_unit = model.add_unit(verify.UNIT_TYPE_UNIT, 'Other Unit')
+        lesson = model.add_lesson(unit, 'Lesson')
+        self.assertIs(unit, model.find_unit_by_id(unit.unit_id))
+        self.assertIs(unit, model.find_unit_by_id(str(unit.unit_id)))
+        self.assertIs(lesson, model.find_lesson_by_id(None, lesson.lesson_id))
+        self.assertIs(
+            lesson, model.find_lesson_by_id(None, unicode(lesson.lesson_id)))
+
+        model.move_lesson_to(lesson, other_unit)
+        self.assertEquals([], model.get_lessons(unit.unit_id))
+        self.assertEquals([lesson], model.get_lessons(other_unit.unit_id))
+
+        model.delete_unit(other_unit)
+        self.assertIsNone(model.find_unit_by_id(other_unit.unit_id))
+        self.assertIsNone(model.find_lesson_by_id(None, lesson.lesson_id))
+        self.assertIs(unit, model.find_unit_by_id(unit.unit_id))
+
+    def test_ids_are_indexed_when_built_from_memento(self):
+        model = _make_course_model(2, 2)
+        copied = CourseModel13(
+            None, next_id=model.next_id, units=model.units,
+            lessons=model.lessons,
+            unit_id_to_lesson_ids=model.unit_id_to_lesson_ids)
+        self.assertIs(model.units[1], copied.find_unit_by_id('4'))
+        self.assertEquals(
+            model.lessons[2:], copied.get_lessons(model.units[1].unit_id))
+
+    def test_lookup_benchmark(self):
+        model = _make_course_model(500, 10)
+        lesson_ids = [lesson.lesson_id for lesson in model.lessons]
+
+        def find_lesson_by_scan(lesson_id):
+            for lesson in model.lessons:
+                if str(lesson.lesson_id) == str(lesson_id):
+                    return lesson
+            return None
+
+        # Scanning is too slow to look up every lesson; sample some.
+        sample = lesson_ids[::50]
+        start = time.time()
+        scanned = [find_lesson_by_scan(lesson_id) for lesson_id in sample]
+        scan_secs = (time.time() - start) / len(sample)
+
+        start = time.time()
+        found = [
+            model.find_lesson_by_id(None, lesson_id)
+            for lesson_id in lesson_ids]
+        for unit in model.units:
+            model.get_lessons(unit.unit_id)
+        lookup_secs = (time.time() - start) / len(lesson_ids)
+
+        logging.info(
+            'Lesson lookup among %d lessons: %.1f us by scanning, '
+            '%.1f us by id.', len(lesson_ids), scan_secs * 1e6,
+            lookup_secs * 1e6)
+        self.assertEquals(model.lessons, found)
+        self.assertEquals(scanned, found[::50])
+
+
+class CourseElementStudentViewTests(unittest.TestCase):
+    """Unit tests for CourseElementStudentView."""
+
+    def setUp(self):
+        super(CourseElementStudentViewTests, self).setUp()
+        self.unit = Unit13()
+        self.unit.unit_id = 1
+        self.unit.type = verify.UNIT_TYPE_UNIT
+        self.unit.title = 'Unit'
+        self.unit.availability = AVAILABILITY_AVAILABLE
+
+    def test_overrides_are_recorded_on_view_only(self):
+        view = CourseElementStudentView(self.unit)
+        other_view = CourseElementStudentView(self.unit)
+        view.availability = AVAILABILITY_UNAVAILABLE
+        view.type = verify.UNIT_TYPE_ASSESSMENT
+
+        self.assertEquals(AVAILABILITY_UNAVAILABLE, view.availability)
+        self.assertEquals('Unit', view.title)
+        self.assertTrue(view.is_assessment())
+        self.assertTrue(isinstance(view, Unit13))
+        self.assertEquals(AVAILABILITY_AVAILABLE, self.unit.availability)
+        self.assertFalse(self.unit.is_assessment())
+        self.assertEquals(AVAILABILITY_AVAILABLE, other_view.availability)
+
+        # Changes to the shared element show through unless overridden.
+        self.unit.title = 'Renamed'
+        self.unit.availability = AVAILABILITY_COURSE
+        self.assertEquals('Renamed', view.title)
+        self.assertEquals(AVAILABILITY_UNAVAILABLE, view.availability)
+        self.assertEquals(AVAILABILITY_COURSE, other_view.availability)
+
+    def test_properties_run_against_view(self):
+        lesson = Lesson13()
+        lesson.has_activity = False
+        lesson.availability = AVAILABILITY_AVAILABLE
+        view = CourseElementStudentView(lesson)
+        view.now_available = True
+        view.has_activity = True
+
+        self.assertEquals(AVAILABILITY_UNAVAILABLE, view.availability)
+        self.assertTrue(view.activity)
+        self.assertEquals(AVAILABILITY_AVAILABLE, lesson.availability)
+        self.assertFalse(lesson.activity)
+        self.assertEquals(
+            {'availability': AVAILABILITY_UNAVAILABLE, 'has_activity': True},
+            view.get_overrides())
+
+    def test_copies_and_views_of_views(self):
+        view = CourseElementStudentView(self.unit)
+        view.availability = AVAILABILITY_UNAVAILABLE
+
+        nested_view = CourseElementStudentView(view)
+        self.assertIs(self.unit, nested_view.get_element())
+        self.assertEquals(AVAILABILITY_UNAVAILABLE, nested_view.availability)
+        nested_view.title = 'Nested'
+        self.assertEquals('Unit', view.title)
+
+        copied = copy.deepcopy(view)
+        self.assertIs(Unit13, type(copied))
+        self.assertEquals(AVAILABILITY_UNAVAILABLE, copied.availability)
+        self.assertEquals('Unit', copied.title)
+        self.assertEquals(AVAILABILITY_AVAILABLE, self.unit.availability)
+
+    def test_mutable_values_are_copied_when_read(self):
+        self.unit.properties = {'skills': [1]}
+        view = CourseElementStudentView(self.unit)
+        view.properties['skills'].append(2)
+        view.title = 'Renamed'
+
+        self.assertEquals({'skills': [1]}, self.unit.properties)
+        self.assertEquals({'skills': [1, 2]}, view.properties)
+        self.assertEquals('Renamed', vars(view)['title'])
+        self.assertEquals({'skills': [1, 2]}, vars(view)['properties'])
+
+        copied = copy.copy(CourseElementStudentView(self.unit))
+        copied.properties['skills'].append(3)
+        self.assertEquals({'skills': [1]}, self.unit.properties)
+
+        unpickled = pickle.loads(pickle.dumps(view))
+        self.assertIs(Unit13, type(unpickled))
+        self.assertEquals('Renamed', unpickled.title)
+        self.assertEquals({'skills': [1, 2]}, unpickled.properties)
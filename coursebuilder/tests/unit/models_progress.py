@@ -0,0 +1,130 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for models.progress."""
+
+import copy
+import unittest
+
+from models import transforms
+from models.progress import CourseOutlineIndex
+from models.progress import DecodedProgress
+from tools import verify
+
+
+class _FakeProperty(object):
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class _FakeUnit(object):
+
+    def __init__(self, unit_id, unit_type, pre=None, post=None):
+        self.unit_id = unit_id
+        self.type = unit_type
+        self.pre_assessment = pre
+        self.post_assessment = post
+
+
+class _FakeLesson(object):
+
+    def __init__(self, lesson_id, has_activity=False):
+        self.lesson_id = lesson_id
+        self.has_activity = has_activity
+
+
+class _FakeModel(object):
+
+    def __init__(self, units, lessons):
+        self._units = units
+        self._lessons = lessons
+
+    def get_units(self):
+        return self._units
+
+    def get_lessons(self, unit_id):
+        return self._lessons.get(unit_id, [])
+
+
+class DecodedProgressTests(unittest.TestCase):
+
+    def test_decodes_once(self):
+        prop = _FakeProperty(transforms.dumps({'u.1': 2}))
+        decoded = DecodedProgress.of(prop)
+        self.assertEquals(2, decoded.get('u.1'))
+        self.assertIs(decoded, DecodedProgress.of(prop))
+
+    def test_set_and_inc_are_deferred_until_flush(self):
+        prop = _FakeProperty()
+        DecodedProgress.of(prop).set('u.1', 1)
+        DecodedProgress.of(prop).inc('u.1.l.2.b.0')
+        DecodedProgress.of(prop).inc('u.1.l.2.b.0')
+        self.assertIsNone(prop.value)
+        self.assertTrue(DecodedProgress.of(prop).is_dirty)
+
+        DecodedProgress.flush(prop)
+        self.assertEquals(
+            {'u.1': 1, 'u.1.l.2.b.0': 2}, transforms.loads(prop.value))
+        self.assertFalse(DecodedProgress.of(prop).is_dirty)
+
+    def test_setting_same_value_does_not_dirty(self):
+        prop = _FakeProperty(transforms.dumps({'u.1': 2}))
+        DecodedProgress.of(prop).set('u.1', 2)
+        self.assertFalse(DecodedProgress.of(prop).is_dirty)
+
+    def test_external_value_change_is_picked_up(self):
+        prop = _FakeProperty(transforms.dumps({'u.1': 1}))
+        self.assertEquals(1, DecodedProgress.of(prop).get('u.1'))
+        prop.value = transforms.dumps({'u.1': 2})
+        self.assertEquals(2, DecodedProgress.of(prop).get('u.1'))
+
+    def test_copy_does_not_share_decoded_state(self):
+        prop = _FakeProperty(transforms.dumps({'u.1': 1}))
+        DecodedProgress.of(prop).get('u.1')
+        prop_copy = copy.deepcopy(prop)
+        DecodedProgress.of(prop_copy).set('u.1', 2)
+        self.assertEquals(1, DecodedProgress.of(prop).get('u.1'))
+
+
+class CourseOutlineIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = CourseOutlineIndex.build(_FakeModel(
+            [_FakeUnit(1, verify.UNIT_TYPE_UNIT, pre=4, post=5),
+             _FakeUnit(4, verify.UNIT_TYPE_ASSESSMENT),
+             _FakeUnit(5, verify.UNIT_TYPE_ASSESSMENT),
+             _FakeUnit(6, verify.UNIT_TYPE_ASSESSMENT)],
+            {1: [_FakeLesson(2), _FakeLesson(3, has_activity=True)]}))
+
+    def test_unit_and_lesson_keys(self):
+        self.assertEquals('u.1', self.index.find_unit('1').key)
+        self.assertEquals((2, 3), self.index.find_unit(1).lesson_ids)
+        lesson = self.index.find_lesson(1, '3')
+        self.assertEquals('u.1.l.3', lesson.key)
+        self.assertEquals('u.1.l.3.h.0', lesson.html_key)
+        self.assertEquals('u.1.l.3.a.0', lesson.activity_key)
+        self.assertTrue(lesson.has_activity)
+        self.assertEquals(
+            ['u.1.l.2', 'u.1.l.3'],
+            [l.key for l in self.index.get_lessons(1)])
+        self.assertIsNone(self.index.find_lesson(4, 2))
+
+    def test_assessment_keys_include_parent_unit(self):
+        self.assertEquals(1, self.index.get_parent_unit_id(4))
+        self.assertEquals('u.1.s.4', self.index.get_assessment_key(4))
+        self.assertEquals('u.1.s.5', self.index.get_assessment_key('5'))
+        self.assertIsNone(self.index.get_parent_unit_id(6))
+        self.assertEquals('s.6', self.index.get_assessment_key(6))
+        self.assertEquals('s.Fin', self.index.get_assessment_key('Fin'))